@@ -0,0 +1,24 @@
+import asyncio
+from picamera_server import app
+from picamera_server.config.config import SERVER_HOST, SERVER_PORT
+from picamera_server.picamera_server import init_camera_controllers
+from picamera_server.async_server.server import AsyncStreamServer
+
+
+def main():
+    """
+    Init the camera controllers and run the asyncio server.
+    The stream endpoints are served from the event loop and the rest of the Flask app from a thread pool
+
+    :return:
+    """
+    init_camera_controllers()
+    server = AsyncStreamServer(app, SERVER_HOST, SERVER_PORT)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+"""
+    Config shared by the stream load test and the bench server. It doesn't import the app, so the load test client
+    doesn't create the app and its database.
+"""
+
+BENCH_SERVER_FLASK = 'flask'
+BENCH_SERVER_ASYNC = 'async'
+BENCH_SERVERS = [BENCH_SERVER_FLASK, BENCH_SERVER_ASYNC]
+BENCH_SERVER_HOST = '127.0.0.1'
+BENCH_SERVER_PORT = 8090
+# Stream endpoint opened by the load test clients
+BENCH_STREAM_PATH = '/camera/video_frame'
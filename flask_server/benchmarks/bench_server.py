@@ -0,0 +1,36 @@
+"""
+    Server started by the stream load test, runs the app with the camera selected with the CAMERA_CLASS env var
+    and the log in disabled, so the load test clients can open the streams without credentials.
+    It only listens on the loopback interface by default, it must not be used as a regular server.
+"""
+import argparse
+import asyncio
+from picamera_server import app
+from picamera_server.picamera_server import init_camera_controllers
+from picamera_server.async_server.server import AsyncStreamServer
+from benchmarks.bench_config import BENCH_SERVERS, BENCH_SERVER_FLASK, BENCH_SERVER_ASYNC, BENCH_SERVER_HOST,\
+    BENCH_SERVER_PORT
+
+
+def main():
+    """
+    Parse the arguments and run the selected server
+
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Server for the stream load test')
+    parser.add_argument('--server', choices=BENCH_SERVERS, default=BENCH_SERVER_FLASK)
+    parser.add_argument('--host', default=BENCH_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=BENCH_SERVER_PORT)
+    args = parser.parse_args()
+
+    app.config['LOGIN_DISABLED'] = True
+    init_camera_controllers()
+    if args.server == BENCH_SERVER_ASYNC:
+        asyncio.run(AsyncStreamServer(app, args.host, args.port).serve_forever())
+    else:
+        app.run(host=args.host, port=args.port, threaded=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+    main()
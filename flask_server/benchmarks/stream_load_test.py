@@ -0,0 +1,436 @@
+"""
+    Stream load test: opens N concurrent /camera/video_frame connections, parses the multipart streams and reports
+    per client fps, inter-frame latency percentiles and bytes/s, with the CPU and RSS of the server process.
+    The results are written to a JSON file to compare runs.
+
+    By default the server is started in a subprocess with bench_server, with the camera class selected with
+    --camera-class. An already running server can be tested with --url.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlencode
+from benchmarks.bench_config import BENCH_SERVERS, BENCH_SERVER_FLASK, BENCH_SERVER_HOST, BENCH_SERVER_PORT,\
+    BENCH_STREAM_PATH
+
+
+CONTENT_LENGTH_REGEX = re.compile(rb'content-length:\s*(\d+)', re.IGNORECASE)
+PERCENTILES = (50, 90, 99)
+# Seconds to wait for the started server to accept connections
+SERVER_START_TIMEOUT = 30
+# Seconds between the samples of the server CPU and RSS
+SAMPLE_INTERVAL = 1.0
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """
+    Return the percentile of the values, with linear interpolation between the closest ranks
+
+    :param values:
+    :param percent: Percentile between 0 and 100
+    :return: None if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+class ClientStats(object):
+    """
+    Frames received by a stream client
+    """
+
+    def __init__(self, client_id: int):
+        """
+        :param client_id: Number of the client
+        """
+        self.client_id = client_id
+        self.connected_at: Optional[float] = None
+        self.frame_times: List[float] = list()
+        self.bytes_received = 0
+        self.error: Optional[str] = None
+
+    def add_frame(self, received_at: float, frame_bytes: int) -> None:
+        """
+        Count a received frame
+
+        :param received_at: Monotonic time when the frame was received
+        :param frame_bytes: Bytes of the multipart frame
+        :return:
+        """
+        self.frame_times.append(received_at)
+        self.bytes_received += frame_bytes
+
+    def get_intervals(self) -> List[float]:
+        """
+        Return the seconds between consecutive frames
+        :return:
+        """
+        return [current - previous for previous, current in zip(self.frame_times, self.frame_times[1:])]
+
+    def get_summary(self, duration: float) -> dict:
+        """
+        Return the stats of the client
+
+        :param duration: Seconds of the test
+        :return:
+        """
+        intervals = self.get_intervals()
+        summary = {
+            'client': self.client_id,
+            'frames': len(self.frame_times),
+            'fps': len(self.frame_times) / duration if duration else 0,
+            'bytes': self.bytes_received,
+            'bytes_per_second': self.bytes_received / duration if duration else 0,
+            'first_frame_seconds': (self.frame_times[0] - self.connected_at
+                                    if self.frame_times and self.connected_at is not None else None),
+            'interval_max_seconds': max(intervals) if intervals else None,
+            'error': self.error,
+        }
+        for percent in PERCENTILES:
+            summary['interval_p{}_seconds'.format(percent)] = percentile(intervals, percent)
+        return summary
+
+
+async def read_multipart_frame(reader: asyncio.StreamReader) -> int:
+    """
+    Read the next frame of a multipart stream, the frame is read with the Content-Length of its part header
+
+    :param reader:
+    :raises ValueError: When the part header doesn't have a Content-Length
+    :return: Bytes of the multipart frame
+    """
+    header = await reader.readuntil(b'\r\n\r\n')
+    content_length = CONTENT_LENGTH_REGEX.search(header)
+    if not content_length:
+        raise ValueError('Multipart frame without Content-Length')
+    body_length = int(content_length.group(1))
+    # Frame and the trailing CRLF of the part
+    await reader.readexactly(body_length + 2)
+    return len(header) + body_length + 2
+
+
+async def run_client(stats: ClientStats, host: str, port: int, path: str, deadline: float,
+                     headers: Optional[Dict[str, str]] = None) -> None:
+    """
+    Open a stream and read frames until the deadline
+
+    :param stats: Stats of the client
+    :param host:
+    :param port:
+    :param path: Path and query string of the stream
+    :param deadline: Monotonic time to stop reading
+    :param headers: Extra request headers, ex. a session Cookie
+    :return:
+    """
+    writer = None
+    try:
+        stats.connected_at = time.monotonic()
+        reader, writer = await asyncio.open_connection(host, port)
+        request_headers = {'Host': '{}:{}'.format(host, port), 'Connection': 'close'}
+        request_headers.update(headers or {})
+        request = 'GET {} HTTP/1.1\r\n'.format(path)
+        request += ''.join('{}: {}\r\n'.format(name, value) for name, value in request_headers.items())
+        writer.write((request + '\r\n').encode('latin-1'))
+
+        response_head = await reader.readuntil(b'\r\n\r\n')
+        status_line = response_head.split(b'\r\n', 1)[0].decode('latin-1')
+        if ' 200 ' not in status_line + ' ':
+            raise ValueError('Unexpected response {}'.format(status_line))
+
+        while time.monotonic() < deadline:
+            remaining = deadline - time.monotonic()
+            frame_bytes = await asyncio.wait_for(read_multipart_frame(reader), max(remaining, 0.001))
+            stats.add_frame(time.monotonic(), frame_bytes)
+    except asyncio.TimeoutError:
+        pass
+    except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+        stats.error = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if writer:
+            writer.close()
+
+
+async def run_clients(clients: int, host: str, port: int, path: str, duration: float,
+                      headers: Optional[Dict[str, str]] = None, ramp_up: float = 0.0) -> List[ClientStats]:
+    """
+    Run the stream clients concurrently
+
+    :param clients: Number of clients
+    :param host:
+    :param port:
+    :param path: Path and query string of the stream
+    :param duration: Seconds to read frames
+    :param headers: Extra request headers
+    :param ramp_up: Seconds to spread the connection of the clients
+    :return: Stats of each client
+    """
+    stats = [ClientStats(client_id) for client_id in range(clients)]
+    deadline = time.monotonic() + ramp_up + duration
+
+    async def delayed_client(client_stats: ClientStats) -> None:
+        if ramp_up and clients > 1:
+            await asyncio.sleep(ramp_up * client_stats.client_id / (clients - 1))
+        await run_client(client_stats, host, port, path, deadline, headers)
+
+    await asyncio.gather(*(delayed_client(client_stats) for client_stats in stats))
+    return stats
+
+
+class ProcessSampler(object):
+    """
+    Sample the CPU and RSS of a process from /proc, only available in Linux
+    """
+
+    def __init__(self, pid: int):
+        """
+        :param pid: Process id
+        """
+        self.pid = pid
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self.samples: List[dict] = list()
+        self.last_cpu_time: Optional[float] = None
+        self.last_sample_time: Optional[float] = None
+
+    def _read_cpu_and_rss(self) -> Optional[tuple]:
+        """
+        Return the CPU seconds and the RSS bytes of the process
+
+        :return: None if /proc is not available
+        """
+        try:
+            with open('/proc/{}/stat'.format(self.pid)) as stat_file:
+                # The command name can contain spaces, the fields are after the last parenthesis
+                fields = stat_file.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            return None
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        rss_bytes = int(fields[21]) * self.page_size
+        return cpu_seconds, rss_bytes
+
+    def sample(self) -> None:
+        """
+        Take a sample, the CPU percent is measured from the previous sample
+
+        :return:
+        """
+        values = self._read_cpu_and_rss()
+        if values is None:
+            return
+        cpu_seconds, rss_bytes = values
+        now = time.monotonic()
+        if self.last_cpu_time is not None and now > self.last_sample_time:
+            cpu_percent = 100 * (cpu_seconds - self.last_cpu_time) / (now - self.last_sample_time)
+            self.samples.append({'cpu_percent': cpu_percent, 'rss_bytes': rss_bytes})
+        self.last_cpu_time = cpu_seconds
+        self.last_sample_time = now
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """
+        Take samples every SAMPLE_INTERVAL seconds until stop is set
+
+        :param stop:
+        :return:
+        """
+        self.sample()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.sample()
+
+    def get_summary(self) -> dict:
+        """
+        Return the average and max CPU percent and the max RSS
+
+        :return:
+        """
+        cpu = [sample['cpu_percent'] for sample in self.samples]
+        rss = [sample['rss_bytes'] for sample in self.samples]
+        return {
+            'pid': self.pid,
+            'cpu_percent_avg': sum(cpu) / len(cpu) if cpu else None,
+            'cpu_percent_max': max(cpu) if cpu else None,
+            'rss_max_bytes': max(rss) if rss else None,
+            'samples': self.samples,
+        }
+
+
+def summarize(stats: List[ClientStats], duration: float) -> dict:
+    """
+    Return the stats of all the clients together
+
+    :param stats: Stats of each client
+    :param duration: Seconds of the test
+    :return:
+    """
+    intervals = [interval for client_stats in stats for interval in client_stats.get_intervals()]
+    clients_fps = [len(client_stats.frame_times) / duration for client_stats in stats] if duration else []
+    total_bytes = sum(client_stats.bytes_received for client_stats in stats)
+    summary = {
+        'clients': len(stats),
+        'clients_with_errors': sum(1 for client_stats in stats if client_stats.error),
+        'clients_without_frames': sum(1 for client_stats in stats if not client_stats.frame_times),
+        'frames': sum(len(client_stats.frame_times) for client_stats in stats),
+        'fps_per_client_min': min(clients_fps) if clients_fps else None,
+        'fps_per_client_avg': sum(clients_fps) / len(clients_fps) if clients_fps else None,
+        'bytes_per_second': total_bytes / duration if duration else 0,
+        'interval_max_seconds': max(intervals) if intervals else None,
+    }
+    for percent in PERCENTILES:
+        summary['interval_p{}_seconds'.format(percent)] = percentile(intervals, percent)
+    return summary
+
+
+def wait_for_server(host: str, port: int, timeout: float = SERVER_START_TIMEOUT) -> None:
+    """
+    Wait until the server accepts connections
+
+    :param host:
+    :param port:
+    :param timeout: Max seconds to wait
+    :raises TimeoutError: If the server doesn't accept connections in time
+    :return:
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError('The server {}:{} is not accepting connections'.format(host, port))
+
+
+def start_server(server: str, camera_class: str, port: int) -> subprocess.Popen:
+    """
+    Start the bench server in a subprocess
+
+    :param server: Server type, flask or async
+    :param camera_class: CAMERA_CLASS of the server
+    :param port:
+    :return:
+    """
+    env = dict(os.environ)
+    if camera_class:
+        env['CAMERA_CLASS'] = camera_class
+    server_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_server',
+                             '--server', server, '--port', str(port)],
+                            cwd=server_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def run_load_test(clients: int, duration: float, host: str, port: int, path: str,
+                        headers: Optional[Dict[str, str]] = None, server_pid: Optional[int] = None,
+                        ramp_up: float = 0.0) -> dict:
+    """
+    Run the clients and sample the server process
+
+    :param clients: Number of clients
+    :param duration: Seconds to read frames
+    :param host:
+    :param port:
+    :param path: Path and query string of the stream
+    :param headers: Extra request headers
+    :param server_pid: Process id of the server to sample, None to not sample
+    :param ramp_up: Seconds to spread the connection of the clients
+    :return: Results of the load test
+    """
+    sampler = ProcessSampler(server_pid) if server_pid else None
+    stop_sampler = asyncio.Event()
+    sampler_task = asyncio.ensure_future(sampler.run(stop_sampler)) if sampler else None
+
+    stats = await run_clients(clients, host, port, path, duration, headers, ramp_up)
+
+    stop_sampler.set()
+    if sampler_task:
+        await sampler_task
+
+    return {
+        'summary': summarize(stats, duration),
+        'clients': [client_stats.get_summary(duration) for client_stats in stats],
+        'server': sampler.get_summary() if sampler else None,
+    }
+
+
+def main():
+    """
+    Parse the arguments, run the load test and write the results
+
+    :return:
+    """
+    parser = argparse.ArgumentParser(description='Concurrent stream load test')
+    parser.add_argument('--clients', type=int, default=10, help='Number of concurrent streams')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to read frames')
+    parser.add_argument('--ramp-up', type=float, default=0, help='Seconds to spread the connection of the clients')
+    parser.add_argument('--camera-class', default='replay', help='CAMERA_CLASS of the started server')
+    parser.add_argument('--server', choices=BENCH_SERVERS, default=BENCH_SERVER_FLASK,
+                        help='Server started for the test')
+    parser.add_argument('--port', type=int, default=BENCH_SERVER_PORT, help='Port of the started server')
+    parser.add_argument('--url', help='Stream URL of a running server, the server is not started')
+    parser.add_argument('--server-pid', type=int, help='Process id of the running server to sample')
+    parser.add_argument('--cookie', help='Cookie header for a running server with log in')
+    parser.add_argument('--fps', type=float, help='fps query argument of the streams')
+    parser.add_argument('--width', type=int, help='w query argument of the streams')
+    parser.add_argument('--quality', type=int, help='q query argument of the streams')
+    parser.add_argument('--output', default='stream_load_test.json', help='JSON file of the results')
+    args = parser.parse_args()
+
+    query = urlencode({name: value for name, value in [('fps', args.fps), ('w', args.width), ('q', args.quality)]
+                       if value is not None})
+    server_process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port, path = url.hostname, url.port or 80, url.path or BENCH_STREAM_PATH
+        if url.query or query:
+            path += '?' + (url.query or query)
+        server_pid = args.server_pid
+    else:
+        host, port, path = BENCH_SERVER_HOST, args.port, BENCH_STREAM_PATH + ('?' + query if query else '')
+        server_process = start_server(args.server, args.camera_class, port)
+        server_pid = server_process.pid
+
+    headers = {'Cookie': args.cookie} if args.cookie else None
+    try:
+        wait_for_server(host, port)
+        results = asyncio.run(run_load_test(args.clients, args.duration, host, port, path, headers, server_pid,
+                                            args.ramp_up))
+    finally:
+        if server_process:
+            server_process.terminate()
+            server_process.wait(timeout=10)
+
+    results['config'] = {
+        'clients': args.clients,
+        'duration': args.duration,
+        'ramp_up': args.ramp_up,
+        'camera_class': None if args.url else args.camera_class,
+        'server': None if args.url else args.server,
+        'url': 'http://{}:{}{}'.format(host, port, path),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+
+    summary = results['summary']
+    print('{} clients, {} frames, {:.1f} fps per client (min {:.1f}), {:.0f} bytes/s, p99 interval {}'.format(
+        summary['clients'], summary['frames'], summary['fps_per_client_avg'] or 0, summary['fps_per_client_min'] or 0,
+        summary['bytes_per_second'], summary['interval_p99_seconds']))
+    print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 from flask_login import LoginManager
 from picamera_server.picamera_server import create_app, register_blueprints
-from picamera_server.config.database import config_database
+from picamera_server.config.database import config_database, migrate_database
 from picamera_server.config.config import APP_ENV
 from picamera_server.config.login_manager import init_login_manager
 
@@ -13,6 +13,7 @@ login_manager.init_app(app)
 import picamera_server.models
 
 db.create_all()
+migrate_database(db)
 
 register_blueprints(app)
 login_manager = init_login_manager(login_manager)
@@ -0,0 +1,4 @@
+"""
+    Asyncio server, serves the stream endpoints from an event loop so every stream client costs a coroutine instead
+    of a WSGI worker thread. The rest of the requests are run by the Flask app in a thread pool.
+"""
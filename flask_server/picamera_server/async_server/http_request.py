@@ -0,0 +1,161 @@
+"""
+    Minimal HTTP/1.1 request parsing for the asyncio server, and the WSGI environ of the parsed requests.
+"""
+import io
+import sys
+from email.utils import formatdate
+from typing import List, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+
+
+HEAD_END = b'\r\n\r\n'
+HTTP_1_0 = 'HTTP/1.0'
+HTTP_1_1 = 'HTTP/1.1'
+
+STATUS_BAD_REQUEST = '400 Bad Request'
+STATUS_PAYLOAD_TOO_LARGE = '413 Payload Too Large'
+STATUS_HEADERS_TOO_LARGE = '431 Request Header Fields Too Large'
+STATUS_NOT_IMPLEMENTED = '501 Not Implemented'
+
+
+class HttpRequest(object):
+    """
+    Request line and headers of an HTTP request
+    """
+
+    def __init__(self, method: str, target: str, version: str, headers: List[Tuple[str, str]]):
+        """
+        :param method: Request method, ex. 'GET'
+        :param target: Request target, path and query string
+        :param version: HTTP version, 'HTTP/1.0' or 'HTTP/1.1'
+        :param headers: List of (name, value) of the request headers
+        """
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers
+
+    @staticmethod
+    def parse(head: bytes) -> 'HttpRequest':
+        """
+        Parse the request line and headers of a request
+
+        :param head: Request line and headers, ending with an empty line
+        :raises ValueError: When the request is malformed or the HTTP version is not supported
+        :return:
+        """
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        if version not in (HTTP_1_0, HTTP_1_1) or not target.startswith('/'):
+            raise ValueError('Invalid request line {}'.format(lines[0]))
+
+        headers = list()
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, separator, value = line.partition(':')
+            if not separator or not name or name != name.strip():
+                raise ValueError('Invalid header line {}'.format(line))
+            headers.append((name, value.strip()))
+
+        return HttpRequest(method, target, version, headers)
+
+    def get_header(self, name: str) -> Optional[str]:
+        """
+        Return the value of a header, the values of repeated headers are joined with commas
+
+        :param name: Header name, case insensitive
+        :return: Header value, None if the header is not in the request
+        """
+        values = [value for header, value in self.headers if header.lower() == name.lower()]
+        return ','.join(values) if values else None
+
+    @property
+    def content_length(self) -> int:
+        """
+        Length of the request body
+        :raises ValueError: When the Content-Length header is not a valid length
+        :return:
+        """
+        content_length = self.get_header('Content-Length')
+        if content_length is None:
+            return 0
+        if not content_length.isdigit():
+            raise ValueError('Invalid Content-Length {}'.format(content_length))
+        return int(content_length)
+
+    @property
+    def keep_alive(self) -> bool:
+        """
+        Return if the client wants to keep the connection open after the response
+        :return:
+        """
+        connection = (self.get_header('Connection') or '').lower()
+        if self.version == HTTP_1_1:
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+    def get_environ(self, body: bytes, server_address: Tuple, peer_address: Tuple) -> dict:
+        """
+        Return the WSGI environ of the request
+
+        :param body: Request body
+        :param server_address: Address of the server socket
+        :param peer_address: Address of the client socket
+        :return:
+        """
+        path, _, query_string = self.target.partition('?')
+        environ = {
+            'REQUEST_METHOD': self.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query_string,
+            'SERVER_NAME': str(server_address[0]),
+            'SERVER_PORT': str(server_address[1]),
+            'SERVER_PROTOCOL': self.version,
+            'REMOTE_ADDR': str(peer_address[0]) if peer_address else '',
+            'REMOTE_PORT': str(peer_address[1]) if peer_address else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in self.headers:
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = environ[key] + ',' + value if key in environ else value
+
+        return environ
+
+
+def get_response_head(status: str, headers: List[Tuple[str, str]]) -> bytes:
+    """
+    Return the status line and headers of a response, the Date header is added
+
+    :param status: Status of the response, ex. '200 OK'
+    :param headers: List of (name, value) of the response headers
+    :return:
+    """
+    lines = ['{} {}'.format(HTTP_1_1, status)]
+    lines.extend('{}: {}'.format(name, value) for name, value in headers)
+    lines.append('Date: {}'.format(formatdate(usegmt=True)))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def get_error_response(status: str) -> bytes:
+    """
+    Return a plain text error response that closes the connection, used for the requests that can't be parsed
+
+    :param status: Status of the response, ex. '400 Bad Request'
+    :return:
+    """
+    body = status.encode('latin-1')
+    head = get_response_head(status, [('Content-Type', 'text/plain'),
+                                      ('Content-Length', str(len(body))),
+                                      ('Connection', 'close')])
+    return head + body
@@ -0,0 +1,221 @@
+"""
+    Asyncio HTTP server. The stream endpoints are served by coroutines and the rest of the requests by the Flask app,
+    run in a thread pool, so the HTML pages and the streams share the same app and camera controller.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+from picamera_server.config.config import SERVER_HOST, SERVER_PORT, ASYNC_SERVER_WSGI_THREADS,\
+    ASYNC_SERVER_KEEP_ALIVE_TIMEOUT, ASYNC_SERVER_MAX_HEADER_SIZE, ASYNC_SERVER_MAX_BODY_SIZE
+from picamera_server.camera.frame_broadcaster import FrameBroadcaster
+from picamera_server.async_server.http_request import HttpRequest, HEAD_END, HTTP_1_0, STATUS_BAD_REQUEST,\
+    STATUS_HEADERS_TOO_LARGE, STATUS_PAYLOAD_TOO_LARGE, STATUS_NOT_IMPLEMENTED, get_error_response, get_response_head
+from picamera_server.async_server.video_stream import AsyncFrameWaiter, STREAM_ENDPOINTS, get_video_stream,\
+    stream_video_frames
+from picamera_server.async_server.wsgi_bridge import WSGIResponse
+
+
+class AsyncStreamServer(object):
+    """
+    HTTP/1.1 server running in an asyncio event loop.
+    An open stream costs one coroutine, the WSGI threads are only used by the requests of the Flask app
+    """
+
+    def __init__(self, app: Flask, host: str = SERVER_HOST, port: int = SERVER_PORT,
+                 wsgi_threads: int = ASYNC_SERVER_WSGI_THREADS):
+        """
+        :param app: Flask app
+        :param host: Host to listen on
+        :param port: Port to listen on, 0 to use a free port
+        :param wsgi_threads: Number of threads used to run the Flask app
+        """
+        self.app = app
+        self.host = host
+        self.port = int(port)
+        self.executor = ThreadPoolExecutor(max_workers=wsgi_threads, thread_name_prefix='async-server-wsgi')
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Set[asyncio.Task] = set()
+        self.frame_waiters: Dict[FrameBroadcaster, AsyncFrameWaiter] = dict()
+
+    async def start(self) -> None:
+        """
+        Start listening, the port attribute is updated with the port of the socket
+
+        :return:
+        """
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                 limit=ASYNC_SERVER_MAX_HEADER_SIZE)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.app.logger.info('Async stream server listening on {}:{}'.format(self.host, self.port))
+
+    async def serve_forever(self) -> None:
+        """
+        Start the server and serve until the task is cancelled
+
+        :return:
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        """
+        Stop listening, close the open connections and release the broadcasters listeners
+
+        :return:
+        """
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for connection in self.connections:
+            connection.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        for waiter in self.frame_waiters.values():
+            waiter.close()
+        self.frame_waiters.clear()
+        self.executor.shutdown(wait=False)
+
+    def _get_frame_waiter(self, broadcaster: FrameBroadcaster) -> AsyncFrameWaiter:
+        """
+        Return the frame waiter of a broadcaster, created with the first stream of the broadcaster
+
+        :param broadcaster:
+        :return:
+        """
+        if broadcaster not in self.frame_waiters:
+            self.frame_waiters[broadcaster] = AsyncFrameWaiter(broadcaster, asyncio.get_running_loop())
+        return self.frame_waiters[broadcaster]
+
+    def _is_stream_endpoint(self, environ: dict) -> bool:
+        """
+        Return if the request is for an endpoint served by the stream coroutines
+
+        :param environ: WSGI environ of the request
+        :return:
+        """
+        if environ['REQUEST_METHOD'] != 'GET':
+            return False
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return False
+        return endpoint in STREAM_ENDPOINTS
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve the requests of a connection until the client or the server closes it
+
+        :param reader:
+        :param writer:
+        :return:
+        """
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            while await self.handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.app.logger.exception('Exception in async server connection {}'.format(e))
+        finally:
+            self.connections.discard(connection)
+            writer.close()
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """
+        Read a request and send its response
+
+        :param reader:
+        :param writer:
+        :return: True if the connection can be used for another request
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(HEAD_END), ASYNC_SERVER_KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return False
+        except asyncio.LimitOverrunError:
+            await self._send_error(writer, STATUS_HEADERS_TOO_LARGE)
+            return False
+
+        try:
+            request = HttpRequest.parse(head)
+            content_length = request.content_length
+        except ValueError:
+            await self._send_error(writer, STATUS_BAD_REQUEST)
+            return False
+
+        if request.get_header('Transfer-Encoding'):
+            await self._send_error(writer, STATUS_NOT_IMPLEMENTED)
+            return False
+        if content_length > ASYNC_SERVER_MAX_BODY_SIZE:
+            await self._send_error(writer, STATUS_PAYLOAD_TOO_LARGE)
+            return False
+
+        body = await reader.readexactly(content_length) if content_length else b''
+        environ = request.get_environ(body, writer.get_extra_info('sockname'), writer.get_extra_info('peername'))
+
+        if self._is_stream_endpoint(environ):
+            loop = asyncio.get_running_loop()
+            stream = await loop.run_in_executor(self.executor, get_video_stream, self.app, environ)
+            if stream:
+                broadcaster, fps, width, quality = stream
+                await stream_video_frames(reader, writer, self._get_frame_waiter(broadcaster), self.executor,
+                                          fps, width, quality, environ['REMOTE_ADDR'])
+                return False
+
+        return await self._send_wsgi_response(request, environ, writer)
+
+    @staticmethod
+    async def _send_error(writer: asyncio.StreamWriter, status: str) -> None:
+        """
+        Send an error response for a request that can't be handled
+
+        :param writer:
+        :param status:
+        :return:
+        """
+        writer.write(get_error_response(status))
+        await writer.drain()
+
+    async def _send_wsgi_response(self, request: HttpRequest, environ: dict, writer: asyncio.StreamWriter) -> bool:
+        """
+        Run the request in the Flask app and send its response.
+        Responses without Content-Length are sent with chunked transfer encoding to keep the connection alive
+
+        :param request:
+        :param environ:
+        :param writer:
+        :return: True if the connection can be used for another request
+        """
+        response = WSGIResponse(self.app, environ, self.executor)
+        try:
+            await response.start()
+            headers = [(name, value) for name, value in response.headers if name.lower() != 'connection']
+            has_length = any(name.lower() == 'content-length' for name, _ in headers)
+            keep_alive = request.keep_alive and (has_length or request.version != HTTP_1_0)
+            chunked = keep_alive and not has_length
+            if chunked:
+                headers.append(('Transfer-Encoding', 'chunked'))
+            headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+
+            writer.write(get_response_head(response.status, headers))
+            async for chunk in response.chunks():
+                if request.method == 'HEAD' or not chunk:
+                    continue
+                if chunked:
+                    writer.writelines((b'%x\r\n' % len(chunk), chunk, b'\r\n'))
+                else:
+                    writer.write(chunk)
+                await writer.drain()
+            if chunked and request.method != 'HEAD':
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            await response.close()
+
+        return keep_alive
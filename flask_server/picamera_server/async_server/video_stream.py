@@ -0,0 +1,185 @@
+"""
+    Stream of the camera frames from the event loop.
+    Every stream client is a coroutine that waits for the frames published by the frame broadcaster.
+"""
+import asyncio
+from concurrent.futures import Executor
+from typing import Optional, Tuple
+from flask import Flask, request
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+from picamera_server.camera.base_camera import FramePacer
+from picamera_server.camera.frame_mailbox import FrameMailbox, MailboxFrame
+from picamera_server.metrics.camera_metrics import STREAM_FRAMES_SENT, STREAM_BYTES_SENT
+from picamera_server.camera.frame_broadcaster import FrameBroadcaster
+from picamera_server.async_server.http_request import get_response_head
+from picamera_server.views.camera_view import MIME_TYPE_MULTIPART_FRAME, get_video_frame_arguments,\
+    get_camera_frame_broadcaster
+
+
+# Endpoints served by the stream coroutines, the rest of the endpoints are served by the Flask app
+STREAM_ENDPOINTS = {'camera.video_frame'}
+
+# Headers of the stream responses, the Date header is added to every response
+STREAM_RESPONSE_HEADERS = [('Content-Type', MIME_TYPE_MULTIPART_FRAME),
+                           ('Cache-Control', 'no-cache, private'),
+                           ('Connection', 'close')]
+
+# Stream of a broadcaster requested by a client: broadcaster, fps, width and quality
+VideoStream = Tuple[FrameBroadcaster, Optional[float], Optional[int], Optional[int]]
+
+
+class AsyncFrameWaiter(object):
+    """
+    Wake up the stream coroutines of a frame broadcaster when a new frame is published.
+    Only one listener is added to the broadcaster, the producer thread schedules one wake up in the event loop per
+    frame and all the coroutines waiting on the current event are released.
+    """
+
+    def __init__(self, broadcaster: FrameBroadcaster, loop: asyncio.AbstractEventLoop):
+        """
+        Must be created from the event loop
+
+        :param broadcaster: Frame broadcaster of the stream
+        :param loop: Event loop of the stream coroutines
+        """
+        self.broadcaster = broadcaster
+        self.loop = loop
+        self.new_frame = asyncio.Event()
+        self.broadcaster.add_listener(self._on_frame_published)
+
+    def _on_frame_published(self) -> None:
+        """
+        Broadcaster listener, called from the producer thread
+
+        :return:
+        """
+        try:
+            self.loop.call_soon_threadsafe(self._wake_up)
+        except RuntimeError:
+            # The event loop is closed
+            pass
+
+    def _wake_up(self) -> None:
+        """
+        Release the coroutines waiting for a frame, a new event is used for the next frame
+
+        :return:
+        """
+        new_frame, self.new_frame = self.new_frame, asyncio.Event()
+        new_frame.set()
+
+    async def wait_for_frame(self, mailbox: FrameMailbox) -> MailboxFrame:
+        """
+        Wait until a frame is delivered to the mailbox of a client and take it
+
+        :param mailbox: Mailbox of the client
+        :return: Sequence, frame and multipart frame of the newest frame
+        """
+        while True:
+            # The event is taken before the mailbox, a frame published after the take wakes up this event
+            new_frame = self.new_frame
+            frame = mailbox.take()
+            if frame is not None:
+                return frame
+            await new_frame.wait()
+
+    def close(self) -> None:
+        """
+        Remove the broadcaster listener
+
+        :return:
+        """
+        self.broadcaster.remove_listener(self._on_frame_published)
+
+
+def get_video_stream(app: Flask, environ: dict) -> Optional[VideoStream]:
+    """
+    Check the stream request with the same rules as the video_frame view: the user must be logged in, the camera
+    must exist and the query arguments must be valid. Runs the Flask request context, so it must be called from a
+    worker thread
+
+    :param app: Flask app
+    :param environ: WSGI environ of the request
+    :return: The requested stream, None if the request must be answered by the Flask app (login redirect or error)
+    """
+    with app.request_context(environ):
+        if not (app.config.get('LOGIN_DISABLED') or current_user.is_authenticated):
+            return None
+        try:
+            broadcaster = get_camera_frame_broadcaster(request.view_args.get('camera_id'))
+            fps, width, quality = get_video_frame_arguments()
+        except HTTPException:
+            return None
+        return broadcaster, fps, width, quality
+
+
+async def _wait_for_disconnect(reader: asyncio.StreamReader) -> None:
+    """
+    Wait until the client closes the connection, anything sent by the client is discarded
+
+    :param reader:
+    :return:
+    """
+    try:
+        while await reader.read(4096):
+            pass
+    except ConnectionError:
+        pass
+
+
+async def stream_video_frames(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, waiter: AsyncFrameWaiter,
+                              executor: Executor, fps: Optional[float] = None, width: Optional[int] = None,
+                              quality: Optional[int] = None, client: str = '') -> None:
+    """
+    Send the multipart response of frames of a stream client until the client disconnects.
+    A slow client waits in drain and takes the newest frame of its mailbox when it catches up.
+    The renditions are encoded in the executor
+
+    :param reader: Reader of the client connection
+    :param writer: Writer of the client connection
+    :param waiter: Frame waiter of the broadcaster of the stream
+    :param executor: Executor used to encode the renditions
+    :param fps: Target frames per second of the stream, STREAM_MAX_FPS by default
+    :param width: Width of the rendition, None to keep the camera width
+    :param quality: JPEG quality of the rendition, None to send the camera frames
+    :param client: Description of the client, ex. the remote address
+    :return:
+    """
+    loop = asyncio.get_running_loop()
+    broadcaster = waiter.broadcaster
+    pacer = FramePacer(fps)
+    rendition = broadcaster.acquire_rendition(width, quality)
+    mailbox = broadcaster.subscribe(client)
+
+    # Stop waiting for frames as soon as the client disconnects
+    stream_task = asyncio.current_task()
+    disconnect = loop.create_task(_wait_for_disconnect(reader))
+
+    def cancel_stream(_: asyncio.Task) -> None:
+        stream_task.cancel()
+
+    disconnect.add_done_callback(cancel_stream)
+    try:
+        writer.write(get_response_head('200 OK', STREAM_RESPONSE_HEADERS))
+        while True:
+            delay = pacer.delay()
+            if delay:
+                await asyncio.sleep(delay)
+            _, frame, multipart_frame = await waiter.wait_for_frame(mailbox)
+            if rendition:
+                multipart_frame = await loop.run_in_executor(executor, rendition.get_multipart_frame, frame)
+            mailbox.set_sending(True)
+            writer.writelines(multipart_frame)
+            await writer.drain()
+            mailbox.set_sending(False)
+            STREAM_FRAMES_SENT.inc()
+            STREAM_BYTES_SENT.inc(sum(map(len, multipart_frame)))
+    except asyncio.CancelledError:
+        if not disconnect.done() or disconnect.cancelled():
+            raise
+    finally:
+        disconnect.remove_done_callback(cancel_stream)
+        disconnect.cancel()
+        broadcaster.unsubscribe(mailbox)
+        broadcaster.release_rendition(rendition)
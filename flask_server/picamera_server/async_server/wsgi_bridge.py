@@ -0,0 +1,93 @@
+"""
+    Run a WSGI app from the asyncio server, the app and the iteration of its response run in a thread pool so the
+    event loop is never blocked by a view.
+"""
+import asyncio
+from concurrent.futures import Executor
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+from flask import Flask
+
+
+class WSGIResponse(object):
+    """
+    Response of a WSGI app call.
+    The app is called in the executor with start, then the chunks of the body are read one by one in the executor
+    """
+
+    def __init__(self, app: Flask, environ: dict, executor: Executor):
+        """
+        :param app: WSGI app
+        :param environ: WSGI environ of the request
+        :param executor: Executor used to run the app
+        """
+        self.app = app
+        self.environ = environ
+        self.executor = executor
+        self.status = ''
+        self.headers: List[Tuple[str, str]] = list()
+        self.app_iter = None
+        self.iterator: Optional[Iterator[bytes]] = None
+        self.first_chunk: Optional[bytes] = None
+        # Chunks written with the write callable returned by start_response
+        self.written: List[bytes] = list()
+
+    def _start_response(self, status: str, headers: List[Tuple[str, str]], exc_info=None):
+        """
+        WSGI start_response callable
+
+        :param status:
+        :param headers:
+        :param exc_info:
+        :return: write callable
+        """
+        if exc_info and self.status:
+            raise exc_info[1].with_traceback(exc_info[2])
+        self.status = status
+        self.headers = headers
+        return self.written.append
+
+    def _call_app(self) -> None:
+        """
+        Call the app and read the first chunk of the body, the app can delay start_response until the first chunk
+
+        :return:
+        """
+        self.app_iter = self.app(self.environ, self._start_response)
+        self.iterator = iter(self.app_iter)
+        self.first_chunk = next(self.iterator, None)
+
+    async def start(self) -> None:
+        """
+        Call the app in the executor, after this the status and headers are set
+
+        :return:
+        """
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._call_app)
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """
+        Chunks of the response body
+
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        for chunk in self.written:
+            yield chunk
+        if self.first_chunk is None:
+            return
+        yield self.first_chunk
+
+        while True:
+            chunk = await loop.run_in_executor(self.executor, next, self.iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def close(self) -> None:
+        """
+        Close the app response, required by WSGI to release the request resources
+
+        :return:
+        """
+        if hasattr(self.app_iter, 'close'):
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.app_iter.close)
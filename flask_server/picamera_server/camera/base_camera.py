@@ -1,4 +1,46 @@
-from typing import Iterator
+import time
+from typing import Iterator, Optional, Tuple
+from picamera_server.config.config import STREAM_MAX_FPS
+
+
+class FramePacer(object):
+    """
+    Keep the pace of a frames loop to a target fps, sleeping the time left until the next frame is due
+    """
+
+    def __init__(self, fps: Optional[float] = None):
+        """
+        :param fps: Target frames per second, limited to STREAM_MAX_FPS
+        """
+        fps = min(fps, STREAM_MAX_FPS) if fps else STREAM_MAX_FPS
+        self.interval = 1.0 / fps
+        self.next_frame_time = 0.0
+
+    def delay(self) -> float:
+        """
+        Return the seconds left until the next frame is due, and schedule the following one
+        :return:
+        """
+        now = time.monotonic()
+        delay = max(self.next_frame_time - now, 0.0)
+        self.next_frame_time = now + delay + self.interval
+        return delay
+
+    def wait(self) -> None:
+        """
+        Sleep until the next frame is due
+        :return:
+        """
+        delay = self.delay()
+        if delay:
+            time.sleep(delay)
+
+
+# Parts of a multipart frame: header, frame and trailer
+MultipartFrame = Tuple[bytes, bytes, bytes]
+
+MULTIPART_FRAME_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+MULTIPART_FRAME_TRAILER = b'\r\n'
 
 
 class Camera(object):
@@ -14,22 +56,50 @@ class Camera(object):
         """
         return b''
 
+    def get_still_frame(self) -> bytes:
+        """
+        Return a dedicated full resolution capture from the camera, by default the same as get_frame
+        :return:
+        """
+        return self.get_frame()
+
+    @staticmethod
+    def _get_multipart_frame(frame: bytes) -> MultipartFrame:
+        """
+        Frame returned as the parts of a frame of a multipart response: the header with the Content-Length of
+        the frame, the frame and the trailer. The parts are sent as separated chunks so the frame is never copied
+
+        :param frame:
+        :return: header, frame and trailer of the multipart frame
+        """
+        return MULTIPART_FRAME_HEADER % len(frame), frame, MULTIPART_FRAME_TRAILER
+
     @staticmethod
-    def _get_multipart_frame(frame: bytes):
+    def _is_same_frame(frame: bytes, last_frame: Optional[bytes]) -> bool:
         """
-        Frame returned as a frame of a multipart response
+        Return if the frame is the same as the last one, the identity is checked first to avoid comparing the content
+        when the camera returns the same cached frame
 
         :param frame:
+        :param last_frame:
         :return:
         """
-        return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n'
+        return frame is last_frame or frame == last_frame
 
-    def frames_generator(self) -> Iterator[bytes]:
+    def frames_generator(self, fps: Optional[float] = None) -> Iterator[bytes]:
         """
-        Generator used to create the multipart responses of frames
+        Generator used to create the multipart responses of frames.
+        The frames are sent at most at fps frames per second, a frame equal to the last one sent is skipped
 
-        :return: --frame (image/jpeg) part of a multipart response
+        :param fps: Target frames per second of the stream, STREAM_MAX_FPS by default
+        :return: Chunks of the --frame (image/jpeg) parts of a multipart response
         """
+        pacer = FramePacer(fps)
+        last_frame = None
         while True:
+            pacer.wait()
             frame = self.get_frame()
-            yield self._get_multipart_frame(frame)
+            if self._is_same_frame(frame, last_frame):
+                continue
+            last_frame = frame
+            yield from self._get_multipart_frame(frame)
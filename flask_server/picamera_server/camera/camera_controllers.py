@@ -1,23 +1,130 @@
-from typing import Union
+import re
+from typing import Dict, List, Optional, Tuple, Union
+from picamera_server.config.config import CAMERA_CLASS_NAME, CAMERA_CLASS_PI, CAMERA_CLASS_TEST, CAMERA_CLASS_REPLAY,\
+    CAMERA_CLASS_SYNTHETIC, CAMERAS, DEFAULT_CAMERA_ID
+from picamera_server.camera.base_camera import Camera
 from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.replay_camera import ReplayCamera
+from picamera_server.camera.synthetic_camera import SyntheticCamera
 from picamera_server.camera.pi_camera import PiCamera, PI_CAMERA_IMPORTED
+from picamera_server.camera.frame_broadcaster import FrameBroadcaster
+from picamera_server.camera.renditions import RenditionCache
+from picamera_server.metrics.camera_metrics import STREAM_CLIENTS
+from picamera_server.views.helpers.singleton import Singleton
 
-# Define the Camera class based on the fact if picamera has been imported
-CAMERA_CLASS = PiCamera if PI_CAMERA_IMPORTED else TestCamera
+# Type of the camera classes
+CameraClass = Union[type(TestCamera), type(PiCamera), type(ReplayCamera), type(SyntheticCamera)]
 
-CAMERA_CONTROLLER = None
+CAMERA_CLASSES = {
+    CAMERA_CLASS_PI: PiCamera,
+    CAMERA_CLASS_TEST: TestCamera,
+    CAMERA_CLASS_REPLAY: ReplayCamera,
+    CAMERA_CLASS_SYNTHETIC: SyntheticCamera,
+}
 
 
-def init_camera_controller():
+def get_camera_class_by_name(name: str) -> CameraClass:
     """
-    Init the camera controller. Should be run only once
+    Return the camera class of a CAMERA_CLASS option, an empty name selects PiCamera if picamera has been imported
+    and TestCamera otherwise
+
+    :param name: Camera class option, ex. 'replay'
+    :raises ValueError: If the name is not a camera class option
     :return:
     """
-    global CAMERA_CONTROLLER
-    CAMERA_CONTROLLER = CAMERA_CLASS()
+    if not name:
+        return PiCamera if PI_CAMERA_IMPORTED else TestCamera
+    if name not in CAMERA_CLASSES:
+        raise ValueError('Invalid camera class {}, options: {}'.format(name, list(CAMERA_CLASSES)))
+    return CAMERA_CLASSES[name]
+
+
+# Define the Camera class based on the CAMERA_CLASS env var or the fact if picamera has been imported
+CAMERA_CLASS = get_camera_class_by_name(CAMERA_CLASS_NAME)
+
+# Camera of the cameras config: camera id, camera class option and source
+CameraConfig = Tuple[str, str, str]
+
+CAMERA_ID_REGEX = re.compile(r'^[A-Za-z0-9_-]+$')
+
+# Camera controllers and frame broadcasters keyed by camera id, in the order of the cameras config
+CAMERA_CONTROLLERS: Dict[str, Camera] = dict()
+FRAME_BROADCASTERS: Dict[str, FrameBroadcaster] = dict()
+DEFAULT_CAMERA: Optional[str] = None
+
+
+def parse_cameras_config(cameras: str) -> List[CameraConfig]:
+    """
+    Parse a CAMERAS config, a comma separated list of id:class[:source]
+
+    :param cameras: Ex. 'main:pi,door:replay:/media/door.mjpeg'
+    :raises ValueError: If a camera is not valid, a camera id is repeated, or a camera class with only one instance,
+        a Singleton like the pi camera, is repeated
+    :return: Id, camera class option and source of every camera, empty source if not defined
+    """
+    cameras_config = list()
+    for camera in filter(None, (camera.strip() for camera in cameras.split(','))):
+        camera_id, _, class_and_source = camera.partition(':')
+        class_name, _, source = class_and_source.partition(':')
+        if not CAMERA_ID_REGEX.match(camera_id):
+            raise ValueError('Invalid camera id {}, only letters, digits, _ and - are allowed'.format(camera_id))
+        if camera_id in [camera_config[0] for camera_config in cameras_config]:
+            raise ValueError('Repeated camera id {}'.format(camera_id))
+        if not class_name:
+            raise ValueError('Camera {} without camera class'.format(camera_id))
+        camera_class = get_camera_class_by_name(class_name)
+        if isinstance(camera_class, Singleton) and class_name in [camera_config[1] for camera_config in cameras_config]:
+            raise ValueError('Camera {} repeats the camera class {}, it has only one instance'.format(camera_id,
+                                                                                                   class_name))
+        if source and class_name != CAMERA_CLASS_REPLAY:
+            raise ValueError('Camera {} has a source, only the {} cameras have one'.format(camera_id,
+                                                                                           CAMERA_CLASS_REPLAY))
+        cameras_config.append((camera_id, class_name, source))
+    return cameras_config
 
 
-def set_camera_class(camera_class: Union[type(TestCamera), type(PiCamera)]) -> None:
+def create_camera(class_name: str, source: str = '') -> Camera:
+    """
+    Create the camera of a camera config
+
+    :param class_name: Camera class option, empty to use the CAMERA_CLASS
+    :param source: Source of a replay camera, empty to use the REPLAY_CAMERA_SOURCE
+    :return:
+    """
+    camera_class = get_camera_class_by_name(class_name) if class_name else CAMERA_CLASS
+    if source:
+        return camera_class(source=source)
+    return camera_class()
+
+
+def init_camera_controller(cameras: Optional[List[CameraConfig]] = None) -> None:
+    """
+    Init the camera controllers and their frame broadcasters, every camera has its own producer thread.
+    Should be run only once
+
+    :param cameras: Cameras to init, by default the CAMERAS config or one camera with the DEFAULT_CAMERA_ID and the
+        CAMERA_CLASS if it's empty
+    :return:
+    """
+    global DEFAULT_CAMERA
+    if cameras is None:
+        cameras = parse_cameras_config(CAMERAS) or [(DEFAULT_CAMERA_ID, '', '')]
+
+    # The cameras are singletons, stop the old producers so they don't keep capturing them
+    for broadcaster in FRAME_BROADCASTERS.values():
+        broadcaster.stop()
+    CAMERA_CONTROLLERS.clear()
+    FRAME_BROADCASTERS.clear()
+    for camera_id, class_name, source in cameras:
+        CAMERA_CONTROLLERS[camera_id] = create_camera(class_name, source)
+        FRAME_BROADCASTERS[camera_id] = FrameBroadcaster(CAMERA_CONTROLLERS[camera_id], RenditionCache(), camera_id)
+
+    camera_ids = get_camera_ids()
+    DEFAULT_CAMERA = DEFAULT_CAMERA_ID if DEFAULT_CAMERA_ID in camera_ids else camera_ids[0]
+    STREAM_CLIENTS.set_function(lambda: sum(broadcaster.clients for broadcaster in FRAME_BROADCASTERS.values()))
+
+
+def set_camera_class(camera_class: CameraClass) -> None:
     """
     Method used to set the global camera class, used in case of testing
     :return:
@@ -26,9 +133,48 @@ def set_camera_class(camera_class: Union[type(TestCamera), type(PiCamera)]) -> N
     CAMERA_CLASS = camera_class
 
 
-def get_camera_controller() -> Union[PiCamera, TestCamera]:
+def get_camera_ids() -> List[str]:
     """
-    Return the camera controller.
+    Return the ids of the cameras, in the order of the cameras config
     :return:
     """
-    return CAMERA_CONTROLLER
+    return list(CAMERA_CONTROLLERS)
+
+
+def get_default_camera_id() -> Optional[str]:
+    """
+    Return the id of the camera served by the endpoints without camera id
+    :return:
+    """
+    return DEFAULT_CAMERA
+
+
+def get_camera_controller(camera_id: Optional[str] = None) -> Optional[Camera]:
+    """
+    Return the camera controller of a camera.
+
+    :param camera_id: Id of the camera, None for the default camera
+    :return: None if there is no camera with the id
+    """
+    return CAMERA_CONTROLLERS.get(camera_id or DEFAULT_CAMERA)
+
+
+def get_frame_broadcaster(camera_id: Optional[str] = None) -> Optional[FrameBroadcaster]:
+    """
+    Return the frame broadcaster of a camera.
+
+    :param camera_id: Id of the camera, None for the default camera
+    :return: None if there is no camera with the id
+    """
+    return FRAME_BROADCASTERS.get(camera_id or DEFAULT_CAMERA)
+
+
+def get_rendition_cache(camera_id: Optional[str] = None) -> Optional[RenditionCache]:
+    """
+    Return the cache of the stream renditions of a camera.
+
+    :param camera_id: Id of the camera, None for the default camera
+    :return: None if there is no camera with the id
+    """
+    broadcaster = get_frame_broadcaster(camera_id)
+    return broadcaster.rendition_cache if broadcaster else None
@@ -3,24 +3,41 @@ import io
 import os
 import time
 from threading import Thread
-from typing import Union, Optional, List
+from typing import Dict, Union, Optional, List
 from PIL import Image
 from picamera_server import db, app
 from picamera_server.config.config import DEFAULT_CAPTURE_INTERVAL, MIN_CAPTURE_INTERVAL,\
-    MAX_CAPTURE_INTERVAL
+    MAX_CAPTURE_INTERVAL, CAPTURE_FRAME_SOURCE, CAPTURE_FRAME_SOURCE_DEDICATED, CAPTURE_FRAME_MAX_AGE,\
+    DEFAULT_CAPTURE_MODE, CAPTURE_MODE_INTERVAL, CAPTURE_MODE_MOTION, MOTION_DETECTION_FPS, CAPTURE_REENCODE_QUALITY
 from picamera_server.models.captured_image import CapturedImage
-from picamera_server.camera.camera_controllers import get_camera_controller
-from picamera_server.views.helpers.singleton import Singleton
+from picamera_server.models.capture_count import CaptureCount
+from picamera_server.camera.base_camera import FramePacer
+from picamera_server.camera.camera_controllers import get_camera_controller, get_frame_broadcaster, get_camera_ids,\
+    get_default_camera_id
+from picamera_server.camera.motion_detector import MotionDetector, NUMPY_IMPORTED
+from picamera_server.camera.capture_writer import get_capture_writer, flush_captures
+from picamera_server.camera.thumbnails import get_thumbnail_cache
+from picamera_server.metrics.camera_metrics import GET_FRAME_SECONDS, CAPTURE_STAGE_SECONDS, CAPTURE_THREAD_ALIVE,\
+    CAPTURE_ERRORS, CAPTURES_BY_FRAME_SOURCE, MOTION_DETECTION_SECONDS,\
+    MOTION_CHANGED_FRACTION
 
 
-CAPTURE_CONTROLLER = None
+# Capture controllers keyed by camera id
+CAPTURE_CONTROLLERS: Dict[str, 'CaptureController'] = dict()
 
 
-class CaptureController(object, metaclass=Singleton):
+class CaptureController(object):
     """
-    Class to manage capture mode using the global camera controller.
+    Class to manage capture mode of a camera, every camera has its own capture controller and capture thread.
     Capture mode allows to capture images from the camera with a specific time interval, the interval can go to a
     min value of MIN_CAPTURE_INTERVAL and max value of MAX_CAPTURE_INTERVAL
+
+    With the FRAME_SOURCE 'stream' the captures reuse the latest stream frame when it's not older than FRAME_MAX_AGE,
+    so the timed captures don't compete with the stream for the camera. With 'dedicated' every capture is a full
+    resolution still capture.
+
+    With the CAPTURE_MODE 'motion' the capture thread checks the stream frames for motion at MOTION_DETECTION_FPS
+    instead of capturing every CAPTURE_INTERVAL seconds, and stores the frames with motion.
     """
 
     CAPTURING_THREAD: Optional[Thread] = None
@@ -28,65 +45,194 @@ class CaptureController(object, metaclass=Singleton):
     CAPTURE_INTERVAL: int = DEFAULT_CAPTURE_INTERVAL
     MAX_CAPTURE_INTERVAL: int = MAX_CAPTURE_INTERVAL
     MIN_CAPTURE_INTERVAL: int = MIN_CAPTURE_INTERVAL
+    FRAME_SOURCE: str = CAPTURE_FRAME_SOURCE
+    FRAME_MAX_AGE: float = CAPTURE_FRAME_MAX_AGE
+    CAPTURE_MODE: str = DEFAULT_CAPTURE_MODE
+    CAPTURE_MODES: List[str] = [CAPTURE_MODE_INTERVAL, CAPTURE_MODE_MOTION]
+    # Name of the stream client of the motion detection
+    MOTION_CLIENT: str = 'motion-detector'
+    # JPEG quality to encode again the captures, 0 to store the camera JPEG bytes as they are
+    REENCODE_QUALITY: int = CAPTURE_REENCODE_QUALITY
+    JPEG_SOI = b'\xff\xd8'
+    JPEG_EOI = b'\xff\xd9'
+    # Bytes at the end of a capture checked for the end of image marker and its padding
+    JPEG_TAIL_SIZE = 64
+
+    def __init__(self, camera_id: Optional[str] = None):
+        """
+        :param camera_id: Id of the camera, None for the default camera
+        """
+        self.camera_id = camera_id or get_default_camera_id()
 
     @staticmethod
-    def _save_capture_to_file(capture: bytes) -> str:
+    def _is_complete_jpeg(capture: bytes) -> bool:
+        """
+        Return if the capture starts with the JPEG start of image marker and ends with the end of image marker,
+        the image is not decoded. The padding some encoders add after the end of image marker is ignored, only the
+        last JPEG_TAIL_SIZE bytes are checked so the capture is not copied
+
+        :param capture:
+        :return:
+        """
+        return capture[:len(CaptureController.JPEG_SOI)] == CaptureController.JPEG_SOI and \
+            capture[-CaptureController.JPEG_TAIL_SIZE:].rstrip(b'\x00').endswith(CaptureController.JPEG_EOI)
+
+    @staticmethod
+    def _reencode_capture(capture: bytes, quality: int) -> bytes:
+        """
+        Decode the capture and encode it again as JPEG with the quality
+
+        :param capture:
+        :param quality: JPEG quality
+        :return:
         """
-        Save the capture as bytes as a file.
-        It will be stored in the CAPTURES_DIR.
+        output = io.BytesIO()
+        Image.open(io.BytesIO(capture)).convert('RGB').save(output, 'JPEG', quality=quality)
+        return output.getvalue()
+
+    @staticmethod
+    def _write_file_atomically(file_path: str, content: bytes) -> None:
+        """
+        Write the content to a temp file next to the file path and rename it to the file path, so a capture file is
+        never seen half written, even if the server stops while writing it. The temp file is synced to the disk before
+        the rename, so after a power loss the file is not empty or truncated while its db entry is committed
+
+        :param file_path:
+        :param content:
+        :return:
+        """
+        temp_file_path = '{}.tmp'.format(file_path)
+        try:
+            with open(temp_file_path, 'wb') as temp_file:
+                temp_file.write(content)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_file_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+    def _save_capture_to_file(self, capture: bytes, camera_folder: str = '',
+                              capture_time: Optional[datetime.datetime] = None) -> str:
+        """
+        Save the capture as bytes as a file, the JPEG bytes of the camera are written as they are.
+        Only if REENCODE_QUALITY is set the capture is decoded and encoded again with that quality.
+        It will be stored in the CAPTURES_DIR, inside the camera_folder if there is one.
         Inside the dir the captures will be split in folders by days.
         The folder naming format will be %y-%m-%d
 
         :param capture:
+        :param camera_folder: Folder of the camera captures, empty for the default camera
+        :param capture_time: Time of the capture used to name the file, by default the current time
+        :raises ValueError: If the capture is not a complete JPEG image
         :return: Relative path of the file from the CAPTURES_DIR
         """
-        captured_image = Image.open(io.BytesIO(capture))
-        current_time = datetime.datetime.now()
+        if not self._is_complete_jpeg(capture):
+            raise ValueError('The capture is not a complete JPEG image')
+        if self.REENCODE_QUALITY:
+            capture = self._reencode_capture(capture, self.REENCODE_QUALITY)
+
+        current_time = capture_time or datetime.datetime.now()
         timestamp = current_time.strftime('%y-%m-%d-%H-%M-%S-%f')
         day_folder = '{year}-{month}-{day}'.format(year=current_time.year,
                                                    month=current_time.month,
                                                    day=current_time.day)
-        relative_path = os.path.join(day_folder, '{}.jpg'.format(timestamp))
+        relative_path = os.path.join(camera_folder, day_folder, '{}.jpg'.format(timestamp))
         file_path = os.path.join(app.config['CAPTURES_DIR'], relative_path)
 
         try:
-            captured_image.save(file_path, 'JPEG')
+            self._write_file_atomically(file_path, capture)
         # If the day folder is not created we create it and save the image
         except FileNotFoundError:
-            os.makedirs(os.path.dirname(file_path))
-            captured_image.save(file_path, 'JPEG')
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            self._write_file_atomically(file_path, capture)
 
         return relative_path
 
     @staticmethod
-    def _new_captured_image_db_entry(relative_path: str, date: Optional[str] = None) -> CapturedImage:
+    def _new_captured_image_db_entry(relative_path: str, date: Optional[datetime.datetime] = None,
+                                     camera_id: Optional[str] = None) -> CapturedImage:
         """
-        Create a new CapturedImage entry in the db
+        Create a new CapturedImage entry in the db, and add it to the count of its day and the total in the same
+        transaction
 
         :param relative_path: Relative path to assign to the new entry
-        :param date: datetime with DB format to assign to the captures
+        :param date: Creation date to assign to the capture, None for now
+        :param camera_id: Id of the camera of the capture, None for the default camera
         :return:
         """
-        new_capture = CapturedImage(relative_path=relative_path, created_at=date)
+        new_capture = CapturedImage(relative_path=relative_path, created_at=date or datetime.datetime.now(),
+                                    camera_id=camera_id or get_default_camera_id())
         db.session.add(new_capture)
+        CaptureCount.add_captures([new_capture])
         db.session.commit()
         return new_capture
 
-    @staticmethod
-    def create_new_capture(date: Optional[str] = None) -> CapturedImage:
+    def _grab_capture_frame(self, dedicated: bool = False) -> bytes:
+        """
+        Return the frame for a new capture: the latest stream frame if it's fresh enough, otherwise a frame from
+        the camera. A dedicated still capture is taken only when asked or with the FRAME_SOURCE 'dedicated'
+
+        :param dedicated: Take a dedicated full resolution still capture
+        :return:
+        """
+        camera_controller = get_camera_controller(self.camera_id)
+        if dedicated or self.FRAME_SOURCE == CAPTURE_FRAME_SOURCE_DEDICATED:
+            CAPTURES_BY_FRAME_SOURCE.labels('still').inc()
+            return camera_controller.get_still_frame()
+
+        frame = get_frame_broadcaster(self.camera_id).get_fresh_frame(self.FRAME_MAX_AGE)
+        if frame:
+            CAPTURES_BY_FRAME_SOURCE.labels('stream').inc()
+            return frame
+
+        CAPTURES_BY_FRAME_SOURCE.labels('camera').inc()
+        with GET_FRAME_SECONDS.labels('capture').time():
+            return camera_controller.get_frame()
+
+    def create_new_capture(self, date: Optional[datetime.datetime] = None, dedicated: bool = False,
+                           frame: Optional[bytes] = None) -> CapturedImage:
         """
         Take a new capture from the camera controller
         Store it as a file and
         Create the CapturedImage entry in db
 
-        :param date: datetime with DB format to assign to the captures
+        :param date: Creation date to assign to the capture, None for now
+        :param dedicated: Take a dedicated full resolution still capture instead of reusing the stream frame
+        :param frame: Frame to store instead of taking a new capture, ex. the frame with motion
         :return:
         """
-        camera_controller = get_camera_controller()
-        capture_as_bytes = camera_controller.get_frame()
+        if frame:
+            capture_as_bytes = frame
+        else:
+            with CAPTURE_STAGE_SECONDS.labels('grab').time():
+                capture_as_bytes = self._grab_capture_frame(dedicated)
+
+        with CAPTURE_STAGE_SECONDS.labels('save').time():
+            relative_file_path = self._save_capture_to_file(capture_as_bytes, self.get_camera_folder())
+        with CAPTURE_STAGE_SECONDS.labels('db_commit').time():
+            return self._new_captured_image_db_entry(relative_file_path, date, self.camera_id)
+
+    def queue_new_capture(self, frame: Optional[bytes] = None) -> bool:
+        """
+        Take a new capture from the camera controller and queue it in the capture writer, the file and the db entry
+        are written by the writer thread
 
-        relative_file_path = CaptureController._save_capture_to_file(capture_as_bytes)
-        return CaptureController._new_captured_image_db_entry(relative_file_path, date)
+        :param frame: Frame to store instead of taking a new capture, ex. the frame with motion
+        :return: True if the capture was queued, False if it was dropped by the overflow policy
+        """
+        if not frame:
+            with CAPTURE_STAGE_SECONDS.labels('grab').time():
+                frame = self._grab_capture_frame()
+        return get_capture_writer().submit((self, frame, datetime.datetime.now()))
+
+    def get_camera_folder(self) -> str:
+        """
+        Return the folder of the camera captures inside the CAPTURES_DIR, empty for the default camera
+        :return:
+        """
+        return '' if self.camera_id == get_default_camera_id() else self.camera_id
 
     def _valid_capture_interval(self, capture_interval: Union[str, int]) -> bool:
         """
@@ -114,21 +260,43 @@ class CaptureController(object, metaclass=Singleton):
         else:
             raise ValueError('Invalid capture interval value')
 
+    def update_capture_mode(self, capture_mode: str) -> None:
+        """
+        Update the CAPTURE_MODE value, a running capture thread switches to the new mode
+
+        :param capture_mode: One of CAPTURE_MODES
+        :raises ValueError: if the capture mode is invalid, or it's 'motion' and numpy is not installed
+        :return:
+        """
+        if capture_mode not in self.CAPTURE_MODES:
+            raise ValueError('Invalid capture mode value')
+        if capture_mode == CAPTURE_MODE_MOTION and not NUMPY_IMPORTED:
+            raise ValueError('The motion capture mode needs numpy')
+        self.CAPTURE_MODE = capture_mode
+
     def get_capture_controller_status(self) -> dict:
         """
         Return the values for the controller properties.
         Values returned:
             - capture_interval
+            - capture_mode
+            - capture_modes
             - max_interval
             - min_interval
             - capturing_status
             - ui_capture_mode_status used by frontend
-            - ui_total_captures number of captures stored
+            - ui_total_captures number of captures of the camera stored
+            - camera_id of the controller camera
+            - camera_ids of all the cameras, used by frontend to select the camera
 
         :return:
         """
         ui_capture_mode_status = 'RUNNING' if self.CAPTURING_STATUS else 'STOPPED'
-        return {'capture_interval': self.CAPTURE_INTERVAL,
+        return {'camera_id': self.camera_id,
+                'camera_ids': get_camera_ids(),
+                'capture_interval': self.CAPTURE_INTERVAL,
+                'capture_mode': self.CAPTURE_MODE,
+                'capture_modes': self.CAPTURE_MODES,
                 'min_interval': self.MIN_CAPTURE_INTERVAL,
                 'max_interval': self.MAX_CAPTURE_INTERVAL,
                 'capturing_status': self.CAPTURING_STATUS,
@@ -149,34 +317,79 @@ class CaptureController(object, metaclass=Singleton):
 
         if self.CAPTURING_STATUS:
             if not self.CAPTURING_THREAD:
-                self.CAPTURING_THREAD = Thread(target=self.capture_thread, daemon=True)
+                thread_name = 'capture-{}'.format(self.camera_id)
+                self.CAPTURING_THREAD = Thread(target=self.capture_thread, name=thread_name, daemon=True)
                 self.CAPTURING_THREAD.start()
 
     def capture_thread(self):
         """
         Function that will be used to run the capture thread.
-        This function will store the captures every CAPTURE_INTERVAL seconds
+        This function will store the captures every CAPTURE_INTERVAL seconds, or the frames with motion with the
+        'motion' capture mode. The captures are queued in the capture writer, so a slow write doesn't delay the
+        next capture
 
         :return:
         """
         try:
             while self.CAPTURING_STATUS:
-                self.create_new_capture()
+                if self.CAPTURE_MODE == CAPTURE_MODE_MOTION:
+                    self.motion_capture_loop()
+                    continue
+                self.queue_new_capture()
                 # Todo: when the thread is sleep and we start the interval again or reduce the interval, it still
                 # Todo: need to wait for this sleep to finish, this needs to be improved
                 time.sleep(self.CAPTURE_INTERVAL)
         except Exception as e:
-            app.logger.exception('Exception in capture thread {}'.format(e))
+            CAPTURE_ERRORS.inc()
+            app.logger.exception('Exception in capture thread {} {}'.format(self.camera_id, e))
         finally:
             self.CAPTURING_THREAD = None
 
-    @staticmethod
-    def get_total_captures() -> int:
+    def motion_capture_loop(self) -> None:
         """
-        Return the total number of stored captures
+        Check the stream frames of the camera for motion and store the frames with motion, while the capturing status
+        is on and the capture mode is 'motion'.
+        The loop subscribes to the frame broadcaster as a stream client, so the producer keeps running
+
+        :return:
+        """
+        detector = MotionDetector()
+        pacer = FramePacer(MOTION_DETECTION_FPS)
+        broadcaster = get_frame_broadcaster(self.camera_id)
+        mailbox = broadcaster.subscribe(self.MOTION_CLIENT)
+        try:
+            while self.CAPTURING_STATUS and self.CAPTURE_MODE == CAPTURE_MODE_MOTION:
+                pacer.wait()
+                mailbox_frame = mailbox.get(timeout=1)
+                if mailbox_frame is None:
+                    continue
+
+                _, frame, _ = mailbox_frame
+                with MOTION_DETECTION_SECONDS.time():
+                    changed_fraction = detector.get_changed_fraction(frame)
+                MOTION_CHANGED_FRACTION.set(changed_fraction)
+                if detector.update_motion(changed_fraction):
+                    CAPTURES_BY_FRAME_SOURCE.labels('motion').inc()
+                    self.queue_new_capture(frame)
+        finally:
+            broadcaster.unsubscribe(mailbox)
+
+    def is_capture_thread_alive(self) -> bool:
+        """
+        Return if the capture thread is running
         :return:
         """
-        return CapturedImage.query.count()
+        capturing_thread = self.CAPTURING_THREAD
+        return bool(capturing_thread and capturing_thread.is_alive())
+
+    def get_total_captures(self) -> int:
+        """
+        Return the total number of committed captures of the camera, read from the total of the counts without
+        counting the captures. The captures queued in the capture writer are not included, so reading it never waits
+        for the writer
+        :return:
+        """
+        return CaptureCount.get_total(self.camera_id)
 
     @staticmethod
     def _delete_captured_images_files(captured_images: List[CapturedImage]) -> None:
@@ -193,31 +406,43 @@ class CaptureController(object, metaclass=Singleton):
             except FileNotFoundError:
                 pass
 
-    @staticmethod
-    def remove_all_captures() -> None:
+    def remove_all_captures(self) -> None:
         """
-        Remove all the stored captures
+        Remove all the stored captures of the camera, their counts and their thumbnails, the captures queued in the
+        capture writer are committed first so they are removed too
         :return:
         """
-        entries_to_delete = CapturedImage.query.all()
-        CaptureController._delete_captured_images_files(entries_to_delete)
-        CapturedImage.query.delete()
+        flush_captures()
+        camera_captures = CapturedImage.query.filter(CapturedImage.camera_id == self.camera_id)
+        entries_to_delete = camera_captures.all()
+        relative_paths = [captured_image.relative_path for captured_image in entries_to_delete]
+        self._delete_captured_images_files(entries_to_delete)
+        camera_captures.delete(synchronize_session=False)
+        CaptureCount.remove_all(self.camera_id)
         db.session.commit()
+        get_thumbnail_cache().remove_thumbnails(relative_paths)
         return
 
 
 def init_capture_controller():
     """
-    Init capture controller. Should be run only once
+    Init the capture controllers of the cameras. Should be run only once,
+    the capture controller of a camera that was already initialized is kept
     :return:
     """
-    global CAPTURE_CONTROLLER
-    CAPTURE_CONTROLLER = CaptureController()
+    capture_controllers = {camera_id: CAPTURE_CONTROLLERS.get(camera_id) or CaptureController(camera_id)
+                           for camera_id in get_camera_ids()}
+    CAPTURE_CONTROLLERS.clear()
+    CAPTURE_CONTROLLERS.update(capture_controllers)
+    CAPTURE_THREAD_ALIVE.set_function(lambda: any(capture_controller.is_capture_thread_alive()
+                                                  for capture_controller in CAPTURE_CONTROLLERS.values()))
 
 
-def get_capture_controller() -> Optional[CaptureController]:
+def get_capture_controller(camera_id: Optional[str] = None) -> Optional[CaptureController]:
     """
-    Return the capture controller.
-    :return:
+    Return the capture controller of a camera.
+
+    :param camera_id: Id of the camera, None for the default camera
+    :return: None if there is no camera with the id
     """
-    return CAPTURE_CONTROLLER
+    return CAPTURE_CONTROLLERS.get(camera_id or get_default_camera_id())
@@ -0,0 +1,317 @@
+"""
+    Capture writer, persists the captures in a background thread so the capture loops don't wait for the SD card or
+    the database. The captures are queued in a bounded queue and the writer stores their files and inserts their
+    CapturedImage rows in batches, one transaction per batch, so a burst of captures costs one journal sync on the
+    SD card instead of one per capture.
+"""
+import atexit
+import datetime
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+from picamera_server import db, app
+from picamera_server.config.config import CAPTURE_WRITER_QUEUE_SIZE, CAPTURE_WRITER_OVERFLOW_POLICY,\
+    CAPTURE_WRITER_BATCH_SIZE, CAPTURE_WRITER_OVERFLOW_BLOCK, CAPTURE_WRITER_OVERFLOW_DROP_OLDEST,\
+    CAPTURE_WRITER_OVERFLOW_DROP_NEWEST, CAPTURE_WRITER_FLUSH_INTERVAL, CAPTURE_WRITER_READ_FLUSH_TIMEOUT
+from picamera_server.models.captured_image import CapturedImage
+from picamera_server.models.capture_count import CaptureCount
+from picamera_server.metrics.camera_metrics import CAPTURE_STAGE_SECONDS, CAPTURE_LAST_SUCCESS_TIMESTAMP,\
+    CAPTURE_ERRORS, CAPTURE_QUEUE_SIZE, CAPTURES_DROPPED
+
+
+# Capture waiting to be written: capture controller of the camera, JPEG frame and capture time
+QueuedCapture = Tuple['CaptureController', bytes, datetime.datetime]
+
+CAPTURE_WRITER: Optional['CaptureWriter'] = None
+
+
+class CaptureWriter(object):
+    """
+    Bounded queue of captures and the writer thread that persists them.
+
+    When the queue is full the overflow policy decides what happens with a new capture:
+        - block: the capture loop waits until the writer makes room
+        - drop_oldest: the oldest queued capture is dropped to make room
+        - drop_newest: the new capture is dropped
+
+    The captures are group committed: the writer waits until batch_size captures are queued, or until the oldest
+    queued capture waited flush_interval milliseconds, whichever comes first, then writes their files and commits their
+    rows in one transaction. A reader that needs to see the last captures calls flush, which commits the queued
+    captures without waiting for the batch to fill.
+    When the writer is closed it drains the queue before stopping, so no queued capture is lost.
+    """
+
+    OVERFLOW_POLICIES = [CAPTURE_WRITER_OVERFLOW_BLOCK, CAPTURE_WRITER_OVERFLOW_DROP_OLDEST,
+                         CAPTURE_WRITER_OVERFLOW_DROP_NEWEST]
+
+    def __init__(self, max_size: int = CAPTURE_WRITER_QUEUE_SIZE,
+                 overflow_policy: str = CAPTURE_WRITER_OVERFLOW_POLICY, batch_size: int = CAPTURE_WRITER_BATCH_SIZE,
+                 flush_interval: int = CAPTURE_WRITER_FLUSH_INTERVAL):
+        """
+        :param max_size: Max number of queued captures
+        :param overflow_policy: One of OVERFLOW_POLICIES
+        :param batch_size: Max number of captures committed in one transaction, limited to max_size
+        :param flush_interval: Max milliseconds a queued capture waits for its batch to fill
+        :raises ValueError: If the overflow policy is invalid
+        """
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            raise ValueError('Invalid overflow policy {}, options: {}'.format(overflow_policy,
+                                                                               self.OVERFLOW_POLICIES))
+        self.max_size = max(max_size, 1)
+        self.overflow_policy = overflow_policy
+        self.batch_size = min(max(batch_size, 1), self.max_size)
+        self.flush_interval = max(flush_interval, 0) / 1000
+        self.queue: Deque[QueuedCapture] = deque()
+        self.condition = threading.Condition()
+        self.writer_thread: Optional[threading.Thread] = None
+        # Captures taken from the queue and not committed yet
+        self.writing = 0
+        self.closed = False
+        self.dropped = 0
+        # Monotonic time when each queued capture was queued, in the order of the queue
+        self.queued_times: Deque[float] = deque()
+        # A reader is waiting for the queued captures to be committed
+        self.flush_requested = False
+
+    def start(self) -> None:
+        """
+        Start the writer thread if it's not running
+
+        :return:
+        """
+        with self.condition:
+            self.closed = False
+            if not self.writer_thread:
+                self.writer_thread = threading.Thread(target=self.writer, name='capture-writer', daemon=True)
+                self.writer_thread.start()
+
+    @property
+    def size(self) -> int:
+        """
+        Number of queued captures
+        :return:
+        """
+        return len(self.queue)
+
+    @property
+    def oldest_queued_time(self) -> float:
+        """
+        Monotonic time when the oldest queued capture was queued, must be called with self.condition acquired
+        :return:
+        """
+        return self.queued_times[0] if self.queued_times else time.monotonic()
+
+    def _pop_oldest(self) -> QueuedCapture:
+        """
+        Take the oldest queued capture, must be called with self.condition acquired
+
+        :return:
+        """
+        self.queued_times.popleft()
+        return self.queue.popleft()
+
+    def _drop(self) -> None:
+        """
+        Count a dropped capture, must be called with self.condition acquired
+
+        :return:
+        """
+        self.dropped += 1
+        CAPTURES_DROPPED.labels(self.overflow_policy).inc()
+
+    def submit(self, capture: QueuedCapture) -> bool:
+        """
+        Queue a capture to be written, applying the overflow policy when the queue is full
+
+        :param capture: Capture controller, frame and capture time
+        :return: True if the capture was queued, False if it was dropped or the writer is closed
+        """
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.queue) >= self.max_size:
+                if self.overflow_policy == CAPTURE_WRITER_OVERFLOW_DROP_NEWEST:
+                    self._drop()
+                    return False
+                if self.overflow_policy == CAPTURE_WRITER_OVERFLOW_DROP_OLDEST:
+                    self._pop_oldest()
+                    self._drop()
+                else:
+                    self.condition.wait_for(lambda: len(self.queue) < self.max_size or self.closed)
+                    if self.closed:
+                        return False
+
+            self.queued_times.append(time.monotonic())
+            self.queue.append(capture)
+            self.condition.notify_all()
+            return True
+
+    def _is_batch_ready(self) -> bool:
+        """
+        Return if the queued captures must be committed now, must be called with self.condition acquired
+
+        :return:
+        """
+        return len(self.queue) >= self.batch_size or self.closed or self.flush_requested
+
+    def _take_batch(self) -> List[QueuedCapture]:
+        """
+        Wait for queued captures and take up to batch_size of them, when there are less than batch_size captures
+        queued it waits until the oldest one waited flush_interval, the writer is closed or a flush is requested
+
+        :return: The captures, an empty list when the writer is closed and the queue is drained
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.queue or self.closed)
+            if self.queue:
+                timeout = self.oldest_queued_time + self.flush_interval - time.monotonic()
+                self.condition.wait_for(self._is_batch_ready, max(timeout, 0))
+            batch = [self._pop_oldest() for _ in range(min(self.batch_size, len(self.queue)))]
+            self.writing = len(batch)
+            if not self.queue:
+                self.flush_requested = False
+            # Wake up the captures waiting for room in the queue
+            self.condition.notify_all()
+            return batch
+
+    @staticmethod
+    def _write_capture_file(capture: QueuedCapture) -> Optional[CapturedImage]:
+        """
+        Write the file of a capture and return its row, not added to the session yet
+
+        :param capture:
+        :return: None if the file couldn't be written
+        """
+        capture_controller, frame, capture_time = capture
+        try:
+            with CAPTURE_STAGE_SECONDS.labels('save').time():
+                relative_path = capture_controller._save_capture_to_file(frame, capture_controller.get_camera_folder(),
+                                                                         capture_time)
+        except Exception as e:
+            CAPTURE_ERRORS.inc()
+            app.logger.exception('Exception writing capture of camera {} {}'.format(capture_controller.camera_id, e))
+            return None
+        return CapturedImage(relative_path=relative_path, created_at=capture_time,
+                             camera_id=capture_controller.camera_id)
+
+    def write_batch(self, batch: List[QueuedCapture]) -> List[CapturedImage]:
+        """
+        Write the files of the captures and insert their rows in one transaction, with the counts of their days.
+        If the transaction fails the files of the batch are removed
+
+        :param batch:
+        :return: The committed rows
+        """
+        captured_images = [captured_image for captured_image in map(self._write_capture_file, batch)
+                           if captured_image]
+        if not captured_images:
+            return []
+
+        try:
+            with CAPTURE_STAGE_SECONDS.labels('db_commit').time():
+                db.session.add_all(captured_images)
+                CaptureCount.add_captures(captured_images)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            CAPTURE_ERRORS.inc()
+            app.logger.exception('Exception committing {} captures {}'.format(len(captured_images), e))
+            for captured_image in captured_images:
+                file_path = os.path.join(app.config['CAPTURES_DIR'], captured_image.relative_path)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            return []
+
+        CAPTURE_LAST_SUCCESS_TIMESTAMP.set_to_current_time()
+        return captured_images
+
+    def writer(self) -> None:
+        """
+        Function used to run the writer thread.
+        Write the queued captures in batches until the writer is closed and the queue is drained
+
+        :return:
+        """
+        try:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return
+                try:
+                    self.write_batch(batch)
+                finally:
+                    with self.condition:
+                        self.writing = 0
+                        self.condition.notify_all()
+        finally:
+            db.session.remove()
+            with self.condition:
+                self.writer_thread = None
+                self.condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Commit the queued captures without waiting for the batch to fill, and wait until they are committed.
+        Used by the readers that need to see the last captures
+
+        :param timeout: Max seconds to wait
+        :return: True if the queue was flushed, False after the timeout
+        """
+        with self.condition:
+            if self.queue:
+                self.flush_requested = True
+                self.condition.notify_all()
+            return self.condition.wait_for(lambda: not (self.queue or self.writing) or not self.writer_thread,
+                                           timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop accepting captures, wait until the queued captures are written and stop the writer thread
+
+        :param timeout: Max seconds to wait for the writer thread
+        :return:
+        """
+        with self.condition:
+            self.closed = True
+            writer_thread = self.writer_thread
+            self.condition.notify_all()
+        if writer_thread:
+            writer_thread.join(timeout)
+
+
+def init_capture_writer() -> None:
+    """
+    Init the capture writer and start its thread, the writer is drained when the interpreter exits.
+    Should be run only once, the running writer is kept
+
+    :return:
+    """
+    global CAPTURE_WRITER
+    if not CAPTURE_WRITER:
+        CAPTURE_WRITER = CaptureWriter()
+        atexit.register(CAPTURE_WRITER.close)
+        CAPTURE_QUEUE_SIZE.set_function(lambda: CAPTURE_WRITER.size)
+    CAPTURE_WRITER.start()
+
+
+def get_capture_writer() -> Optional[CaptureWriter]:
+    """
+    Return the capture writer.
+    :return:
+    """
+    return CAPTURE_WRITER
+
+
+def flush_captures(timeout: float = CAPTURE_WRITER_READ_FLUSH_TIMEOUT) -> bool:
+    """
+    Flush hook for the readers of the captures, commit the captures queued in the capture writer so the reader sees
+    all the captures taken until now
+
+    :param timeout: Max seconds to wait for the queued captures
+    :return: True if the queue was flushed or there is no capture writer, False after the timeout
+    """
+    if not CAPTURE_WRITER:
+        return True
+    return CAPTURE_WRITER.flush(timeout)
@@ -0,0 +1,306 @@
+"""
+    Single producer frame broadcaster, share the frames of one camera between all the stream clients.
+"""
+import os
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+from picamera_server import app
+from picamera_server.config.config import RENDITION_DEFAULT_QUALITY, SNAPSHOT_PRODUCER_KEEP_ALIVE,\
+    SNAPSHOT_FIRST_FRAME_TIMEOUT
+from picamera_server.camera.base_camera import Camera, FramePacer, MultipartFrame
+from picamera_server.camera.frame_mailbox import FrameMailbox
+from picamera_server.camera.renditions import Rendition, RenditionCache
+from picamera_server.metrics.camera_metrics import GET_FRAME_SECONDS, FRAME_PRODUCER_ERRORS, STREAM_FRAMES_SENT,\
+    STREAM_BYTES_SENT
+
+
+class FrameBroadcaster(object):
+    """
+    One background producer thread owns the camera and publishes every new frame, with a sequence number,
+    in a shared slot and in the one slot mailbox of every stream client. The stream clients don't capture frames,
+    they wait on their mailbox and always take the newest frame, a slow client skips the frames it couldn't send.
+
+    Every camera has its own broadcaster and producer thread, so a slow camera doesn't stall the streams of the others.
+
+    The producer polls the camera at most at STREAM_MAX_FPS and a frame equal to the last published one is not
+    published again, so the clients only wake up when the frame really changes.
+
+    The producer thread is started with the first subscribed client and stops when there are no clients left.
+    The snapshot requests keep the producer running for SNAPSHOT_PRODUCER_KEEP_ALIVE seconds, so the clients polling
+    snapshots get the last published frame instead of capturing a new one each.
+
+    Clients that can't block on the condition, like the coroutines of the asyncio server, add a listener that is
+    called by the producer thread after every published frame and read it with get_latest_frame.
+    """
+
+    # Seconds to wait before retrying when the camera raises an exception
+    PRODUCER_ERROR_BACKOFF: float = 1.0
+
+    def __init__(self, camera: Camera, rendition_cache: Optional[RenditionCache] = None, camera_id: str = ''):
+        """
+        :param camera: Camera used as the frames source
+        :param rendition_cache: Cache of the renditions requested by the clients
+        :param camera_id: Id of the camera, used to name the producer thread
+        """
+        self.camera = camera
+        self.camera_id = camera_id
+        self.rendition_cache = rendition_cache if rendition_cache else RenditionCache()
+        self.condition = threading.Condition()
+        self.producer_thread: Optional[threading.Thread] = None
+        # Set by stop to end the producer thread, also interrupts the error backoff
+        self.stop_event = threading.Event()
+        self.mailboxes: List[FrameMailbox] = list()
+        self.listeners: List[Callable[[], None]] = list()
+        self.sequence = 0
+        # Identifies the sequences of this broadcaster, the sequences start again when the server is restarted
+        self.boot_id = os.urandom(4).hex()
+        # Monotonic time until the producer is kept running without clients
+        self.keep_alive_until = 0.0
+        self.frame = b''
+        # Monotonic time when the last frame was published
+        self.frame_time = 0.0
+        self.multipart_frame: MultipartFrame = Camera._get_multipart_frame(b'')
+
+    def _start_producer(self) -> None:
+        """
+        Start the producer thread if it's not running, must be called with self.condition acquired
+
+        :return:
+        """
+        if not self.producer_thread:
+            self.stop_event.clear()
+            thread_name = 'frame-producer-{}'.format(self.camera_id)
+            self.producer_thread = threading.Thread(target=self.producer, name=thread_name, daemon=True)
+            self.producer_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the producer thread without waiting for the clients to unsubscribe or the error backoff to pass.
+        The producer finishes after the frame it's capturing, if any
+
+        :return:
+        """
+        with self.condition:
+            self.keep_alive_until = 0.0
+            self.stop_event.set()
+            self.condition.notify_all()
+
+    @property
+    def clients(self) -> int:
+        """
+        Number of subscribed clients
+        :return:
+        """
+        return len(self.mailboxes)
+
+    def subscribe(self, client: str = '') -> FrameMailbox:
+        """
+        Register a new client and start the producer if needed
+
+        :param client: Description of the client, ex. the remote address
+        :return: Mailbox where the frames published from now on are delivered to the client
+        """
+        mailbox = FrameMailbox(client)
+        with self.condition:
+            self.mailboxes.append(mailbox)
+            self._start_producer()
+        return mailbox
+
+    def unsubscribe(self, mailbox: FrameMailbox) -> None:
+        """
+        Unregister a client, the producer will stop when there are no clients left
+
+        :param mailbox: Mailbox returned by subscribe
+        :return:
+        """
+        with self.condition:
+            if mailbox in self.mailboxes:
+                self.mailboxes.remove(mailbox)
+
+        stats = mailbox.get_stats()
+        app.logger.info('Stream client {} disconnected, frames delivered: {}, dropped: {}, skipped: {}'.format(
+            stats['client'], stats['delivered'], stats['dropped'], stats['skipped']))
+
+    def get_clients_stats(self) -> List[dict]:
+        """
+        Return the counters of the mailboxes of the subscribed clients
+
+        :return:
+        """
+        with self.condition:
+            mailboxes = list(self.mailboxes)
+        return [mailbox.get_stats() for mailbox in mailboxes]
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Register a function called from the producer thread after every published frame.
+        A listener doesn't count as a client, the clients must subscribe to keep the producer running
+
+        :param listener:
+        :return:
+        """
+        with self.condition:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        """
+        Unregister a listener added with add_listener
+
+        :param listener:
+        :return:
+        """
+        with self.condition:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def acquire_rendition(self, width: Optional[int], quality: Optional[int]) -> Optional[Rendition]:
+        """
+        Return the shared rendition for the width and quality, None if no rendition is requested.
+        The rendition must be released when the client stops watching it
+
+        :param width: Width of the rendition, None to keep the camera width
+        :param quality: JPEG quality of the rendition, None to send the camera frames
+        :return:
+        """
+        if not (width or quality):
+            return None
+        return self.rendition_cache.acquire(width, quality or RENDITION_DEFAULT_QUALITY)
+
+    def release_rendition(self, rendition: Optional[Rendition]) -> None:
+        """
+        Release a rendition acquired with acquire_rendition
+
+        :param rendition:
+        :return:
+        """
+        if rendition:
+            self.rendition_cache.release(rendition)
+
+    def _publish(self, frame: bytes) -> None:
+        """
+        Publish a new frame in the shared slot and in the mailboxes of the clients.
+        The multipart frame is built only once and shared by all the clients.
+
+        :param frame:
+        :return:
+        """
+        multipart_frame = Camera._get_multipart_frame(frame)
+        with self.condition:
+            self.sequence += 1
+            sequence = self.sequence
+            self.frame = frame
+            self.frame_time = time.monotonic()
+            self.multipart_frame = multipart_frame
+            mailboxes = list(self.mailboxes)
+            listeners = list(self.listeners)
+            self.condition.notify_all()
+
+        for mailbox in mailboxes:
+            mailbox.put((sequence, frame, multipart_frame))
+        for listener in listeners:
+            listener()
+
+    def producer(self) -> None:
+        """
+        Function used to run the producer thread.
+        Get frames from the camera and publish them while there are clients subscribed or snapshot requests,
+        until the broadcaster is stopped
+
+        :return:
+        """
+        pacer = FramePacer()
+        get_frame_seconds = GET_FRAME_SECONDS.labels('stream')
+        last_frame = None
+        while True:
+            with self.condition:
+                if self.stop_event.is_set() or (not self.clients and time.monotonic() >= self.keep_alive_until):
+                    self.producer_thread = None
+                    return
+
+            pacer.wait()
+            try:
+                with get_frame_seconds.time():
+                    frame = self.camera.get_frame()
+            except Exception as e:
+                FRAME_PRODUCER_ERRORS.inc()
+                app.logger.exception('Exception in frame producer {} {}'.format(self.camera_id, e))
+                self.stop_event.wait(self.PRODUCER_ERROR_BACKOFF)
+                continue
+
+            if not Camera._is_same_frame(frame, last_frame):
+                last_frame = frame
+                self._publish(frame)
+
+    def get_latest_frame(self) -> Tuple[int, bytes, MultipartFrame]:
+        """
+        Return the last published frame without waiting
+
+        :return: Sequence, frame and multipart frame of the last published frame
+        """
+        with self.condition:
+            return self.sequence, self.frame, self.multipart_frame
+
+    def get_fresh_frame(self, max_age: float) -> Optional[bytes]:
+        """
+        Return the last published frame if it's not older than max_age, the camera is not captured
+
+        :param max_age: Max age in seconds of the frame
+        :return: The frame, None if there is no frame fresh enough
+        """
+        with self.condition:
+            if self.sequence and time.monotonic() - self.frame_time <= max_age:
+                return self.frame
+            return None
+
+    def get_snapshot(self, timeout: float = SNAPSHOT_FIRST_FRAME_TIMEOUT) -> Tuple[int, bytes]:
+        """
+        Return the last published frame for a snapshot request, the camera is not captured by the request.
+        The producer is kept running for SNAPSHOT_PRODUCER_KEEP_ALIVE seconds, if it was stopped the frame held
+        is stale, so it's started and the next published frame is returned
+
+        :param timeout: Max seconds to wait for a frame when the producer was stopped
+        :return: Sequence and frame, sequence 0 and an empty frame if there is no frame after the timeout
+        """
+        with self.condition:
+            self.keep_alive_until = time.monotonic() + SNAPSHOT_PRODUCER_KEEP_ALIVE
+            if not self.producer_thread:
+                last_sequence = self.sequence
+                self._start_producer()
+                self.condition.wait_for(lambda: self.sequence > last_sequence, timeout)
+            return self.sequence, self.frame
+
+    def frames_generator(self, fps: Optional[float] = None, width: Optional[int] = None,
+                         quality: Optional[int] = None, client: str = '') -> Iterator[bytes]:
+        """
+        Generator used to create the multipart responses of frames of a stream client.
+        The frames are taken from the client mailbox, when the client is slower than the producer the frames in
+        between are replaced in the mailbox and the newest one is sent.
+
+        If a width or quality is requested the frames are taken from the shared rendition, encoded once per frame
+        for all the clients watching the same rendition.
+
+        :param fps: Target frames per second of the stream, STREAM_MAX_FPS by default
+        :param width: Width of the rendition, None to keep the camera width
+        :param quality: JPEG quality of the rendition, None to send the camera frames
+        :param client: Description of the client, ex. the remote address
+        :return: Chunks of the --frame (image/jpeg) parts of a multipart response
+        """
+        pacer = FramePacer(fps)
+        rendition = self.acquire_rendition(width, quality)
+        mailbox = self.subscribe(client)
+        try:
+            while True:
+                pacer.wait()
+                _, frame, multipart_frame = mailbox.get()
+                if rendition:
+                    multipart_frame = rendition.get_multipart_frame(frame)
+                # The generator is resumed when the server has written the chunks to the client
+                mailbox.set_sending(True)
+                yield from multipart_frame
+                mailbox.set_sending(False)
+                STREAM_FRAMES_SENT.inc()
+                STREAM_BYTES_SENT.inc(sum(map(len, multipart_frame)))
+        finally:
+            self.unsubscribe(mailbox)
+            self.release_rendition(rendition)
@@ -0,0 +1,101 @@
+"""
+    One slot mailbox of a stream client, the frame broadcaster puts every published frame in the mailbox of each client
+    and the client takes the newest one when it's ready to send it.
+"""
+import threading
+import time
+from typing import Optional, Tuple
+from picamera_server.camera.base_camera import MultipartFrame
+
+
+# Frame delivered by a mailbox: sequence, frame and multipart frame
+MailboxFrame = Tuple[int, bytes, MultipartFrame]
+
+
+class FrameMailbox(object):
+    """
+    The mailbox keeps only the latest frame, a frame that is not taken before the next one is published is replaced.
+    A slow client never gets stale frames and never holds up the producer or the rest of the clients.
+
+    The replaced frames are counted:
+        - dropped: replaced while the client was sending the previous frame, the client is limited by its link
+        - skipped: replaced while the client was waiting for its next frame time, the client fps is lower than
+            the camera fps
+    """
+
+    def __init__(self, client: str = ''):
+        """
+        :param client: Description of the client, ex. the remote address
+        """
+        self.client = client
+        self.connected_at = time.time()
+        self.condition = threading.Condition()
+        self.frame: Optional[MailboxFrame] = None
+        self.sending = False
+        self.delivered = 0
+        self.dropped = 0
+        self.skipped = 0
+
+    def put(self, frame: MailboxFrame) -> None:
+        """
+        Put a frame in the mailbox replacing the frame not taken yet, called by the producer
+
+        :param frame: Sequence, frame and multipart frame
+        :return:
+        """
+        with self.condition:
+            if self.frame is not None:
+                if self.sending:
+                    self.dropped += 1
+                else:
+                    self.skipped += 1
+            self.frame = frame
+            self.condition.notify()
+
+    def take(self) -> Optional[MailboxFrame]:
+        """
+        Take the frame of the mailbox without waiting
+
+        :return: The frame, None if the mailbox is empty
+        """
+        with self.condition:
+            frame, self.frame = self.frame, None
+            if frame is not None:
+                self.delivered += 1
+            return frame
+
+    def get(self, timeout: Optional[float] = None) -> Optional[MailboxFrame]:
+        """
+        Wait for a frame and take it
+
+        :param timeout: Max seconds to wait
+        :return: The frame, None if there is no frame after the timeout
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None, timeout)
+            return self.take()
+
+    def set_sending(self, sending: bool) -> None:
+        """
+        Set if the client is sending a frame, the frames replaced while sending are counted as dropped
+
+        :param sending:
+        :return:
+        """
+        with self.condition:
+            self.sending = sending
+
+    def get_stats(self) -> dict:
+        """
+        Return the counters of the mailbox
+
+        :return:
+        """
+        with self.condition:
+            return {
+                'client': self.client,
+                'connected_at': self.connected_at,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'skipped': self.skipped,
+            }
@@ -0,0 +1,123 @@
+"""
+    Motion detection by frame differencing. The JPEG frames are decoded downscaled to a small luma array and compared
+    with a running average of the previous frames, so the check is cheap enough to run at the stream fps on a Pi.
+"""
+import io
+import time
+from typing import Optional
+from PIL import Image
+from picamera_server.config.config import MOTION_DETECTION_WIDTH, MOTION_PIXEL_THRESHOLD, MOTION_THRESHOLD,\
+    MOTION_BACKGROUND_LEARNING_RATE, MOTION_MIN_INTERVAL, MOTION_COOLDOWN
+from picamera_server.views.helpers.optional_import import import_optional
+
+
+np = import_optional('numpy')
+NUMPY_IMPORTED = np is not None
+
+
+def get_luma(frame: bytes, width: int) -> 'np.ndarray':
+    """
+    Decode a JPEG frame to a luma array of the width, the height keeps the aspect ratio.
+    The JPEG draft mode decodes only the luma channel already downscaled by a power of two, then the image is
+    resized to the width
+
+    :param frame: JPEG frame
+    :param width: Width of the array
+    :return: float32 array of shape (height, width)
+    """
+    image = Image.open(io.BytesIO(frame))
+    height = max(round(image.height * width / image.width), 1)
+    image.draft('L', (width, height))
+    image = image.convert('L')
+    if image.size != (width, height):
+        image = image.resize((width, height), Image.BILINEAR)
+    return np.asarray(image, dtype=np.float32)
+
+
+class MotionDetector(object):
+    """
+    Detect motion comparing every frame with a background model, the running average of the previous frames.
+    A pixel changed when its luma differs more than pixel_threshold from the background, and the frame has motion
+    when the fraction of changed pixels is over threshold.
+
+    A motion capture is triggered by a frame with motion, while the motion lasts the captures are triggered at most
+    every min_interval seconds. When the motion stops the captures are not triggered again until cooldown seconds
+    later, so a flickering light doesn't trigger a capture on every flicker.
+    """
+
+    def __init__(self, width: int = MOTION_DETECTION_WIDTH, pixel_threshold: float = MOTION_PIXEL_THRESHOLD,
+                 threshold: float = MOTION_THRESHOLD, learning_rate: float = MOTION_BACKGROUND_LEARNING_RATE,
+                 min_interval: float = MOTION_MIN_INTERVAL, cooldown: float = MOTION_COOLDOWN):
+        """
+        :param width: Width of the luma arrays compared
+        :param pixel_threshold: Min luma difference of a changed pixel
+        :param threshold: Min fraction of changed pixels of a frame with motion
+        :param learning_rate: Weight of every new frame in the background
+        :param min_interval: Min seconds between two triggered captures
+        :param cooldown: Seconds after the motion stops before a capture is triggered again
+        """
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.threshold = threshold
+        self.learning_rate = learning_rate
+        self.min_interval = min_interval
+        self.cooldown = cooldown
+        self.background: Optional['np.ndarray'] = None
+        self.motion = False
+        self.last_trigger_time: Optional[float] = None
+        self.cooldown_until = 0.0
+
+    def get_changed_fraction(self, frame: bytes) -> float:
+        """
+        Return the fraction of pixels of the frame that changed from the background, and add the frame to the
+        background. The first frame, or a frame with a different size, resets the background
+
+        :param frame: JPEG frame
+        :return: Fraction between 0 and 1
+        """
+        luma = get_luma(frame, self.width)
+        if self.background is None or self.background.shape != luma.shape:
+            self.background = luma.copy()
+            return 0.0
+
+        difference = np.abs(luma - self.background)
+        changed_fraction = float(np.count_nonzero(difference > self.pixel_threshold)) / difference.size
+        # Running average of the background, updated in place
+        self.background *= 1 - self.learning_rate
+        self.background += self.learning_rate * luma
+        return changed_fraction
+
+    def update_motion(self, changed_fraction: float, now: Optional[float] = None) -> bool:
+        """
+        Update the motion state with the changed fraction of a frame
+
+        :param changed_fraction: Fraction of changed pixels of the frame
+        :param now: Monotonic time of the frame, by default the current time
+        :return: True if a capture must be stored
+        """
+        now = time.monotonic() if now is None else now
+        if changed_fraction < self.threshold:
+            if self.motion:
+                self.motion = False
+                self.cooldown_until = now + self.cooldown
+            return False
+
+        if not self.motion:
+            if now < self.cooldown_until:
+                return False
+            self.motion = True
+
+        if self.last_trigger_time is not None and now - self.last_trigger_time < self.min_interval:
+            return False
+        self.last_trigger_time = now
+        return True
+
+    def check_frame(self, frame: bytes, now: Optional[float] = None) -> bool:
+        """
+        Compare a frame with the background and return if a capture must be stored
+
+        :param frame: JPEG frame
+        :param now: Monotonic time of the frame, by default the current time
+        :return:
+        """
+        return self.update_motion(self.get_changed_fraction(frame), now)
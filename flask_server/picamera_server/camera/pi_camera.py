@@ -1,7 +1,12 @@
 import io
 import threading
+import time
+from typing import Optional
+from picamera_server.config.config import PI_CAMERA_CAPTURE_MODE, PI_CAMERA_CAPTURE_MODE_VIDEO,\
+    PI_CAMERA_VIDEO_FRAMERATE, PI_CAMERA_VIDEO_QUALITY
 from picamera_server.views.helpers.singleton import Singleton
 from picamera_server.camera.base_camera import Camera
+from picamera_server.metrics.camera_metrics import CAMERA_LOCK_WAIT_SECONDS
 
 
 PI_CAMERA_IMPORTED = False
@@ -13,17 +18,98 @@ except ImportError:
     print('Error importing picamera')
 
 
+class StreamingOutput(object):
+    """
+    Custom output for the picamera recorder.
+    The MJPEG recorder writes the frames as chunks, the chunks are accumulated until the JPEG end of image marker
+    is found, then the complete JPEG is kept in memory as the latest frame.
+    """
+
+    JPEG_SOI = b'\xff\xd8'
+    JPEG_EOI = b'\xff\xd9'
+
+    def __init__(self):
+        self.frame: Optional[bytes] = None
+        self.buffer = io.BytesIO()
+        self.condition = threading.Condition()
+
+    def _buffer_ends_with_eoi(self) -> bool:
+        """
+        Return if the buffer ends with the JPEG end of image marker
+        :return:
+        """
+        if self.buffer.tell() < len(self.JPEG_EOI):
+            return False
+        with self.buffer.getbuffer() as buffer_view:
+            return buffer_view[-len(self.JPEG_EOI):] == self.JPEG_EOI
+
+    def write(self, buf: bytes) -> int:
+        """
+        Write a chunk of the MJPEG stream, called by the picamera recorder
+
+        :param buf: Chunk of the stream
+        :return: Number of bytes written
+        """
+        # A new frame starts, drop any incomplete frame left in the buffer
+        if buf[:len(self.JPEG_SOI)] == self.JPEG_SOI:
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+        self.buffer.write(buf)
+
+        if self._buffer_ends_with_eoi():
+            # A new buffer is used for the next frame, so getvalue can return the bytes without copying them
+            frame = self.buffer.getvalue()
+            self.buffer = io.BytesIO()
+            with self.condition:
+                self.frame = frame
+                self.condition.notify_all()
+
+        return len(buf)
+
+    def flush(self) -> None:
+        """
+        Called by the picamera recorder when the recording stops
+        :return:
+        """
+        return
+
+    def wait_for_frame(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Return the latest complete frame, waiting for the first one if the recorder didn't write any yet
+
+        :param timeout: Max seconds to wait for the first frame
+        :return: Latest frame, None if there is no frame after the timeout
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None, timeout)
+            return self.frame
+
+
 class PiCamera(Camera, metaclass=Singleton):
     """
     PiCamera control class, made to control the camera resource, which can be initialized only 1 time.
     If it's initialized multiple times "picamera.PiCamera()" will raise a PiCameraMMALError exception.
+
+    Frames can be taken with two capture modes, selected with CAPTURE_MODE:
+        - still: every frame is a full still capture
+        - video: the camera keeps recording MJPEG from the video port in a StreamingOutput and get_frame returns
+            the latest complete frame without waiting for a capture
     """
 
     CAPTURE_FORMAT = 'jpeg'
+    CAPTURE_MODE = PI_CAMERA_CAPTURE_MODE
+    VIDEO_FORMAT = 'mjpeg'
+    VIDEO_FRAMERATE = PI_CAMERA_VIDEO_FRAMERATE
+    VIDEO_QUALITY = PI_CAMERA_VIDEO_QUALITY
+    # Seconds to wait for the first frame after the recording starts
+    VIDEO_FIRST_FRAME_TIMEOUT = 5
 
     def __init__(self):
         self.camera = picamera.PiCamera()
         self.lock = threading.Lock()
+        self.output = StreamingOutput()
+        self.recording = False
 
     def _is_camera_enabled(self) -> bool:
         """
@@ -51,9 +137,32 @@ class PiCamera(Camera, metaclass=Singleton):
         Disable the camera
         :return:
         """
+        self._stop_video_capture()
         self.camera.close()
         return
 
+    def _start_video_capture(self) -> None:
+        """
+        Start the MJPEG recording into self.output if it's not running
+        :return:
+        """
+        with self.lock:
+            if not self.recording:
+                self.output = StreamingOutput()
+                self.camera.framerate = self.VIDEO_FRAMERATE
+                self.camera.start_recording(self.output, format=self.VIDEO_FORMAT, quality=self.VIDEO_QUALITY)
+                self.recording = True
+
+    def _stop_video_capture(self) -> None:
+        """
+        Stop the MJPEG recording if it's running
+        :return:
+        """
+        with self.lock:
+            if self.recording:
+                self.camera.stop_recording()
+                self.recording = False
+
     def _get_frame(self, _format: str = 'jpeg') -> bytes:
         """
         Get a frame from the camera and return it, to capture the frame the camera lock will be acquire and release
@@ -61,12 +170,34 @@ class PiCamera(Camera, metaclass=Singleton):
         :param _format: Format of the image, default 'jpeg'. Options: ['jpeg', 'png', 'gif', 'bmp', 'raw', 'bgr, 'bgra']
         :return:
         """
+        lock_wait_start = time.perf_counter()
         self.lock.acquire()
+        CAMERA_LOCK_WAIT_SECONDS.observe(time.perf_counter() - lock_wait_start)
         stream = io.BytesIO()
         self.camera.capture(stream, format=_format)
         self.lock.release()
-        stream.seek(0)
-        return stream.read()
+        # getvalue returns the stream buffer without copying it
+        return stream.getvalue()
+
+    def _get_video_frame(self) -> bytes:
+        """
+        Return the latest frame written by the MJPEG recorder, the recording is started if needed
+        :raises TimeoutError: When the recorder doesn't write a frame in VIDEO_FIRST_FRAME_TIMEOUT seconds
+        :return:
+        """
+        self._start_video_capture()
+        frame = self.output.wait_for_frame(self.VIDEO_FIRST_FRAME_TIMEOUT)
+        if frame is None:
+            raise TimeoutError('No frame received from the camera recording')
+        return frame
+
+    def get_still_frame(self) -> bytes:
+        """
+        Return a full resolution capture from the still port, even when the video capture mode is recording
+        :return:
+        """
+        self._enable_camera()
+        return self._get_frame(self.CAPTURE_FORMAT)
 
     def get_frame(self) -> bytes:
         """
@@ -74,5 +205,8 @@ class PiCamera(Camera, metaclass=Singleton):
         :return:
         """
         self._enable_camera()
+        if self.CAPTURE_MODE == PI_CAMERA_CAPTURE_MODE_VIDEO:
+            return self._get_video_frame()
+
         frame = self._get_frame(self.CAPTURE_FORMAT)
         return frame
@@ -0,0 +1,113 @@
+"""
+    Renditions of the stream frames, resized and re-encoded versions of the camera frames shared by the
+    stream clients that request the same width and quality.
+"""
+import io
+import threading
+from typing import Dict, Optional, Tuple
+from PIL import Image
+from picamera_server.camera.base_camera import Camera, MultipartFrame
+
+
+def resize_jpeg(frame: bytes, width: Optional[int], quality: int) -> bytes:
+    """
+    Resize and encode a JPEG frame, the height keeps the aspect ratio. The JPEG draft mode decodes the frame
+    downscaled by a power of two, then the image is resized to the width. A frame smaller than the width is encoded
+    with its own size
+
+    :param frame: JPEG frame
+    :param width: Width of the encoded frame, None to keep the frame width
+    :param quality: JPEG quality of the encoded frame
+    :return: Encoded frame
+    """
+    image = Image.open(io.BytesIO(frame))
+    if width and width < image.width:
+        height = max(round(image.height * width / image.width), 1)
+        image.draft('RGB', (width, height))
+        image = image.resize((width, height), Image.BILINEAR)
+
+    output = io.BytesIO()
+    image.convert('RGB').save(output, 'JPEG', quality=quality)
+    return output.getvalue()
+
+
+class Rendition(object):
+    """
+    A rendition of the stream frames with a specific width and JPEG quality.
+    Each source frame is encoded only once, the first client that asks for a new frame encodes it and the rest of the
+    clients get the cached encoded frame.
+    """
+
+    def __init__(self, width: Optional[int], quality: int):
+        """
+        :param width: Width of the rendition, the height keeps the aspect ratio. None to keep the source width
+        :param quality: JPEG quality of the rendition
+        """
+        self.width = width
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.viewers = 0
+        self.source_frame: Optional[bytes] = None
+        self.multipart_frame: MultipartFrame = Camera._get_multipart_frame(b'')
+
+    def encode(self, frame: bytes) -> bytes:
+        """
+        Resize and encode a JPEG frame with the width and quality of the rendition
+
+        :param frame: Source frame
+        :return: Encoded rendition of the frame
+        """
+        return resize_jpeg(frame, self.width, self.quality)
+
+    def get_multipart_frame(self, frame: bytes) -> MultipartFrame:
+        """
+        Return the rendition of the frame as a frame of a multipart response, encode it if it's not cached.
+        The published frames are shared by all the clients, so the cached rendition is checked by identity
+
+        :param frame: Source frame
+        :return:
+        """
+        with self.lock:
+            if self.source_frame is not frame:
+                self.multipart_frame = Camera._get_multipart_frame(self.encode(frame))
+                self.source_frame = frame
+            return self.multipart_frame
+
+
+class RenditionCache(object):
+    """
+    Cache of the renditions being watched, keyed by width and quality.
+    A rendition is evicted when there are no viewers left.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.renditions: Dict[Tuple[Optional[int], int], Rendition] = dict()
+
+    def acquire(self, width: Optional[int], quality: int) -> Rendition:
+        """
+        Return the rendition for the width and quality, create it if there is not one, and add a viewer
+
+        :param width:
+        :param quality:
+        :return:
+        """
+        with self.lock:
+            rendition = self.renditions.get((width, quality))
+            if not rendition:
+                rendition = Rendition(width, quality)
+                self.renditions[(width, quality)] = rendition
+            rendition.viewers += 1
+            return rendition
+
+    def release(self, rendition: Rendition) -> None:
+        """
+        Remove a viewer of the rendition, the rendition is evicted when there are no viewers left
+
+        :param rendition:
+        :return:
+        """
+        with self.lock:
+            rendition.viewers -= 1
+            if rendition.viewers <= 0:
+                self.renditions.pop((rendition.width, rendition.quality), None)
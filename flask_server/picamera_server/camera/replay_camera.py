@@ -0,0 +1,192 @@
+"""
+    A camera implementation that replays recorded frames, from a directory of JPEG files or from a concatenated
+    MJPEG file, at a configurable fps. Used to benchmark the stream and capture paths with real size frames
+    without the camera hardware.
+"""
+import mmap
+import os
+import random
+import threading
+import time
+from typing import List, Optional, Tuple
+from picamera_server.config.config import REPLAY_CAMERA_SOURCE, REPLAY_CAMERA_FPS, REPLAY_CAMERA_LATENCY,\
+    REPLAY_CAMERA_JITTER
+from picamera_server.camera.base_camera import Camera
+from picamera_server.metrics.camera_metrics import CAMERA_LOCK_WAIT_SECONDS
+
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+JPEG_SOS = 0xda
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def index_mjpeg_frames(data: bytes, offset: int = 0) -> List[Tuple[int, int]]:
+    """
+    Find the frames of a concatenated MJPEG buffer.
+    The marker segments of each frame are skipped by their length, so the SOI and EOI markers of embedded thumbnails
+    are not taken as frames, and the end of the frame is searched only in the entropy coded data
+
+    :param data: MJPEG buffer, bytes or mmap
+    :param offset: Position to start the search
+    :return: List of (start, end) of the frames
+    """
+    frames = list()
+    size = len(data)
+    start = data.find(JPEG_SOI, offset)
+    while start != -1:
+        position = start + len(JPEG_SOI)
+        end = -1
+        # Marker segments until the start of scan, each one with its length
+        while position + 4 <= size and data[position] == 0xff:
+            marker = data[position + 1]
+            if marker == 0xff:
+                position += 1
+                continue
+            # Markers without length
+            if 0xd0 <= marker <= 0xd7 or marker == 0x01:
+                position += 2
+                continue
+            segment_length = int.from_bytes(data[position + 2:position + 4], 'big')
+            position += 2 + segment_length
+            if marker == JPEG_SOS:
+                break
+        # Entropy coded data, the 0xff bytes are followed by 0x00 or a restart marker, the first EOI ends the frame
+        while position < size:
+            position = data.find(b'\xff', position)
+            if position == -1 or position + 1 >= size:
+                break
+            if data[position + 1] == JPEG_EOI[1]:
+                end = position + len(JPEG_EOI)
+                break
+            position += 2
+
+        if end == -1:
+            # Truncated frame at the end of the buffer
+            break
+        frames.append((start, end))
+        start = data.find(JPEG_SOI, end)
+
+    return frames
+
+
+class ReplayCamera(Camera):
+    """
+    Camera that replays the frames of a directory of JPEG files, in name order, or of a concatenated MJPEG file.
+
+    The frames are not loaded in memory: the MJPEG file is memory mapped and indexed once, and the JPEG files are
+    read when their frame is requested. The frame shown changes at fps frames per second, like a sensor, and the
+    same frame object is returned until the next one is due so the stream skips it.
+
+    A latency, with an optional random jitter, can be added to every get_frame to emulate the capture time of the
+    camera. Unlike PiCamera it's not a singleton, it doesn't own any hardware.
+    """
+
+    def __init__(self, source: str = REPLAY_CAMERA_SOURCE, fps: float = REPLAY_CAMERA_FPS,
+                 latency: float = REPLAY_CAMERA_LATENCY, jitter: float = REPLAY_CAMERA_JITTER,
+                 seed: Optional[int] = None):
+        """
+        :param source: Directory of JPEG files or MJPEG file
+        :param fps: Frames per second of the replay
+        :param latency: Seconds added to every get_frame
+        :param jitter: Max seconds added or removed randomly from the latency
+        :param seed: Seed of the jitter, to replay the same latencies
+        :raises ValueError: When there are no frames in the source
+        """
+        self.source = source
+        self.fps = fps
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.mjpeg_file = None
+        self.mjpeg_map: Optional[mmap.mmap] = None
+        self.frame_paths: List[str] = list()
+        self.frame_offsets: List[Tuple[int, int]] = list()
+
+        if os.path.isdir(source):
+            self.frame_paths = sorted(os.path.join(source, file_name) for file_name in os.listdir(source)
+                                      if file_name.lower().endswith(JPEG_EXTENSIONS))
+        else:
+            self._map_mjpeg_file(source)
+
+        if not self.frames_count:
+            raise ValueError('No JPEG frames found in the replay source {}'.format(source))
+
+        self.start_time = time.monotonic()
+        self.frame_index = -1
+        self.frame = b''
+
+    def _map_mjpeg_file(self, path: str) -> None:
+        """
+        Memory map the MJPEG file and index its frames
+
+        :param path:
+        :return:
+        """
+        self.mjpeg_file = open(path, 'rb')
+        if os.fstat(self.mjpeg_file.fileno()).st_size:
+            self.mjpeg_map = mmap.mmap(self.mjpeg_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.frame_offsets = index_mjpeg_frames(self.mjpeg_map)
+
+    @property
+    def frames_count(self) -> int:
+        """
+        Number of frames of the source
+        :return:
+        """
+        return len(self.frame_paths) or len(self.frame_offsets)
+
+    def _read_frame(self, index: int) -> bytes:
+        """
+        Read a frame of the source
+
+        :param index: Index of the frame
+        :return:
+        """
+        if self.frame_paths:
+            with open(self.frame_paths[index], 'rb') as frame_file:
+                return frame_file.read()
+
+        start, end = self.frame_offsets[index]
+        return self.mjpeg_map[start:end]
+
+    def _simulate_latency(self) -> None:
+        """
+        Sleep the configured latency plus a random jitter
+        :return:
+        """
+        latency = self.latency
+        if self.jitter:
+            latency += self.random.uniform(-self.jitter, self.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def get_frame(self) -> bytes:
+        """
+        Return the frame due at the current time, the source is replayed in a loop
+
+        :return:
+        """
+        lock_wait_start = time.perf_counter()
+        with self.lock:
+            CAMERA_LOCK_WAIT_SECONDS.observe(time.perf_counter() - lock_wait_start)
+            self._simulate_latency()
+            frame_index = int((time.monotonic() - self.start_time) * self.fps) % self.frames_count
+            if frame_index != self.frame_index:
+                self.frame = self._read_frame(frame_index)
+                self.frame_index = frame_index
+            return self.frame
+
+    def close(self) -> None:
+        """
+        Release the memory map of the MJPEG file
+
+        :return:
+        """
+        if self.mjpeg_map:
+            self.mjpeg_map.close()
+            self.mjpeg_map = None
+        if self.mjpeg_file:
+            self.mjpeg_file.close()
+            self.mjpeg_file = None
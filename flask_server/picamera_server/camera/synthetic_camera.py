@@ -0,0 +1,233 @@
+"""
+    A camera implementation that renders synthetic scenes with NumPy: a background with moving objects, lighting
+    changes and noise, encoded to JPEG at any resolution. The frames are deterministic for a seed, so the same
+    scene can be replayed to measure throughput or to test frame differencing.
+"""
+import io
+import math
+import threading
+import time
+from typing import List, Optional
+from PIL import Image
+from picamera_server.config.config import SYNTHETIC_CAMERA_WIDTH, SYNTHETIC_CAMERA_HEIGHT, SYNTHETIC_CAMERA_FPS,\
+    SYNTHETIC_CAMERA_QUALITY, SYNTHETIC_CAMERA_OBJECTS, SYNTHETIC_CAMERA_NOISE, SYNTHETIC_CAMERA_LOOP_FRAMES,\
+    SYNTHETIC_CAMERA_SEED
+from picamera_server.camera.base_camera import Camera
+from picamera_server.views.helpers.optional_import import import_optional
+
+
+np = import_optional('numpy')
+NUMPY_IMPORTED = np is not None
+
+
+class SyntheticObject(object):
+    """
+    A disc that moves in a closed path, so the scene loops without jumps
+    """
+
+    def __init__(self, center_x: float, center_y: float, amplitude_x: float, amplitude_y: float, cycles: int,
+                 phase: float, radius: float, color: 'np.ndarray'):
+        """
+        :param center_x: Center of the path in pixels
+        :param center_y: Center of the path in pixels
+        :param amplitude_x: Horizontal amplitude of the path in pixels
+        :param amplitude_y: Vertical amplitude of the path in pixels
+        :param cycles: Laps of the path per scene loop
+        :param phase: Phase of the path in radians
+        :param radius: Radius of the disc in pixels
+        :param color: RGB color of the disc
+        """
+        self.center_x = center_x
+        self.center_y = center_y
+        self.amplitude_x = amplitude_x
+        self.amplitude_y = amplitude_y
+        self.cycles = cycles
+        self.phase = phase
+        self.radius = radius
+        self.color = color
+
+    def get_position(self, loop_phase: float) -> tuple:
+        """
+        Return the position of the object
+
+        :param loop_phase: Phase of the scene loop in radians
+        :return: x and y in pixels
+        """
+        angle = self.cycles * loop_phase + self.phase
+        return (self.center_x + self.amplitude_x * math.cos(angle),
+                self.center_y + self.amplitude_y * math.sin(angle))
+
+
+class SyntheticCamera(Camera):
+    """
+    Camera that renders a loop of loop_frames synthetic frames, the frame shown changes at fps frames per second.
+
+    Every frame of the loop is rendered and encoded only once: the frames are pre-rendered in a background thread
+    when the camera is created, and a frame requested before the pre-render reaches it is rendered on demand.
+    So the rendering is not part of the throughput measured with the camera.
+
+    Unlike PiCamera it's not a singleton, it doesn't own any hardware.
+    """
+
+    # Relative amplitude of the lighting change along the loop
+    LIGHT_AMPLITUDE = 0.25
+
+    def __init__(self, width: int = SYNTHETIC_CAMERA_WIDTH, height: int = SYNTHETIC_CAMERA_HEIGHT,
+                 fps: float = SYNTHETIC_CAMERA_FPS, quality: int = SYNTHETIC_CAMERA_QUALITY,
+                 objects: int = SYNTHETIC_CAMERA_OBJECTS, noise: float = SYNTHETIC_CAMERA_NOISE,
+                 loop_frames: int = SYNTHETIC_CAMERA_LOOP_FRAMES, seed: int = SYNTHETIC_CAMERA_SEED,
+                 prerender: bool = True):
+        """
+        :param width: Width of the frames in pixels
+        :param height: Height of the frames in pixels
+        :param fps: Frames per second of the scene
+        :param quality: JPEG quality of the frames
+        :param objects: Number of moving objects
+        :param noise: Standard deviation of the gaussian noise added to the frames
+        :param loop_frames: Number of frames of the scene loop
+        :param seed: Seed of the scene, the same seed renders the same frames
+        :param prerender: Pre-render the loop in a background thread
+        :raises RuntimeError: When numpy is not installed
+        """
+        if not NUMPY_IMPORTED:
+            raise RuntimeError('numpy is required by the SyntheticCamera')
+
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.quality = quality
+        self.noise = noise
+        self.loop_frames = loop_frames
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.frames: List[Optional[bytes]] = [None] * loop_frames
+
+        random_generator = np.random.default_rng(seed)
+        self.background = self._render_background()
+        self.objects = [self._create_object(random_generator) for _ in range(objects)]
+
+        self.start_time = time.monotonic()
+        self.prerender_thread: Optional[threading.Thread] = None
+        if prerender:
+            self.prerender_thread = threading.Thread(target=self.prerender, daemon=True)
+            self.prerender_thread.start()
+
+    def _render_background(self) -> 'np.ndarray':
+        """
+        Render the background, a color gradient
+        :return: Float RGB image
+        """
+        x = np.linspace(0.0, 1.0, self.width, dtype=np.float32)[np.newaxis, :]
+        y = np.linspace(0.0, 1.0, self.height, dtype=np.float32)[:, np.newaxis]
+        background = np.empty((self.height, self.width, 3), dtype=np.float32)
+        background[..., 0] = 60 + 80 * x
+        background[..., 1] = 70 + 60 * y
+        background[..., 2] = 110 + 50 * (1 - x) * y
+        return background
+
+    def _create_object(self, random_generator: 'np.random.Generator') -> SyntheticObject:
+        """
+        Create a moving object with a random path, size and color
+
+        :param random_generator:
+        :return:
+        """
+        size = min(self.width, self.height)
+        return SyntheticObject(center_x=random_generator.uniform(0.3, 0.7) * self.width,
+                               center_y=random_generator.uniform(0.3, 0.7) * self.height,
+                               amplitude_x=random_generator.uniform(0.1, 0.3) * self.width,
+                               amplitude_y=random_generator.uniform(0.1, 0.3) * self.height,
+                               cycles=int(random_generator.integers(1, 4)),
+                               phase=random_generator.uniform(0, 2 * math.pi),
+                               radius=random_generator.uniform(0.04, 0.12) * size,
+                               color=random_generator.uniform(0, 255, 3).astype(np.float32))
+
+    @staticmethod
+    def _draw_disc(image: 'np.ndarray', x: float, y: float, radius: float, color: 'np.ndarray') -> None:
+        """
+        Draw a disc in the image, only the bounding box of the disc is processed
+
+        :param image: Float RGB image
+        :param x: Center in pixels
+        :param y: Center in pixels
+        :param radius: Radius in pixels
+        :param color: RGB color
+        :return:
+        """
+        height, width = image.shape[:2]
+        x0, x1 = max(int(x - radius), 0), min(int(x + radius) + 1, width)
+        y0, y1 = max(int(y - radius), 0), min(int(y + radius) + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        mask = (xx - x) ** 2 + (yy - y) ** 2 <= radius ** 2
+        image[y0:y1, x0:x1][mask] = color
+
+    def render_frame(self, index: int) -> 'np.ndarray':
+        """
+        Render a frame of the loop
+
+        :param index: Index of the frame in the loop
+        :return: RGB image as uint8
+        """
+        loop_phase = 2 * math.pi * (index % self.loop_frames) / self.loop_frames
+        light = 1 + self.LIGHT_AMPLITUDE * math.sin(loop_phase)
+
+        image = self.background.copy()
+        for synthetic_object in self.objects:
+            x, y = synthetic_object.get_position(loop_phase)
+            self._draw_disc(image, x, y, synthetic_object.radius, synthetic_object.color)
+        image *= light
+
+        if self.noise:
+            # The noise of each frame depends only on the seed and the frame index
+            noise_generator = np.random.default_rng((self.seed, index % self.loop_frames))
+            image += noise_generator.standard_normal(image.shape, dtype=np.float32) * self.noise
+
+        return np.clip(image, 0, 255).astype(np.uint8)
+
+    def encode_frame(self, image: 'np.ndarray') -> bytes:
+        """
+        Encode a frame as JPEG
+
+        :param image: RGB image as uint8
+        :return:
+        """
+        output = io.BytesIO()
+        Image.fromarray(image, 'RGB').save(output, 'JPEG', quality=self.quality)
+        return output.getvalue()
+
+    def get_loop_frame(self, index: int) -> bytes:
+        """
+        Return the encoded frame of the loop, rendered if it's not rendered yet
+
+        :param index: Index of the frame in the loop
+        :return:
+        """
+        frame = self.frames[index]
+        if frame is None:
+            frame = self.encode_frame(self.render_frame(index))
+            with self.lock:
+                # A frame rendered at the same time by the pre-render is kept, so the same frame is always the same
+                # object
+                if self.frames[index] is None:
+                    self.frames[index] = frame
+                frame = self.frames[index]
+        return frame
+
+    def prerender(self) -> None:
+        """
+        Render all the frames of the loop, used to run the pre-render thread
+        :return:
+        """
+        for index in range(self.loop_frames):
+            self.get_loop_frame(index)
+
+    def get_frame(self) -> bytes:
+        """
+        Return the frame due at the current time, the loop is repeated
+
+        :return:
+        """
+        index = int((time.monotonic() - self.start_time) * self.fps) % self.loop_frames
+        return self.get_loop_frame(index)
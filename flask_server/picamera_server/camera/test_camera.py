@@ -9,6 +9,7 @@ from typing import List
 from picamera_server.config.config import STATIC_FILES_PATH
 from picamera_server.views.helpers.singleton import Singleton
 from picamera_server.camera.base_camera import Camera
+from picamera_server.metrics.camera_metrics import CAMERA_LOCK_WAIT_SECONDS
 
 
 class TestCamera(Camera, metaclass=Singleton):
@@ -49,7 +50,9 @@ class TestCamera(Camera, metaclass=Singleton):
 
         :return: random test_image
         """
+        lock_wait_start = time.perf_counter()
         self.lock.acquire()
+        CAMERA_LOCK_WAIT_SECONDS.observe(time.perf_counter() - lock_wait_start)
         _frame = self.frames[int(time.time()) % 3]
         self.lock.release()
         return _frame
@@ -0,0 +1,189 @@
+"""
+    Thumbnails of the captures for the captures pages. The thumbnails are generated on the first request with the JPEG
+    draft mode, that decodes the capture already downscaled, and cached on disk in the THUMBNAILS_DIR.
+"""
+import os
+import shutil
+import threading
+import time
+from typing import Iterable, Optional
+from werkzeug.security import safe_join
+from picamera_server import app
+from picamera_server.config.config import THUMBNAIL_QUALITY, THUMBNAIL_CACHE_MAX_SIZE
+from picamera_server.metrics.camera_metrics import THUMBNAIL_REQUESTS, THUMBNAIL_CACHE_BYTES
+from picamera_server.camera.renditions import resize_jpeg
+
+
+THUMBNAIL_CACHE: Optional['ThumbnailCache'] = None
+
+
+class ThumbnailCache(object):
+    """
+    On disk cache of the thumbnails, the thumbnail of a capture is stored in the folder of its width with the relative
+    path of the capture: {thumbnails_dir}/{width}/{relative_path}
+
+    When the thumbnails take more than max_size bytes the least recently used ones are removed, until they take
+    EVICTION_TARGET of max_size. The modification time of a thumbnail is updated every time it's used.
+    The thumbnails are written, used and evicted with the lock acquired, the eviction skips the temp files and the
+    thumbnails used in the last EVICTION_MIN_AGE seconds, so a thumbnail is not removed before it's served.
+    """
+
+    # Fraction of max_size left after an eviction, so the eviction doesn't run for every new thumbnail
+    EVICTION_TARGET = 0.8
+    # Seconds since the last use of a thumbnail before it can be evicted
+    EVICTION_MIN_AGE = 5
+
+    def __init__(self, captures_dir: str, thumbnails_dir: str, max_size: int = THUMBNAIL_CACHE_MAX_SIZE,
+                 quality: int = THUMBNAIL_QUALITY):
+        """
+        :param captures_dir: Dir of the captures
+        :param thumbnails_dir: Dir of the cached thumbnails
+        :param max_size: Max bytes of the cached thumbnails
+        :param quality: JPEG quality of the thumbnails
+        """
+        self.captures_dir = captures_dir
+        self.thumbnails_dir = thumbnails_dir
+        self.max_size = max_size
+        self.quality = quality
+        self.lock = threading.Lock()
+        # Bytes of the cached thumbnails, None until the dir is scanned
+        self.size: Optional[int] = None
+
+    def _scan_size(self) -> int:
+        """
+        Return the bytes of the cached thumbnails, must be called with self.lock acquired
+        :return:
+        """
+        if self.size is None:
+            self.size = sum(os.path.getsize(os.path.join(folder, file_name))
+                            for folder, _, files_names in os.walk(self.thumbnails_dir) for file_name in files_names)
+        return self.size
+
+    def get_size(self) -> int:
+        """
+        Return the bytes of the cached thumbnails
+        :return:
+        """
+        with self.lock:
+            return self._scan_size()
+
+    def get_thumbnail(self, relative_path: str, width: int) -> str:
+        """
+        Return the path of the thumbnail of a capture relative to the thumbnails_dir, the thumbnail is generated if
+        it's not cached
+
+        :param relative_path: Relative path of the capture in the captures_dir
+        :param width: Width of the thumbnail
+        :raises FileNotFoundError: If the capture doesn't exist or the path is outside the captures_dir
+        :return:
+        """
+        capture_path = safe_join(self.captures_dir, relative_path)
+        thumbnail_relative_path = os.path.join(str(width), relative_path)
+        thumbnail_path = safe_join(self.thumbnails_dir, thumbnail_relative_path)
+        if not capture_path or not thumbnail_path or not os.path.isfile(capture_path):
+            raise FileNotFoundError('Capture {} not found'.format(relative_path))
+
+        with self.lock:
+            if os.path.isfile(thumbnail_path):
+                THUMBNAIL_REQUESTS.labels('hit').inc()
+                os.utime(thumbnail_path)
+                return thumbnail_relative_path
+
+        THUMBNAIL_REQUESTS.labels('miss').inc()
+        # The thumbnail is encoded without the lock, the rest of the thumbnails are served meanwhile
+        with open(capture_path, 'rb') as capture_file:
+            thumbnail = resize_jpeg(capture_file.read(), width, self.quality)
+
+        with self.lock:
+            # The cached thumbnails are scanned before the new one is written, so it's not counted twice
+            self._scan_size()
+            # Every thread writes its own temp file, a thumbnail generated by two requests at once is replaced whole
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            temp_file_path = '{}.{}.tmp'.format(thumbnail_path, threading.get_ident())
+            with open(temp_file_path, 'wb') as temp_file:
+                temp_file.write(thumbnail)
+            replaced_size = os.path.getsize(thumbnail_path) if os.path.isfile(thumbnail_path) else 0
+            os.replace(temp_file_path, thumbnail_path)
+
+            self.size += len(thumbnail) - replaced_size
+            if self.size > self.max_size:
+                self._evict()
+        return thumbnail_relative_path
+
+    def _evict(self) -> int:
+        """
+        Remove the least recently used thumbnails until they take EVICTION_TARGET of max_size, the temp files and the
+        thumbnails used in the last EVICTION_MIN_AGE seconds are kept. Must be called with self.lock acquired
+
+        :return: Number of removed thumbnails
+        """
+        thumbnails = list()
+        for folder, _, files_names in os.walk(self.thumbnails_dir):
+            for file_name in files_names:
+                if file_name.endswith('.tmp'):
+                    continue
+                thumbnail_path = os.path.join(folder, file_name)
+                thumbnail_stat = os.stat(thumbnail_path)
+                thumbnails.append((thumbnail_stat.st_mtime, thumbnail_stat.st_size, thumbnail_path))
+        thumbnails.sort()
+
+        self.size = sum(thumbnail_size for _, thumbnail_size, _ in thumbnails)
+        target_size = self.max_size * self.EVICTION_TARGET
+        min_used_time = time.time() - self.EVICTION_MIN_AGE
+        removed = 0
+        for used_time, thumbnail_size, thumbnail_path in thumbnails:
+            if self.size <= target_size or used_time > min_used_time:
+                break
+            try:
+                os.remove(thumbnail_path)
+            except FileNotFoundError:
+                pass
+            self.size -= thumbnail_size
+            removed += 1
+        return removed
+
+    def remove_thumbnails(self, relative_paths: Iterable[str]) -> int:
+        """
+        Remove the cached thumbnails of the captures, of every width
+
+        :param relative_paths: Relative paths of the captures in the captures_dir
+        :return: Number of removed thumbnails
+        """
+        with self.lock:
+            if not os.path.isdir(self.thumbnails_dir):
+                return 0
+            widths_folders = [os.path.join(self.thumbnails_dir, width_folder)
+                              for width_folder in os.listdir(self.thumbnails_dir)]
+            removed = 0
+            for relative_path in relative_paths:
+                for width_folder in widths_folders:
+                    thumbnail_path = safe_join(width_folder, relative_path)
+                    if not thumbnail_path or not os.path.isfile(thumbnail_path):
+                        continue
+                    thumbnail_size = os.path.getsize(thumbnail_path)
+                    os.remove(thumbnail_path)
+                    if self.size is not None:
+                        self.size -= thumbnail_size
+                    removed += 1
+            return removed
+
+    def clear(self) -> None:
+        """
+        Remove all the cached thumbnails
+        :return:
+        """
+        with self.lock:
+            shutil.rmtree(self.thumbnails_dir, ignore_errors=True)
+            self.size = 0
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """
+    Return the thumbnails cache of the app captures, it's created on the first call
+    :return:
+    """
+    global THUMBNAIL_CACHE
+    if not THUMBNAIL_CACHE:
+        THUMBNAIL_CACHE = ThumbnailCache(app.config['CAPTURES_DIR'], app.config['THUMBNAILS_DIR'])
+        THUMBNAIL_CACHE_BYTES.set_function(THUMBNAIL_CACHE.get_size)
+    return THUMBNAIL_CACHE
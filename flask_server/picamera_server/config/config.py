@@ -1,4 +1,5 @@
 import os
+from importlib.util import find_spec
 
 
 # Env options ['development', 'testing', 'production']
@@ -14,12 +15,157 @@ FLASK_INSTANCE_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__),
 STATIC_FILES_PATH = os.path.join(FLASK_INSTANCE_FOLDER, 'static')
 DEFAULT_SQL_LITE_DATABASE = 'sqlite:///{}'.format(os.path.join(FLASK_INSTANCE_FOLDER, 'sqlite.db'))
 TEST_SQL_LITE_DATABASE = 'sqlite:///{}'.format(os.path.join(FLASK_INSTANCE_FOLDER, 'test_sqlite.db'))
+# SQLite engine profile options ['performance', 'default'], applied to every new connection
+# - performance: the pragmas below, WAL journal so the gallery reads don't block the captures writes
+# - default: the SQLite defaults, rollback journal
+SQLITE_PROFILE_PERFORMANCE = 'performance'
+SQLITE_PROFILE_DEFAULT = 'default'
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', SQLITE_PROFILE_PERFORMANCE)
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+# Bytes of the database file mapped in memory
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+# Pages of the page cache, a negative value is the size in KiB
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -8192))
+# Milliseconds a connection waits for a lock held by another connection
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
 
 # Camera settings
 DEFAULT_CAPTURE_INTERVAL = os.environ.get('DEFAULT_CAPTURE_INTERVAL', 60)
 MIN_CAPTURE_INTERVAL = 0
 MAX_CAPTURE_INTERVAL = 600
 CAPTURES_DIR = os.path.join(FLASK_INSTANCE_FOLDER, 'camera', 'captures')
+# Seconds the browsers can cache the captures and thumbnails, they never change once written
+CAPTURE_CACHE_MAX_AGE = int(os.environ.get('CAPTURE_CACHE_MAX_AGE', 365 * 24 * 60 * 60))
+# Thumbnails of the captures shown in the captures pages, generated on the first request and cached on disk
+THUMBNAILS_DIR = os.path.join(FLASK_INSTANCE_FOLDER, 'camera', 'thumbnails')
+# Widths of the thumbnails that can be requested, the first one is the default
+THUMBNAIL_WIDTHS = [int(width) for width in os.environ.get('THUMBNAIL_WIDTHS', '320,640').split(',')]
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 75))
+# Max bytes of the thumbnails cache, the least recently used thumbnails are removed when it's exceeded
+THUMBNAIL_CACHE_MAX_SIZE = int(os.environ.get('THUMBNAIL_CACHE_MAX_SIZE', 256 * 1024 * 1024))
+# Captures export, bytes read from the capture files and captures read from the database at once
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 64 * 1024))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+# Bytes of the manifest of a TAR export kept in memory, a bigger manifest is spooled to a temp file
+EXPORT_MANIFEST_SPOOL_SIZE = int(os.environ.get('EXPORT_MANIFEST_SPOOL_SIZE', 1024 * 1024))
+# Timelapses of the captures, default frames per second and capture files read ahead of the sent frame
+TIMELAPSE_FPS = float(os.environ.get('TIMELAPSE_FPS', 10))
+TIMELAPSE_MAX_FPS = 60
+TIMELAPSE_PREFETCH_FRAMES = int(os.environ.get('TIMELAPSE_PREFETCH_FRAMES', 8))
+# Capture frame source options ['stream', 'dedicated']
+# - stream: the captures reuse the latest stream frame when it's not older than CAPTURE_FRAME_MAX_AGE seconds,
+#   the camera is captured only when there is no fresh stream frame
+# - dedicated: every capture is a dedicated full resolution still capture
+CAPTURE_FRAME_SOURCE_STREAM = 'stream'
+CAPTURE_FRAME_SOURCE_DEDICATED = 'dedicated'
+CAPTURE_FRAME_SOURCE = os.environ.get('CAPTURE_FRAME_SOURCE', CAPTURE_FRAME_SOURCE_STREAM)
+if CAPTURE_FRAME_SOURCE not in (CAPTURE_FRAME_SOURCE_STREAM, CAPTURE_FRAME_SOURCE_DEDICATED):
+    raise ValueError('Invalid CAPTURE_FRAME_SOURCE {}'.format(CAPTURE_FRAME_SOURCE))
+CAPTURE_FRAME_MAX_AGE = float(os.environ.get('CAPTURE_FRAME_MAX_AGE', 1.0))
+# The captures are stored with the JPEG bytes of the camera, set a JPEG quality to decode and encode them again
+CAPTURE_REENCODE_QUALITY = int(os.environ.get('CAPTURE_REENCODE_QUALITY', 0))
+# Capture writer settings, the captures are queued and written by a background thread in batches.
+# Overflow policy options when the queue is full ['block', 'drop_oldest', 'drop_newest']
+CAPTURE_WRITER_OVERFLOW_BLOCK = 'block'
+CAPTURE_WRITER_OVERFLOW_DROP_OLDEST = 'drop_oldest'
+CAPTURE_WRITER_OVERFLOW_DROP_NEWEST = 'drop_newest'
+CAPTURE_WRITER_OVERFLOW_POLICY = os.environ.get('CAPTURE_WRITER_OVERFLOW_POLICY', CAPTURE_WRITER_OVERFLOW_BLOCK)
+CAPTURE_WRITER_QUEUE_SIZE = int(os.environ.get('CAPTURE_WRITER_QUEUE_SIZE', 32))
+CAPTURE_WRITER_BATCH_SIZE = int(os.environ.get('CAPTURE_WRITER_BATCH_SIZE', 16))
+# Max milliseconds a queued capture waits for its batch to fill before it's committed
+CAPTURE_WRITER_FLUSH_INTERVAL = int(os.environ.get('CAPTURE_WRITER_FLUSH_INTERVAL', 500))
+# Max seconds a reader waits for the queued captures to be committed
+CAPTURE_WRITER_READ_FLUSH_TIMEOUT = float(os.environ.get('CAPTURE_WRITER_READ_FLUSH_TIMEOUT', 2))
+# Capture mode options ['interval', 'motion']
+# - interval: a capture is stored every capture interval seconds
+# - motion: the stream frames are compared with a background model and a capture is stored when there is motion
+CAPTURE_MODE_INTERVAL = 'interval'
+CAPTURE_MODE_MOTION = 'motion'
+DEFAULT_CAPTURE_MODE = os.environ.get('DEFAULT_CAPTURE_MODE', CAPTURE_MODE_INTERVAL)
+if DEFAULT_CAPTURE_MODE not in (CAPTURE_MODE_INTERVAL, CAPTURE_MODE_MOTION):
+    raise ValueError('Invalid DEFAULT_CAPTURE_MODE {}'.format(DEFAULT_CAPTURE_MODE))
+# The motion detection needs numpy, fail at startup instead of when the capture thread starts
+if DEFAULT_CAPTURE_MODE == CAPTURE_MODE_MOTION and not find_spec('numpy'):
+    raise ValueError('DEFAULT_CAPTURE_MODE {} needs numpy installed'.format(CAPTURE_MODE_MOTION))
+
+# Motion detection settings, the frames are decoded downscaled to MOTION_DETECTION_WIDTH to a luma array.
+# A pixel changed when its luma differs more than MOTION_PIXEL_THRESHOLD from the background, and there is motion
+# when the fraction of changed pixels is over MOTION_THRESHOLD
+MOTION_DETECTION_WIDTH = int(os.environ.get('MOTION_DETECTION_WIDTH', 160))
+MOTION_DETECTION_FPS = float(os.environ.get('MOTION_DETECTION_FPS', 10))
+MOTION_PIXEL_THRESHOLD = float(os.environ.get('MOTION_PIXEL_THRESHOLD', 25))
+MOTION_THRESHOLD = float(os.environ.get('MOTION_THRESHOLD', 0.01))
+# Weight of every new frame in the running average of the background
+MOTION_BACKGROUND_LEARNING_RATE = float(os.environ.get('MOTION_BACKGROUND_LEARNING_RATE', 0.05))
+# Min seconds between two motion captures, and seconds after the motion stops before a new motion is captured
+MOTION_MIN_INTERVAL = float(os.environ.get('MOTION_MIN_INTERVAL', 1))
+MOTION_COOLDOWN = float(os.environ.get('MOTION_COOLDOWN', 5))
+
+# Camera class options ['pi', 'test', 'replay', 'synthetic'], by default 'pi' if picamera is installed and 'test'
+# otherwise.
+# When running tests the camera class is always 'test'
+CAMERA_CLASS_PI = 'pi'
+CAMERA_CLASS_TEST = 'test'
+CAMERA_CLASS_REPLAY = 'replay'
+CAMERA_CLASS_SYNTHETIC = 'synthetic'
+CAMERA_CLASS_NAME = os.environ.get('CAMERA_CLASS', '')
+
+# Cameras served by the server, comma separated list of id:class[:source], ex. 'main:pi,door:replay:/media/door.mjpeg'.
+# The source is only used by the 'replay' cameras. Every camera has its own frame producer thread and capture schedule.
+# Empty to serve only one camera with the DEFAULT_CAMERA_ID and the CAMERA_CLASS
+CAMERAS = os.environ.get('CAMERAS', '')
+# Camera served by the endpoints without camera id, the first camera of CAMERAS if it's not one of them
+DEFAULT_CAMERA_ID = os.environ.get('DEFAULT_CAMERA_ID', 'main')
+
+# ReplayCamera settings, the source is a directory of JPEG files or a concatenated MJPEG file
+REPLAY_CAMERA_SOURCE = os.environ.get('REPLAY_CAMERA_SOURCE', os.path.join(STATIC_FILES_PATH, 'test_images'))
+REPLAY_CAMERA_FPS = float(os.environ.get('REPLAY_CAMERA_FPS', 15))
+# Seconds added to every frame capture, and max seconds added or removed randomly from it
+REPLAY_CAMERA_LATENCY = float(os.environ.get('REPLAY_CAMERA_LATENCY', 0))
+REPLAY_CAMERA_JITTER = float(os.environ.get('REPLAY_CAMERA_JITTER', 0))
+
+# SyntheticCamera settings, the scene is a loop of SYNTHETIC_CAMERA_LOOP_FRAMES frames rendered once
+SYNTHETIC_CAMERA_WIDTH = int(os.environ.get('SYNTHETIC_CAMERA_WIDTH', 1920))
+SYNTHETIC_CAMERA_HEIGHT = int(os.environ.get('SYNTHETIC_CAMERA_HEIGHT', 1080))
+SYNTHETIC_CAMERA_FPS = float(os.environ.get('SYNTHETIC_CAMERA_FPS', 15))
+SYNTHETIC_CAMERA_QUALITY = int(os.environ.get('SYNTHETIC_CAMERA_QUALITY', 85))
+SYNTHETIC_CAMERA_OBJECTS = int(os.environ.get('SYNTHETIC_CAMERA_OBJECTS', 3))
+SYNTHETIC_CAMERA_NOISE = float(os.environ.get('SYNTHETIC_CAMERA_NOISE', 4))
+SYNTHETIC_CAMERA_LOOP_FRAMES = int(os.environ.get('SYNTHETIC_CAMERA_LOOP_FRAMES', 60))
+SYNTHETIC_CAMERA_SEED = int(os.environ.get('SYNTHETIC_CAMERA_SEED', 0))
+
+# PiCamera capture mode options ['still', 'video']
+# - still: every frame is a full still capture from the camera
+# - video: the camera keeps recording MJPEG from the video port and the latest frame is kept in memory
+PI_CAMERA_CAPTURE_MODE_STILL = 'still'
+PI_CAMERA_CAPTURE_MODE_VIDEO = 'video'
+PI_CAMERA_CAPTURE_MODE = os.environ.get('PI_CAMERA_CAPTURE_MODE', PI_CAMERA_CAPTURE_MODE_STILL)
+PI_CAMERA_VIDEO_FRAMERATE = int(os.environ.get('PI_CAMERA_VIDEO_FRAMERATE', 15))
+PI_CAMERA_VIDEO_QUALITY = int(os.environ.get('PI_CAMERA_VIDEO_QUALITY', 85))
+
+# Stream settings, max frames per second sent to a stream client and polled from the camera
+STREAM_MAX_FPS = float(os.environ.get('STREAM_MAX_FPS', 30))
+# Stream renditions, limits of the width and JPEG quality that the stream clients can request
+RENDITION_MIN_WIDTH = 80
+RENDITION_MAX_WIDTH = 3280
+RENDITION_MIN_QUALITY = 10
+RENDITION_MAX_QUALITY = 95
+RENDITION_DEFAULT_QUALITY = 75
+
+# Snapshot settings, seconds that the frame producer keeps running after a snapshot request and max seconds to wait
+# for a frame when the producer was stopped
+SNAPSHOT_PRODUCER_KEEP_ALIVE = float(os.environ.get('SNAPSHOT_PRODUCER_KEEP_ALIVE', 10))
+SNAPSHOT_FIRST_FRAME_TIMEOUT = 5
+
+# Asyncio stream server settings, the stream endpoints are served from the event loop and the rest of the
+# requests are run by the Flask app in a pool of ASYNC_SERVER_WSGI_THREADS threads
+ASYNC_SERVER_WSGI_THREADS = int(os.environ.get('ASYNC_SERVER_WSGI_THREADS', 8))
+# Seconds to wait for the next request of a keep-alive connection
+ASYNC_SERVER_KEEP_ALIVE_TIMEOUT = float(os.environ.get('ASYNC_SERVER_KEEP_ALIVE_TIMEOUT', 15))
+# Max size of the request line and headers, and of the request body
+ASYNC_SERVER_MAX_HEADER_SIZE = 64 * 1024
+ASYNC_SERVER_MAX_BODY_SIZE = 16 * 1024 * 1024
 
 # Endpoint settings
 ITEMS_PER_PAGE = 20
@@ -36,6 +182,7 @@ class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     ITEMS_PER_PAGE = ITEMS_PER_PAGE
     CAPTURES_DIR = CAPTURES_DIR
+    THUMBNAILS_DIR = THUMBNAILS_DIR
 
 
 class DevelopmentConfig(Config):
@@ -53,5 +200,6 @@ class TestingConfig(Config):
     SECRET_KEY = 'test'
     SQLALCHEMY_DATABASE_URI = TEST_SQL_LITE_DATABASE
     CAPTURES_DIR = os.path.join(FLASK_INSTANCE_FOLDER, 'tests', 'tmp')
+    THUMBNAILS_DIR = os.path.join(FLASK_INSTANCE_FOLDER, 'tests', 'tmp_thumbnails')
     ITEMS_PER_PAGE = 5
     LOGIN_DISABLED = True
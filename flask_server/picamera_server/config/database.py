@@ -1,12 +1,150 @@
+from typing import List, Tuple, Union
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, event
+from picamera_server.config.config import SQLITE_PROFILE, SQLITE_PROFILE_PERFORMANCE, SQLITE_PROFILE_DEFAULT,\
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE, SQLITE_BUSY_TIMEOUT
+
+
+SQLITE_PROFILES = [SQLITE_PROFILE_PERFORMANCE, SQLITE_PROFILE_DEFAULT]
+SQLITE_JOURNAL_MODES = ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']
+SQLITE_SYNCHRONOUS_MODES = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+
+
+def get_sqlite_pragmas(profile: str = SQLITE_PROFILE) -> List[Tuple[str, Union[str, int]]]:
+    """
+    Return the pragmas of the SQLite engine profile, in the order they must be set
+
+    :param profile: One of SQLITE_PROFILES
+    :raises ValueError: If the profile or a pragma value is invalid
+    :return: Names and values of the pragmas
+    """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError('Invalid SQLite profile {}, options: {}'.format(profile, SQLITE_PROFILES))
+    if profile == SQLITE_PROFILE_DEFAULT:
+        return []
+
+    journal_mode = SQLITE_JOURNAL_MODE.upper()
+    synchronous = SQLITE_SYNCHRONOUS.upper()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError('Invalid SQLite journal mode {}, options: {}'.format(journal_mode, SQLITE_JOURNAL_MODES))
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError('Invalid SQLite synchronous {}, options: {}'.format(synchronous, SQLITE_SYNCHRONOUS_MODES))
+
+    # busy_timeout goes first, changing the journal mode needs a lock
+    return [('busy_timeout', SQLITE_BUSY_TIMEOUT), ('journal_mode', journal_mode), ('synchronous', synchronous),
+            ('mmap_size', SQLITE_MMAP_SIZE), ('cache_size', SQLITE_CACHE_SIZE)]
+
+
+def set_sqlite_pragmas(dbapi_connection, pragmas: List[Tuple[str, Union[str, int]]]) -> None:
+    """
+    Set the pragmas in a new SQLite connection
+
+    :param dbapi_connection: sqlite3 connection
+    :param pragmas: Names and values returned by get_sqlite_pragmas
+    :return:
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+    finally:
+        cursor.close()
 
 
 def config_database(app: Flask) -> SQLAlchemy:
     """
-    Config the database in the app
+    Config the database in the app, the pragmas of the SQLITE_PROFILE are set in every new SQLite connection
     :param app:
     :return:
     """
     db = SQLAlchemy(app)
+    if db.engine.dialect.name == 'sqlite':
+        pragmas = get_sqlite_pragmas()
+        if pragmas:
+            event.listen(db.engine, 'connect',
+                         lambda dbapi_connection, _: set_sqlite_pragmas(dbapi_connection, pragmas))
     return db
+
+
+def add_missing_columns(db: SQLAlchemy, model: type) -> List[str]:
+    """
+    Add to the table of the model the columns that it doesn't have yet, used to migrate the databases created with
+    an older version of the model. create_all only creates the missing tables.
+    The new columns must be nullable or have a server default, the existing rows get the server default
+
+    :param db:
+    :param model: Model of the table
+    :return: Names of the added columns
+    """
+    table = model.__table__
+    existing_columns = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    added_columns = list()
+    for column in table.columns:
+        if column.name in existing_columns:
+            continue
+        column_definition = '{} {}'.format(column.name, column.type.compile(db.engine.dialect))
+        if column.server_default is not None:
+            column_definition += " DEFAULT '{}'".format(column.server_default.arg)
+        if not column.nullable:
+            column_definition += ' NOT NULL'
+        db.engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(table.name, column_definition))
+        added_columns.append(column.name)
+    return added_columns
+
+
+def add_missing_indexes(db: SQLAlchemy, model: type) -> List[str]:
+    """
+    Create the indexes of the model that its table doesn't have yet, used to migrate the databases created with
+    an older version of the model. create_all doesn't create the indexes of an existing table
+
+    :param db:
+    :param model: Model of the table
+    :return: Names of the created indexes
+    """
+    table = model.__table__
+    existing_indexes = {index['name'] for index in inspect(db.engine).get_indexes(table.name)}
+    added_indexes = list()
+    for index in sorted(table.indexes, key=lambda table_index: table_index.name):
+        if index.name in existing_indexes:
+            continue
+        index.create(db.engine)
+        added_indexes.append(index.name)
+    return added_indexes
+
+
+def recreate_table_without_columns(db: SQLAlchemy, model: type) -> bool:
+    """
+    Drop and create again the table of the model when it doesn't have all the columns of the model, used to migrate
+    the tables of data that can be rebuilt, ex. when the primary key of the model changed and the columns can't be
+    added to the rows
+
+    :param db:
+    :param model: Model of the table
+    :return: True if the table was created again
+    """
+    table = model.__table__
+    existing_columns = {column['name'] for column in inspect(db.engine).get_columns(table.name)}
+    if all(column.name in existing_columns for column in table.columns):
+        return False
+    table.drop(db.engine)
+    table.create(db.engine)
+    return True
+
+
+def migrate_database(db: SQLAlchemy) -> None:
+    """
+    Migrate the tables created with an older version of the models
+
+    :param db:
+    :return:
+    """
+    from picamera_server.models import CapturedImage, CaptureCount
+    add_missing_columns(db, CapturedImage)
+    add_missing_indexes(db, CapturedImage)
+    # The counts created before they were kept per camera are rebuilt
+    recreate_table_without_columns(db, CaptureCount)
+    # The databases created before the counts were maintained have captures without counts or without the totals
+    if CaptureCount.query.filter_by(day=CaptureCount.TOTAL_DAY).first() is None and \
+            CapturedImage.query.first() is not None:
+        CaptureCount.rebuild()
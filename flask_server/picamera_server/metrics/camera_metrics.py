@@ -0,0 +1,61 @@
+"""
+    Metrics of the camera, the streams and the capture pipeline
+"""
+from picamera_server.metrics.registry import Counter, Gauge, Histogram, REGISTRY
+
+
+# Buckets in seconds of the camera lock wait, most of the waits are much shorter than a capture
+LOCK_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Buckets in seconds of the motion detection of a frame, it must be shorter than the stream frame interval
+MOTION_DETECTION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+GET_FRAME_SECONDS = REGISTRY.register(Histogram(
+    'picamera_get_frame_seconds', 'Latency of the camera get_frame calls', ['caller']))
+CAMERA_LOCK_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'picamera_camera_lock_wait_seconds', 'Time waiting to acquire the camera lock', buckets=LOCK_WAIT_BUCKETS))
+FRAME_PRODUCER_ERRORS = REGISTRY.register(Counter(
+    'picamera_frame_producer_errors_total', 'Exceptions raised by the camera in the frame producer'))
+
+STREAM_CLIENTS = REGISTRY.register(Gauge(
+    'picamera_stream_clients', 'Stream clients connected'))
+STREAM_FRAMES_SENT = REGISTRY.register(Counter(
+    'picamera_stream_frames_sent_total', 'Frames sent to the stream clients'))
+STREAM_BYTES_SENT = REGISTRY.register(Counter(
+    'picamera_stream_bytes_sent_total', 'Bytes of the multipart frames sent to the stream clients'))
+
+CAPTURE_STAGE_SECONDS = REGISTRY.register(Histogram(
+    'picamera_capture_stage_seconds', 'Duration of the stages of a capture: grab, save and db_commit', ['stage']))
+CAPTURE_THREAD_ALIVE = REGISTRY.register(Gauge(
+    'picamera_capture_thread_alive', '1 if the capture thread is running, 0 otherwise'))
+CAPTURE_LAST_SUCCESS_TIMESTAMP = REGISTRY.register(Gauge(
+    'picamera_capture_last_success_timestamp_seconds', 'Unix time of the last stored capture'))
+CAPTURE_ERRORS = REGISTRY.register(Counter(
+    'picamera_capture_errors_total',
+    'Capture errors: frame grab failures that stop the capture thread, incomplete JPEGs and file or db write errors'))
+CAPTURES_BY_FRAME_SOURCE = REGISTRY.register(Counter(
+    'picamera_capture_frame_source_total', 'Captures by frame source: stream, camera, still or motion', ['source']))
+CAPTURE_QUEUE_SIZE = REGISTRY.register(Gauge(
+    'picamera_capture_queue_size', 'Captures waiting in the queue of the capture writer'))
+CAPTURES_DROPPED = REGISTRY.register(Counter(
+    'picamera_captures_dropped_total', 'Captures dropped because the capture writer queue was full', ['policy']))
+THUMBNAIL_REQUESTS = REGISTRY.register(Counter(
+    'picamera_thumbnail_requests_total', 'Thumbnail requests by result: hit or miss of the thumbnails cache',
+    ['result']))
+THUMBNAIL_CACHE_BYTES = REGISTRY.register(Gauge(
+    'picamera_thumbnail_cache_bytes', 'Bytes of the thumbnails in the thumbnails cache'))
+
+MOTION_DETECTION_SECONDS = REGISTRY.register(Histogram(
+    'picamera_motion_detection_seconds', 'Duration of the motion detection of a frame',
+    buckets=MOTION_DETECTION_BUCKETS))
+MOTION_CHANGED_FRACTION = REGISTRY.register(Gauge(
+    'picamera_motion_changed_fraction', 'Fraction of changed pixels of the last frame checked for motion'))
+
+# Expose the labeled metrics from the start
+GET_FRAME_SECONDS.labels('stream')
+GET_FRAME_SECONDS.labels('capture')
+for capture_stage in ('grab', 'save', 'db_commit'):
+    CAPTURE_STAGE_SECONDS.labels(capture_stage)
+for capture_frame_source in ('stream', 'camera', 'still', 'motion'):
+    CAPTURES_BY_FRAME_SOURCE.labels(capture_frame_source)
+for thumbnail_result in ('hit', 'miss'):
+    THUMBNAIL_REQUESTS.labels(thumbnail_result)
@@ -0,0 +1,391 @@
+"""
+    Minimal Prometheus metrics: counters, gauges and histograms rendered in the text exposition format.
+    The metrics are updated from the hot loops of the camera and the streams, so an update is only a lock and an
+    addition, the text is built when /metrics is scraped.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets in seconds of the latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    """
+    Format a sample value as expected by the exposition format
+
+    :param value:
+    :return:
+    """
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(label_names: Sequence[str], label_values: Sequence[str]) -> str:
+    """
+    Format the labels of a sample, ex. {stage="grab"}
+
+    :param label_names:
+    :param label_values:
+    :return: Labels string, empty if there are no labels
+    """
+    if not label_names:
+        return ''
+    labels = ('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"'))
+              for name, value in zip(label_names, label_values))
+    return '{' + ','.join(labels) + '}'
+
+
+class Metric(object):
+    """
+    Base class of the metrics, a metric has a child with the values for each combination of label values.
+    The metrics without labels are updated directly, the metrics with labels are updated through labels()
+    """
+
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        """
+        :param name: Metric name
+        :param documentation: Help text of the metric
+        :param label_names: Names of the labels of the metric
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.children: Dict[Tuple[str, ...], object] = dict()
+        # The metrics without labels are exposed from the start
+        if not self.label_names:
+            self.labels()
+
+    def _create_child(self):
+        """
+        Create the values of a combination of label values
+        :return:
+        """
+        raise NotImplementedError
+
+    def _get_child_samples(self, labels: Tuple[str, ...], child) -> List[str]:
+        """
+        Return the sample lines of a child
+
+        :param labels: Label values of the child
+        :param child:
+        :return:
+        """
+        raise NotImplementedError
+
+    def labels(self, *label_values: str):
+        """
+        Return the child of the label values, created if it doesn't exist
+
+        :param label_values: Values of the labels, in the order of label_names
+        :return:
+        """
+        child = self.children.get(label_values)
+        if child is None:
+            if len(label_values) != len(self.label_names):
+                raise ValueError('Metric {} expects the labels {}'.format(self.name, self.label_names))
+            with self.lock:
+                child = self.children.setdefault(label_values, self._create_child())
+        return child
+
+    def collect(self) -> List[str]:
+        """
+        Return the lines of the metric in the text exposition format
+
+        :return:
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.TYPE)]
+        for labels, child in sorted(self.children.items()):
+            lines.extend(self._get_child_samples(labels, child))
+        return lines
+
+
+class CounterValue(object):
+    """
+    Value of a counter
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        """
+        Increment the counter
+
+        :param amount: Amount to increment, must be positive
+        :return:
+        """
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """
+    Counter, a value that only goes up
+    """
+
+    TYPE = 'counter'
+
+    def _create_child(self) -> CounterValue:
+        return CounterValue()
+
+    def _get_child_samples(self, labels: Tuple[str, ...], child: CounterValue) -> List[str]:
+        return ['{}{} {}'.format(self.name, _format_labels(self.label_names, labels), _format_value(child.value))]
+
+    def inc(self, amount: float = 1.0) -> None:
+        """
+        Increment the counter of a metric without labels
+
+        :param amount:
+        :return:
+        """
+        self.labels().inc(amount)
+
+
+class GaugeValue(object):
+    """
+    Value of a gauge, set directly or read from a function when the metrics are collected
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        """
+        Set the gauge value
+
+        :param value:
+        :return:
+        """
+        with self.lock:
+            self.value = value
+
+    def set_to_current_time(self) -> None:
+        """
+        Set the gauge value to the current unix time
+
+        :return:
+        """
+        self.set(time.time())
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Read the gauge value from a function each time the metrics are collected
+
+        :param function:
+        :return:
+        """
+        self.function = function
+
+    def get(self) -> float:
+        """
+        Return the gauge value
+
+        :return:
+        """
+        if self.function:
+            return float(self.function())
+        return self.value
+
+
+class Gauge(Metric):
+    """
+    Gauge, a value that can go up and down
+    """
+
+    TYPE = 'gauge'
+
+    def _create_child(self) -> GaugeValue:
+        return GaugeValue()
+
+    def _get_child_samples(self, labels: Tuple[str, ...], child: GaugeValue) -> List[str]:
+        return ['{}{} {}'.format(self.name, _format_labels(self.label_names, labels), _format_value(child.get()))]
+
+    def set(self, value: float) -> None:
+        """
+        Set the value of a gauge without labels
+
+        :param value:
+        :return:
+        """
+        self.labels().set(value)
+
+    def set_to_current_time(self) -> None:
+        """
+        Set the value of a gauge without labels to the current unix time
+
+        :return:
+        """
+        self.labels().set_to_current_time()
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Read the value of a gauge without labels from a function when the metrics are collected
+
+        :param function:
+        :return:
+        """
+        self.labels().set_function(function)
+
+
+class HistogramValue(object):
+    """
+    Values of a histogram, the observations are counted in the first bucket with an upper bound bigger or equal
+    than the observation, the buckets are made cumulative when collected
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        """
+        :param buckets: Sorted upper bounds of the buckets, without +Inf
+        """
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Observe a value
+
+        :param value:
+        :return:
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        Observe the seconds spent in the context
+
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    """
+    Histogram, count of the observations in buckets and their sum
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        :param name: Metric name
+        :param documentation: Help text of the metric
+        :param label_names: Names of the labels of the metric
+        :param buckets: Upper bounds of the buckets, the +Inf bucket is added
+        """
+        self.buckets = tuple(sorted(bucket for bucket in buckets if not math.isinf(bucket)))
+        super(Histogram, self).__init__(name, documentation, label_names)
+
+    def _create_child(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+    def _get_child_samples(self, labels: Tuple[str, ...], child: HistogramValue) -> List[str]:
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+
+        lines = list()
+        label_names = self.label_names + ('le',)
+        cumulative_count = 0
+        for upper_bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative_count += count
+            lines.append('{}_bucket{} {}'.format(self.name,
+                                                 _format_labels(label_names, labels + (_format_value(upper_bound),)),
+                                                 cumulative_count))
+        formatted_labels = _format_labels(self.label_names, labels)
+        lines.append('{}_sum{} {}'.format(self.name, formatted_labels, _format_value(total)))
+        lines.append('{}_count{} {}'.format(self.name, formatted_labels, cumulative_count))
+        return lines
+
+    def observe(self, value: float) -> None:
+        """
+        Observe a value in a histogram without labels
+
+        :param value:
+        :return:
+        """
+        self.labels().observe(value)
+
+    def time(self):
+        """
+        Observe the seconds spent in the context in a histogram without labels
+
+        :return:
+        """
+        return self.labels().time()
+
+
+class MetricsRegistry(object):
+    """
+    Collection of the metrics exposed in /metrics
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = dict()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Register a metric, the metric names must be unique
+
+        :param metric:
+        :raises ValueError: If there is a metric with the same name
+        :return: The registered metric
+        """
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError('Duplicated metric {}'.format(metric.name))
+            self.metrics[metric.name] = metric
+        return metric
+
+    def generate_latest(self) -> str:
+        """
+        Return all the metrics in the text exposition format
+
+        :return:
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = list()
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """
+    Return the registry of the metrics
+    :return:
+    """
+    return REGISTRY
@@ -1,2 +1,3 @@
 from .captured_image import CapturedImage
+from .capture_count import CaptureCount
 from .user import User
@@ -0,0 +1,156 @@
+import datetime
+from collections import Counter
+from typing import Iterable, Optional
+from sqlalchemy import func
+from picamera_server import db
+from picamera_server.models.captured_image import CapturedImage
+
+
+class CaptureCount(db.Model):
+    """
+    Number of captures taken each day by each camera, and the total of captures of each camera. The counts are
+    updated in the same transaction as the inserts and deletions of the captures, so the totals are read from this
+    small table instead of counting the captured_image rows.
+
+    Fields:
+        - camera_id: id of the camera of the captures
+        - day: date of the captures, TOTAL_DAY for the row with the total of captures of the camera
+        - count: number of captures of the camera and the day
+    """
+    # Day of the row with the total of captures of a camera, before the day of any capture
+    TOTAL_DAY = datetime.date.min
+
+    camera_id = db.Column(db.String(64), name='camera_id', primary_key=True)
+    day = db.Column(db.Date, name='day', primary_key=True)
+    count = db.Column(db.Integer, name='count', nullable=False, default=0)
+
+    @staticmethod
+    def _add_count(camera_id: str, day: datetime.date, count: int) -> None:
+        """
+        Add to the count of a camera and a day, creating its row if it doesn't exist, in the current transaction of
+        the session
+
+        :param camera_id:
+        :param day:
+        :param count:
+        :return:
+        """
+        updated = CaptureCount.query.filter_by(camera_id=camera_id, day=day)\
+            .update({'count': CaptureCount.count + count}, synchronize_session=False)
+        if not updated:
+            db.session.add(CaptureCount(camera_id=camera_id, day=day, count=count))
+
+    @staticmethod
+    def add_captures(captured_images: Iterable[CapturedImage]) -> None:
+        """
+        Add the captures to the counts of their cameras and days and to the totals of their cameras, in the current
+        transaction of the session. The captures must have their created_at and camera_id set
+
+        :param captured_images:
+        :return:
+        """
+        days_counts = Counter((captured_image.camera_id, captured_image.created_at.date())
+                              for captured_image in captured_images)
+        cameras_totals = Counter()
+        for (camera_id, day), count in sorted(days_counts.items()):
+            CaptureCount._add_count(camera_id, day, count)
+            cameras_totals[camera_id] += count
+        for camera_id, total in sorted(cameras_totals.items()):
+            CaptureCount._add_count(camera_id, CaptureCount.TOTAL_DAY, total)
+
+    @staticmethod
+    def remove_all(camera_id: Optional[str] = None) -> None:
+        """
+        Remove the counts and the total of a camera, in the current transaction of the session
+
+        :param camera_id: None to remove the counts of all the cameras
+        :return:
+        """
+        query = CaptureCount.query
+        if camera_id is not None:
+            query = query.filter_by(camera_id=camera_id)
+        query.delete(synchronize_session=False)
+
+    @staticmethod
+    def rebuild() -> None:
+        """
+        Count again the captures of every camera and day and the totals, used when the counts are missing, ex. a
+        database created before the counts were maintained. It scans all the captures, so it's not run by the requests
+
+        :return:
+        """
+        CaptureCount.remove_all()
+        day = func.date(CapturedImage.created_at)
+        cameras_totals = Counter()
+        days_counts = db.session.query(CapturedImage.camera_id, day, func.count(CapturedImage.id))\
+            .group_by(CapturedImage.camera_id, day)
+        for camera_id, capture_day, count in days_counts:
+            db.session.add(CaptureCount(camera_id=camera_id, day=datetime.date.fromisoformat(capture_day),
+                                        count=count))
+            cameras_totals[camera_id] += count
+        for camera_id, total in cameras_totals.items():
+            db.session.add(CaptureCount(camera_id=camera_id, day=CaptureCount.TOTAL_DAY, count=total))
+        db.session.commit()
+
+    @staticmethod
+    def get_total(camera_id: Optional[str] = None) -> int:
+        """
+        Return the total number of captures of a camera, read from its total row
+
+        :param camera_id: None for the total of all the cameras
+        :return:
+        """
+        query = db.session.query(func.coalesce(func.sum(CaptureCount.count), 0))\
+            .filter(CaptureCount.day == CaptureCount.TOTAL_DAY)
+        if camera_id is not None:
+            query = query.filter(CaptureCount.camera_id == camera_id)
+        return query.scalar()
+
+    @staticmethod
+    def count_captures(date_from: Optional[datetime.datetime] = None,
+                       date_until: Optional[datetime.datetime] = None) -> int:
+        """
+        Return the number of captures of all the cameras taken between the dates, both included.
+        The days fully inside the range are read from the counts, only the captures of the first and the last day
+        when they are not full days are counted, with the created_at index
+
+        :param date_from: None to count from the first capture
+        :param date_until: None to count until the last capture
+        :return:
+        """
+        if not date_from and not date_until:
+            return CaptureCount.get_total()
+
+        # First and last days fully inside the range
+        first_day = last_day = None
+        if date_from:
+            first_day = date_from.date()
+            if date_from.time() != datetime.time.min:
+                first_day += datetime.timedelta(days=1)
+        if date_until:
+            last_day = date_until.date()
+            if date_until.time() != datetime.time.max:
+                last_day -= datetime.timedelta(days=1)
+
+        captures_query = CapturedImage.query
+        if first_day and last_day and first_day > last_day:
+            # Less than a full day, count the captures
+            return captures_query.filter(CapturedImage.created_at >= date_from,
+                                         CapturedImage.created_at <= date_until).count()
+
+        counts_query = db.session.query(func.coalesce(func.sum(CaptureCount.count), 0))\
+            .filter(CaptureCount.day > CaptureCount.TOTAL_DAY)
+        total = 0
+        if first_day:
+            counts_query = counts_query.filter(CaptureCount.day >= first_day)
+            first_day_start = datetime.datetime.combine(first_day, datetime.time.min)
+            if date_from < first_day_start:
+                total += captures_query.filter(CapturedImage.created_at >= date_from,
+                                               CapturedImage.created_at < first_day_start).count()
+        if last_day:
+            counts_query = counts_query.filter(CaptureCount.day <= last_day)
+            last_day_end = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time.min)
+            if date_until >= last_day_end:
+                total += captures_query.filter(CapturedImage.created_at >= last_day_end,
+                                               CapturedImage.created_at <= date_until).count()
+        return total + counts_query.scalar()
@@ -1,5 +1,6 @@
 import datetime
 from picamera_server import db
+from picamera_server.config.config import DEFAULT_CAMERA_ID
 
 
 class CapturedImage(db.Model):
@@ -9,8 +10,13 @@ class CapturedImage(db.Model):
     Fields:
         - relative_path: Relative path of the stored file based on the CAPTURES_DIR that was configured when the
         capture was created
-        - created_at: date of creation
+        - created_at: date of creation, indexed for the date filters of the captures pages
+        - camera_id: id of the camera of the capture, the captures created before the multi camera support belong to
+        the DEFAULT_CAMERA_ID
     """
     id = db.Column(db.Integer, name='id', primary_key=True, autoincrement=True)
     relative_path = db.Column(db.String(255), name='relative_path', nullable=False, unique=True)
-    created_at = db.Column(db.DateTime, name='created_at', nullable=False, default=datetime.datetime.now)
+    created_at = db.Column(db.DateTime, name='created_at', nullable=False, default=datetime.datetime.now,
+                           index=True)
+    camera_id = db.Column(db.String(64), name='camera_id', nullable=False, default=DEFAULT_CAMERA_ID,
+                          server_default=DEFAULT_CAMERA_ID)
@@ -1,7 +1,7 @@
 import os
 from picamera_server.config.logging_config import set_up_logging
 from picamera_server.config.config import FLASK_INSTANCE_FOLDER, APP_ENV_TESTING, APP_ENV_DEVELOPMENT,\
-    DevelopmentConfig, TestingConfig, APP_ENV
+    DevelopmentConfig, TestingConfig, APP_ENV, DEFAULT_CAMERA_ID
 from flask import Flask
 
 
@@ -18,12 +18,14 @@ def register_blueprints(app: Flask) -> None:
     from picamera_server.views.camera_view import camera
     from picamera_server.views.capture_mode_view import capture_mode
     from picamera_server.views.users_view import users
+    from picamera_server.views.metrics_view import metrics
 
     # Register Blueprints
     app.register_blueprint(home)
     app.register_blueprint(camera)
     app.register_blueprint(capture_mode)
     app.register_blueprint(users)
+    app.register_blueprint(metrics)
 
 
 def init_camera_controllers() -> None:
@@ -34,13 +36,16 @@ def init_camera_controllers() -> None:
     """
     from picamera_server.camera.camera_controllers import init_camera_controller, set_camera_class
     from picamera_server.camera.capture_controller import init_capture_controller
+    from picamera_server.camera.capture_writer import init_capture_writer
     from picamera_server.camera.test_camera import TestCamera
 
-    # Set TestCamera for the camera class when running with test environment
+    # Set TestCamera for the camera class and only the default camera when running with test environment
     if APP_ENV == APP_ENV_TESTING:
         set_camera_class(TestCamera)
-
-    init_camera_controller()
+        init_camera_controller([(DEFAULT_CAMERA_ID, '', '')])
+    else:
+        init_camera_controller()
+    init_capture_writer()
     init_capture_controller()
 
 
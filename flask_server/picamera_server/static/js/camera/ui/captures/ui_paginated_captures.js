@@ -4,8 +4,8 @@ function expandCapture(image) {
     let expandImg = document.getElementById("expandedImg");
     // Get the image text
     let imgText = document.getElementById("imgtext");
-    // Use the same src in the expanded image as the image being clicked on from the grid
-    expandImg.src = image.src;
+    // The grid shows the thumbnails, the full resolution capture is loaded only when it's expanded
+    expandImg.src = image.dataset.fullSrc;
     // Use the value of the alt attribute of the clickable image as text inside the expanded image
     imgText.innerHTML = image.alt;
     // Show the container element (hidden with CSS)
@@ -29,16 +29,14 @@ document.body.addEventListener("keydown", (event) => {
 // Redirect to get apply date filters
 function getCapturesFilteredByDate(){
     /**
-     * Redirect with the datetime filters applied.
+     * Redirect to the first page with the datetime filters applied, keeping the sort.
      * Action of button in datetime filter form
-     *
-     * @type {number}
      */
-    let pageNumber = 1;
     let datetimeFrom = document.getElementById('datetime-from-input').value;
     let datetimeUntil = document.getElementById('datetime-until-input').value;
     let capturesEndpoint = document.getElementById('capturesEndpoint').value;
-    let endpoint = `${window.location.origin}${capturesEndpoint}${pageNumber}/?datetimeFrom=${datetimeFrom}&datetimeUntil=${datetimeUntil}`;
+    let sort = document.getElementById('capturesSort').value;
+    let endpoint = `${window.location.origin}${capturesEndpoint}?sort=${sort}&datetimeFrom=${datetimeFrom}&datetimeUntil=${datetimeUntil}`;
     window.location.replace(endpoint);
     return false
 }
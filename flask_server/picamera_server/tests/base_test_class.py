@@ -32,6 +32,7 @@ class BaseTestClass(unittest.TestCase):
         cls.db.create_all()
         init_camera_controllers()
         shutil.rmtree(cls.app.config['CAPTURES_DIR'], ignore_errors=True)
+        shutil.rmtree(cls.app.config['THUMBNAILS_DIR'], ignore_errors=True)
 
     @classmethod
     def tearDownClass(cls) -> None:
@@ -41,3 +42,4 @@ class BaseTestClass(unittest.TestCase):
         """
         cls.db.drop_all()
         shutil.rmtree(cls.app.config['CAPTURES_DIR'], ignore_errors=True)
+        shutil.rmtree(cls.app.config['THUMBNAILS_DIR'], ignore_errors=True)
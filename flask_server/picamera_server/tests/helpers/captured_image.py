@@ -1,21 +1,22 @@
+import datetime
 import glob
 from typing import List, Optional
 from picamera_server import app
 from picamera_server.models import CapturedImage
-from picamera_server.camera.capture_controller import CaptureController
+from picamera_server.camera.capture_controller import get_capture_controller
 
 
-def create_test_captured_images(number: int = 1, date: Optional[str] = None) -> List[CapturedImage]:
+def create_test_captured_images(number: int = 1, date: Optional[datetime.datetime] = None) -> List[CapturedImage]:
     """
     Create test captured images files and database entries
 
     :param number: Number of captures to create
-    :param date: datetime with DB format to assign to the captures
+    :param date: Creation date to assign to the captures, None for now
     :return:
     """
     created = list()
     for i in range(number):
-        created.append(CaptureController.create_new_capture(date))
+        created.append(get_capture_controller().create_new_capture(date))
 
     return created
 
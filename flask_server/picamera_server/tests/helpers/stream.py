@@ -0,0 +1,37 @@
+import re
+from typing import BinaryIO, Iterator
+from picamera_server.camera.base_camera import Camera, MULTIPART_FRAME_TRAILER
+
+
+def next_multipart_frame(frames_iterator: Iterator[bytes]) -> bytes:
+    """
+    Read the chunks of the next multipart frame from a stream iterator and return them joined
+
+    :param frames_iterator: Iterator of the chunks of the stream
+    :return: Multipart frame
+    """
+    return b''.join(next(frames_iterator) for _ in Camera._get_multipart_frame(b''))
+
+
+def multipart_frame(frame: bytes) -> bytes:
+    """
+    Return the expected multipart frame of a frame with its chunks joined
+
+    :param frame:
+    :return: Multipart frame
+    """
+    return b''.join(Camera._get_multipart_frame(frame))
+
+
+def read_multipart_frame(response: BinaryIO) -> bytes:
+    """
+    Read the next multipart frame of a stream from a file like response, the frame is read with its Content-Length
+
+    :param response: Response of the stream, ex. http.client.HTTPResponse
+    :return: Multipart frame
+    """
+    header = b''
+    while not header.endswith(b'\r\n\r\n'):
+        header += response.readline()
+    content_length = int(re.search(rb'Content-Length: (\d+)', header).group(1))
+    return header + response.read(content_length + len(MULTIPART_FRAME_TRAILER))
@@ -0,0 +1,266 @@
+"""
+Test the asyncio stream server
+"""
+import asyncio
+import http.client
+import io
+import queue
+import socket
+import threading
+import time
+from PIL import Image
+from unittest.mock import patch
+from flask import url_for
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.stream import read_multipart_frame, multipart_frame
+from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.camera_controllers import get_camera_controller, get_frame_broadcaster
+from picamera_server.async_server.http_request import HttpRequest
+from picamera_server.async_server.server import AsyncStreamServer
+from picamera_server.views.camera_view import MIME_TYPE_MULTIPART_FRAME
+
+
+class TestAsyncStreamServer(BaseTestClass):
+    """
+    The server runs in an event loop in a background thread, listening in a free port
+    """
+
+    WSGI_THREADS = 2
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Start the async server
+        """
+        super(TestAsyncStreamServer, cls).setUpClass()
+        cls.loop = asyncio.new_event_loop()
+        cls.server = AsyncStreamServer(cls.app, '127.0.0.1', 0, wsgi_threads=cls.WSGI_THREADS)
+        cls.loop.run_until_complete(cls.server.start())
+        cls.server_thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """
+        Stop the async server
+        """
+        asyncio.run_coroutine_threadsafe(cls.server.close(), cls.loop).result(timeout=5)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.server_thread.join(timeout=5)
+        cls.loop.close()
+        super(TestAsyncStreamServer, cls).tearDownClass()
+
+    def _get_connection(self) -> http.client.HTTPConnection:
+        """
+        Return a connection to the async server
+        :return:
+        """
+        return http.client.HTTPConnection('127.0.0.1', self.server.port, timeout=5)
+
+    @staticmethod
+    def _wait_for_clients(clients: int) -> None:
+        """
+        Wait until the frame broadcaster has the expected number of clients
+
+        :param clients:
+        :return:
+        """
+        deadline = time.monotonic() + 5
+        while get_frame_broadcaster().clients != clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_get_ui_camera_stream_keep_alive(self):
+        """
+        Test that the Flask views are served by the async server, reusing the connection
+
+        :return:
+        """
+        # Mock and data
+        connection = self._get_connection()
+
+        # When
+        connection.request('GET', url_for('camera.ui_camera_stream'))
+        first_response = connection.getresponse()
+        first_body = first_response.read()
+        first_socket = connection.sock
+        connection.request('GET', url_for('camera.ui_camera_stream'))
+        second_response = connection.getresponse()
+        second_body = second_response.read()
+        connection.close()
+
+        # Validation
+        self.assertEqual(first_response.status, 200)
+        self.assertEqual(second_response.status, 200)
+        self.assertIn(b'<img', first_body)
+        self.assertEqual(first_body, second_body)
+        self.assertIs(connection.sock, None)
+        self.assertIsNotNone(first_socket)
+        self.assertEqual(first_response.getheader('Connection'), 'keep-alive')
+
+    def test_get_video_frame(self):
+        """
+        Test the Video stream endpoint served by a stream coroutine, the client is unsubscribed when it disconnects.
+        The Date header is the date of the response
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        connection = self._get_connection()
+        response_date = 'Sun, 18 Oct 2026 12:00:00 GMT'
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _, \
+                patch('picamera_server.async_server.http_request.formatdate', return_value=response_date):
+            # When
+            connection.request('GET', url_for('camera.video_frame'))
+            response = connection.getresponse()
+            self._wait_for_clients(1)
+            frames_queue.put(test_frames[0])
+            first_frame = read_multipart_frame(response)
+            frames_queue.put(test_frames[1])
+            second_frame = read_multipart_frame(response)
+            producer_thread = get_frame_broadcaster().producer_thread
+            response.close()
+            connection.close()
+            self._wait_for_clients(0)
+            frames_queue.put(test_frames[2])
+            producer_thread.join(timeout=5)
+
+        # Validation
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), MIME_TYPE_MULTIPART_FRAME)
+        self.assertEqual(response.getheader('Date'), response_date)
+        self.assertEqual(first_frame, multipart_frame(test_frames[0]))
+        self.assertEqual(second_frame, multipart_frame(test_frames[1]))
+        self.assertEqual(get_frame_broadcaster().clients, 0)
+        self.assertFalse(producer_thread.is_alive())
+
+    def test_get_video_frame_rendition(self):
+        """
+        Test the Video stream endpoint with a rendition, encoded out of the event loop
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        connection = self._get_connection()
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _:
+            # When
+            connection.request('GET', url_for('camera.video_frame', w=100, q=50))
+            response = connection.getresponse()
+            self._wait_for_clients(1)
+            frames_queue.put(test_frames[0])
+            frame = read_multipart_frame(response)
+            producer_thread = get_frame_broadcaster().producer_thread
+            response.close()
+            connection.close()
+            self._wait_for_clients(0)
+            frames_queue.put(test_frames[1])
+            producer_thread.join(timeout=5)
+
+        # Validation
+        image = Image.open(io.BytesIO(frame[frame.index(b'\r\n\r\n') + 4:]))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.width, 100)
+        self.assertFalse(producer_thread.is_alive())
+
+    def test_get_video_frame_invalid_fps(self):
+        """
+        Test that the invalid stream requests are answered by the Flask view
+
+        :return:
+        """
+        # Mock and data
+        connection = self._get_connection()
+
+        # When
+        connection.request('GET', url_for('camera.video_frame', fps='invalid'))
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+
+        # Validation
+        self.assertEqual(response.status, 400)
+        self.assertIn(b'Query argument fps', body)
+        self.assertEqual(get_frame_broadcaster().clients, 0)
+
+    def test_streams_dont_use_wsgi_threads(self):
+        """
+        Test that the pages are served while there are more open streams than WSGI threads
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        stream_connections = [self._get_connection() for _ in range(self.WSGI_THREADS * 2)]
+        page_connection = self._get_connection()
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _:
+            # When
+            for stream_connection in stream_connections:
+                stream_connection.request('GET', url_for('camera.video_frame'))
+            stream_responses = [stream_connection.getresponse() for stream_connection in stream_connections]
+            self._wait_for_clients(len(stream_connections))
+            page_connection.request('GET', url_for('camera.ui_camera_stream'))
+            page_response = page_connection.getresponse()
+            page_response.read()
+            frames_queue.put(test_frames[0])
+            frames = [read_multipart_frame(stream_response) for stream_response in stream_responses]
+            producer_thread = get_frame_broadcaster().producer_thread
+            for response, connection in zip(stream_responses, stream_connections):
+                response.close()
+                connection.close()
+            page_connection.close()
+            self._wait_for_clients(0)
+            frames_queue.put(test_frames[1])
+            producer_thread.join(timeout=5)
+
+        # Validation
+        self.assertEqual(page_response.status, 200)
+        self.assertEqual(frames, [multipart_frame(test_frames[0])] * len(stream_connections))
+        self.assertFalse(producer_thread.is_alive())
+
+    def test_bad_request(self):
+        """
+        Test the response to a malformed request
+
+        :return:
+        """
+        # When
+        with socket.create_connection(('127.0.0.1', self.server.port), timeout=5) as client:
+            client.sendall(b'INVALID REQUEST\r\n\r\n')
+            response = client.recv(1024)
+
+        # Validation
+        self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request\r\n'))
+
+    def test_http_request_environ(self):
+        """
+        Test the WSGI environ of a parsed request
+
+        :return:
+        """
+        # Mock and data
+        head = b'POST /login%20page?next=%2F HTTP/1.1\r\nHost: pi\r\nContent-Type: text/plain\r\n' \
+               b'Content-Length: 4\r\nX-Tag: a\r\nX-Tag: b\r\n\r\n'
+
+        # When
+        request = HttpRequest.parse(head)
+        environ = request.get_environ(b'body', ('127.0.0.1', 8080), ('127.0.0.2', 5000))
+
+        # Validation
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'], '/login page')
+        self.assertEqual(environ['QUERY_STRING'], 'next=%2F')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['CONTENT_LENGTH'], '4')
+        self.assertEqual(environ['HTTP_HOST'], 'pi')
+        self.assertEqual(environ['HTTP_X_TAG'], 'a,b')
+        self.assertEqual(environ['REMOTE_ADDR'], '127.0.0.2')
+        self.assertEqual(environ['wsgi.input'].read(), b'body')
+        self.assertEqual(request.content_length, 4)
+        self.assertTrue(request.keep_alive)
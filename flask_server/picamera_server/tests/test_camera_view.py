@@ -1,15 +1,26 @@
 """
 Test camera view
 """
+import io
+import queue
+import threading
+import time
+from PIL import Image
 from lxml import html
 from unittest.mock import patch, MagicMock
 from jinja2 import TemplateNotFound
 from flask import render_template, abort, Response, url_for
 from picamera_server.tests.base_test_class import BaseTestClass
-from picamera_server.camera.base_camera import Camera
+from picamera_server.tests.helpers.stream import next_multipart_frame, multipart_frame
+from picamera_server.camera.base_camera import Camera, FramePacer
+from picamera_server.config.config import STREAM_MAX_FPS
 from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.frame_broadcaster import FrameBroadcaster
+from picamera_server.camera.frame_mailbox import FrameMailbox
+from picamera_server.camera.renditions import Rendition
 from picamera_server.views.camera_view import TEMPLATES, UI_CAMERA_STREAM, MIME_TYPE_MULTIPART_FRAME,\
-    get_camera_controller
+    get_frame_broadcaster
+from picamera_server.camera.camera_controllers import get_camera_controller
 
 
 class TestCameraView(BaseTestClass):
@@ -34,7 +45,8 @@ class TestCameraView(BaseTestClass):
 
         self.assertEqual(200, response.status_code)
         self.assertTrue(html_tree.xpath(img_source_element_xpath), 'Img element to stream not found')
-        mock_render_template.assert_called_once_with(TEMPLATES[UI_CAMERA_STREAM], section='stream')
+        mock_render_template.assert_called_once_with(TEMPLATES[UI_CAMERA_STREAM], section='stream',
+                                                     stream_urls=[url_for('camera.video_frame')])
 
     @patch('picamera_server.views.camera_view.abort')
     @patch('picamera_server.views.camera_view.render_template')
@@ -77,9 +89,9 @@ class TestCameraView(BaseTestClass):
         mock_stream_with_context.return_value = test_generator
         mock_response.side_effect = Response
 
-        expected_multipart_frames = [Camera._get_multipart_frame(test_frames[0]),
-                                     Camera._get_multipart_frame(test_frames[1]),
-                                     Camera._get_multipart_frame(test_frames[2])]
+        expected_multipart_frames = [multipart_frame(test_frames[0]),
+                                     multipart_frame(test_frames[1]),
+                                     multipart_frame(test_frames[2])]
 
         with patch.object(TestCamera, 'get_frame', side_effect=test_frames) as _:
             # When
@@ -92,33 +104,470 @@ class TestCameraView(BaseTestClass):
             self.assertEqual(response.is_streamed, True)
             self.assertEqual(response.content_type, MIME_TYPE_MULTIPART_FRAME)
             response_iterator = response.iter_encoded()
-            self.assertEqual(next(response_iterator), expected_multipart_frames[0])
-            self.assertEqual(next(response_iterator), expected_multipart_frames[1])
-            self.assertEqual(next(response_iterator), expected_multipart_frames[2])
+            self.assertEqual(next_multipart_frame(response_iterator), expected_multipart_frames[0])
+            self.assertEqual(next_multipart_frame(response_iterator), expected_multipart_frames[1])
+            self.assertEqual(next_multipart_frame(response_iterator), expected_multipart_frames[2])
             self.assertRaises(RuntimeError, response_iterator.__next__)
             self.assertRaises(StopIteration, response_iterator.__next__)
 
-    @patch('time.sleep')
     @patch('time.time')
-    def test_get_video_frame_test_camera_2(self, mock_time: MagicMock, mock_sleep: MagicMock):
+    def test_get_video_frame_test_camera_2(self, mock_time: MagicMock):
         """
         Test the Video stream endpoint
-        Test that the same frame is always returned from test camera based on time.time
+        Test that the same frame is not sent twice, the frame of the test camera changes based on time.time
 
-        :param mock_sleep: mock time.sleep to make test run faster
         :param mock_time: Magic mock of time.time to force the selected frame
         :return:
         """
         # Mock and data
         mock_time.return_value = 3
         test_frames = get_camera_controller().frames
-        expected_multipart_frame = Camera._get_multipart_frame(test_frames[0])
+        expected_multipart_frames = [multipart_frame(test_frames[0]),
+                                     multipart_frame(test_frames[1]),
+                                     multipart_frame(test_frames[2])]
 
         # When
         response = self.client.get(url_for('camera.video_frame'))
+        response_iterator = response.iter_encoded()
+        first_frame = next_multipart_frame(response_iterator)
+        mock_time.return_value = 4
+        second_frame = next_multipart_frame(response_iterator)
+        mock_time.return_value = 5
+        third_frame = next_multipart_frame(response_iterator)
+        producer_thread = get_frame_broadcaster().producer_thread
+        response.close()
+        producer_thread.join(timeout=5)
 
         # Validation
-        response_iterator = response.iter_encoded()
-        self.assertEqual(next(response_iterator), expected_multipart_frame)
-        self.assertEqual(next(response_iterator), expected_multipart_frame)
-        self.assertEqual(next(response_iterator), expected_multipart_frame)
+        self.assertEqual([first_frame, second_frame, third_frame], expected_multipart_frames)
+        self.assertFalse(producer_thread.is_alive())
+
+    def test_get_snapshot(self):
+        """
+        Test the snapshot endpoint, the frame is captured once by the producer and the requests with
+        the ETag of the frame get a 304
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        broadcaster = get_frame_broadcaster()
+        frames_queue.put(test_frames[0])
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as mock_get_frame:
+            # When
+            response = self.client.get(url_for('camera.snapshot'))
+            etag = response.headers['ETag']
+            not_modified_response = self.client.get(url_for('camera.snapshot'), headers={'If-None-Match': etag})
+            other_etag_response = self.client.get(url_for('camera.snapshot'), headers={'If-None-Match': '"old"'})
+
+            # Stop the producer blocked in get_frame
+            producer_thread = broadcaster.producer_thread
+            broadcaster.keep_alive_until = 0
+            frames_queue.put(test_frames[0])
+            producer_thread.join(timeout=5)
+
+        # Validation
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.content_type, 'image/jpeg')
+        self.assertEqual(response.data, test_frames[0])
+        self.assertEqual(etag, '"{}-{}"'.format(broadcaster.boot_id, broadcaster.sequence))
+        self.assertEqual(304, not_modified_response.status_code)
+        self.assertEqual(not_modified_response.data, b'')
+        self.assertEqual(200, other_etag_response.status_code)
+        self.assertEqual(mock_get_frame.call_count, 2)
+        self.assertFalse(producer_thread.is_alive())
+
+    @patch('picamera_server.views.camera_view.get_frame_broadcaster')
+    def test_get_snapshot_no_frame(self, mock_get_frame_broadcaster: MagicMock):
+        """
+        Test the snapshot endpoint when there is no frame from the camera
+
+        :param mock_get_frame_broadcaster: Magic mock of get_frame_broadcaster
+        :return:
+        """
+        # Mock
+        mock_get_frame_broadcaster.return_value.get_snapshot.return_value = (0, b'')
+
+        # When
+        response = self.client.get(url_for('camera.snapshot'))
+
+        # Validation
+        self.assertEqual(503, response.status_code)
+
+    def test_frames_generator_skip_same_frame(self):
+        """
+        Test that the camera frames generator doesn't send a frame equal to the last one sent
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        camera_frames = [test_frames[0], test_frames[0], bytes(test_frames[0]), test_frames[1]]
+
+        with patch.object(TestCamera, 'get_frame', side_effect=camera_frames) as _:
+            # When
+            frames_generator = get_camera_controller().frames_generator()
+
+            # Validation
+            self.assertEqual(next_multipart_frame(frames_generator), multipart_frame(test_frames[0]))
+            self.assertEqual(next_multipart_frame(frames_generator), multipart_frame(test_frames[1]))
+            self.assertRaises(RuntimeError, frames_generator.__next__)
+
+    @patch('picamera_server.views.camera_view.get_frame_broadcaster')
+    def test_get_video_frame_fps(self, mock_get_frame_broadcaster: MagicMock):
+        """
+        Test that the fps query argument is used as the target fps of the stream
+
+        :param mock_get_frame_broadcaster: Magic mock of get_frame_broadcaster
+        :return:
+        """
+        # Mock
+        mock_get_frame_broadcaster.return_value.frames_generator.return_value = iter([b''])
+
+        # When
+        response = self.client.get(url_for('camera.video_frame', fps=5))
+
+        # Validation
+        self.assertEqual(200, response.status_code)
+        mock_get_frame_broadcaster.return_value.frames_generator.assert_called_once_with(5.0, None, None, '127.0.0.1')
+
+    @patch('picamera_server.views.camera_view.get_frame_broadcaster')
+    def test_get_video_frame_rendition(self, mock_get_frame_broadcaster: MagicMock):
+        """
+        Test that the width and quality query arguments are used to select the rendition of the stream
+
+        :param mock_get_frame_broadcaster: Magic mock of get_frame_broadcaster
+        :return:
+        """
+        # Mock
+        mock_get_frame_broadcaster.return_value.frames_generator.return_value = iter([b''])
+
+        # When
+        response = self.client.get(url_for('camera.video_frame', w=640, q=60))
+
+        # Validation
+        self.assertEqual(200, response.status_code)
+        mock_get_frame_broadcaster.return_value.frames_generator.assert_called_once_with(None, 640, 60, '127.0.0.1')
+
+    def test_get_video_frame_invalid_rendition(self):
+        """
+        Test the Video stream endpoint with invalid width and quality values
+
+        :return:
+        """
+        for query_arguments in [{'w': 'invalid'}, {'w': 1}, {'w': 100000}, {'q': 0}, {'q': 100}]:
+            # When
+            response = self.client.get(url_for('camera.video_frame', **query_arguments))
+
+            # Validation
+            self.assertEqual(400, response.status_code)
+            self.assertIn('Query argument', str(response.data))
+
+    def test_get_video_frame_invalid_fps(self):
+        """
+        Test the Video stream endpoint with invalid fps values
+
+        :return:
+        """
+        for fps in ['invalid', '0', '-1']:
+            # When
+            response = self.client.get(url_for('camera.video_frame', fps=fps))
+
+            # Validation
+            self.assertEqual(400, response.status_code)
+            self.assertIn('Query argument fps', str(response.data))
+
+    def test_multipart_frame_chunks(self):
+        """
+        Test the chunks of a multipart frame, the frame is not copied and the header has its Content-Length
+
+        :return:
+        """
+        # Mock and data
+        test_frame = get_camera_controller().frames[0]
+        expected_header = 'Content-Length: {}\r\n\r\n'.format(len(test_frame)).encode()
+
+        # When
+        header, frame, trailer = Camera._get_multipart_frame(test_frame)
+
+        # Validation
+        self.assertTrue(header.startswith(b'--frame\r\nContent-Type: image/jpeg\r\n'))
+        self.assertTrue(header.endswith(expected_header))
+        self.assertIs(frame, test_frame)
+        self.assertEqual(trailer, b'\r\n')
+
+    def test_frame_pacer_interval(self):
+        """
+        Test the frame pacer interval, limited by STREAM_MAX_FPS
+
+        :return:
+        """
+        self.assertEqual(FramePacer(5).interval, 0.2)
+        self.assertEqual(FramePacer(STREAM_MAX_FPS * 10).interval, 1.0 / STREAM_MAX_FPS)
+        self.assertEqual(FramePacer().interval, 1.0 / STREAM_MAX_FPS)
+
+class TestFrameBroadcaster(BaseTestClass):
+
+    def test_frames_shared_between_clients(self):
+        """
+        Test that the frames captured by the producer are shared between all the clients,
+        each frame is captured only once
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        broadcaster = FrameBroadcaster(get_camera_controller())
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as mock_get_frame:
+            # When
+            client_1 = broadcaster.subscribe()
+            client_2 = broadcaster.subscribe()
+            frames_queue.put(test_frames[0])
+            client_1_first = client_1.get(timeout=5)
+            client_2_first = client_2.get(timeout=5)
+            frames_queue.put(test_frames[1])
+            client_1_second = client_1.get(timeout=5)
+            client_2_second = client_2.get(timeout=5)
+
+            # Unsubscribe and release the producer blocked in get_frame
+            producer_thread = broadcaster.producer_thread
+            broadcaster.unsubscribe(client_1)
+            broadcaster.unsubscribe(client_2)
+            frames_queue.put(test_frames[2])
+            producer_thread.join(timeout=5)
+
+            # Validation
+            self.assertEqual(client_1_first, (1, test_frames[0], Camera._get_multipart_frame(test_frames[0])))
+            self.assertEqual(client_1_first, client_2_first)
+            self.assertEqual(client_1_second, (2, test_frames[1], Camera._get_multipart_frame(test_frames[1])))
+            self.assertEqual(client_1_second, client_2_second)
+            self.assertEqual(mock_get_frame.call_count, 3)
+            self.assertFalse(producer_thread.is_alive())
+            self.assertIsNone(broadcaster.producer_thread)
+
+    def test_frames_generator_unsubscribe_on_close(self):
+        """
+        Test that the client is unsubscribed when the stream generator is closed
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        broadcaster = FrameBroadcaster(get_camera_controller())
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _:
+            # When
+            frames_generator = broadcaster.frames_generator()
+            frames_queue.put(test_frames[0])
+            first_frame = next_multipart_frame(frames_generator)
+            clients_streaming = broadcaster.clients
+            producer_thread = broadcaster.producer_thread
+            frames_generator.close()
+            frames_queue.put(test_frames[1])
+            producer_thread.join(timeout=5)
+
+            # Validation
+            self.assertEqual(first_frame, multipart_frame(test_frames[0]))
+            self.assertEqual(clients_streaming, 1)
+            self.assertEqual(broadcaster.clients, 0)
+            self.assertFalse(producer_thread.is_alive())
+
+    def test_slow_client_gets_latest_frame(self):
+        """
+        Test that a slow client gets the newest frame and counts the replaced frames,
+        while a fast client gets every frame
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        broadcaster = FrameBroadcaster(get_camera_controller())
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _:
+            # When
+            fast_client = broadcaster.subscribe('fast')
+            slow_client = broadcaster.subscribe('slow')
+            slow_client.set_sending(True)
+            fast_client_frames = list()
+            for test_frame in test_frames:
+                frames_queue.put(test_frame)
+                fast_client_frames.append(fast_client.get(timeout=5)[1])
+            slow_client_frame = slow_client.get(timeout=5)[1]
+            clients_stats = broadcaster.get_clients_stats()
+
+            producer_thread = broadcaster.producer_thread
+            broadcaster.unsubscribe(fast_client)
+            broadcaster.unsubscribe(slow_client)
+            frames_queue.put(test_frames[0])
+            producer_thread.join(timeout=5)
+
+        # Validation
+        self.assertEqual(fast_client_frames, test_frames)
+        self.assertIs(slow_client_frame, test_frames[2])
+        self.assertEqual([(stats['client'], stats['delivered'], stats['dropped'], stats['skipped'])
+                          for stats in clients_stats], [('fast', 3, 0, 0), ('slow', 1, 2, 0)])
+
+    def test_mailbox_skipped_frames(self):
+        """
+        Test that the frames replaced while the client is not sending are counted as skipped
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        mailbox = FrameMailbox()
+
+        # When
+        for sequence, test_frame in enumerate(test_frames):
+            mailbox.put((sequence, test_frame, Camera._get_multipart_frame(test_frame)))
+        frame = mailbox.take()
+        empty_mailbox_frame = mailbox.take()
+
+        # Validation
+        self.assertEqual(frame, (2, test_frames[2], Camera._get_multipart_frame(test_frames[2])))
+        self.assertIsNone(empty_mailbox_frame)
+        self.assertEqual((mailbox.delivered, mailbox.dropped, mailbox.skipped), (1, 0, 2))
+
+    @patch('picamera_server.views.camera_view.get_frame_broadcaster')
+    def test_get_stream_clients(self, mock_get_frame_broadcaster: MagicMock):
+        """
+        Test the endpoint with the counters of the stream clients
+
+        :param mock_get_frame_broadcaster: Magic mock of get_frame_broadcaster
+        :return:
+        """
+        # Mock and data
+        clients_stats = [{'client': '127.0.0.1', 'connected_at': 1.0, 'delivered': 10, 'dropped': 2, 'skipped': 0}]
+        mock_get_frame_broadcaster.return_value.get_clients_stats.return_value = clients_stats
+
+        # When
+        response = self.client.get(url_for('camera.stream_clients'))
+
+        # Validation
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.get_json(), clients_stats)
+
+    def test_stop_interrupts_error_backoff(self):
+        """
+        Test that stopping the broadcaster ends the producer without waiting out the error backoff
+
+        :return:
+        """
+        # Mock and data
+        broadcaster = FrameBroadcaster(get_camera_controller())
+        broadcaster.PRODUCER_ERROR_BACKOFF = 60.0
+        get_frame_called = threading.Event()
+
+        def get_frame_error():
+            get_frame_called.set()
+            raise IOError('Camera error')
+
+        with patch.object(TestCamera, 'get_frame', side_effect=get_frame_error) as _:
+            # When
+            client = broadcaster.subscribe()
+            producer_thread = broadcaster.producer_thread
+            get_frame_called.wait(timeout=5)
+            start = time.monotonic()
+            broadcaster.stop()
+            producer_thread.join(timeout=5)
+            elapsed = time.monotonic() - start
+            broadcaster.unsubscribe(client)
+
+        # Validation
+        self.assertFalse(producer_thread.is_alive())
+        self.assertLess(elapsed, 5)
+        self.assertIsNone(broadcaster.producer_thread)
+
+
+class TestRenditions(BaseTestClass):
+
+    def test_rendition_encode(self):
+        """
+        Test that the rendition is resized keeping the aspect ratio
+
+        :return:
+        """
+        # Mock and data
+        test_frame = get_camera_controller().frames[0]
+        rendition = Rendition(64, 50)
+
+        # When
+        encoded_frame = rendition.encode(test_frame)
+
+        # Validation
+        encoded_image = Image.open(io.BytesIO(encoded_frame))
+        self.assertEqual(encoded_image.format, 'JPEG')
+        self.assertEqual(encoded_image.size, (64, 64))
+
+    def test_rendition_encoded_once_per_frame(self):
+        """
+        Test that the rendition encodes each frame only once for all the clients
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        rendition = Rendition(64, 50)
+
+        with patch.object(Rendition, 'encode', side_effect=[b'first', b'second']) as mock_encode:
+            # When
+            first_frames = [rendition.get_multipart_frame(test_frames[0]) for _ in range(3)]
+            second_frames = [rendition.get_multipart_frame(test_frames[1]) for _ in range(3)]
+
+        # Validation
+        self.assertEqual(first_frames, [Camera._get_multipart_frame(b'first')] * 3)
+        self.assertEqual(second_frames, [Camera._get_multipart_frame(b'second')] * 3)
+        self.assertEqual(mock_encode.call_count, 2)
+
+    def test_rendition_shared_and_evicted(self):
+        """
+        Test that the clients watching the same rendition share the encoded frames,
+        and that the rendition is evicted when there are no viewers left
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        frames_queue = queue.Queue()
+        broadcaster = FrameBroadcaster(get_camera_controller())
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _,\
+                patch.object(Rendition, 'encode', side_effect=[b'first', b'second']) as mock_encode:
+            # When
+            client_1 = broadcaster.frames_generator(width=64, quality=50)
+            client_2 = broadcaster.frames_generator(width=64, quality=50)
+            frames_queue.put(test_frames[0])
+            client_1_first_frame = next_multipart_frame(client_1)
+            # Wait for client 2 to subscribe before the next frame is captured
+            client_2_frames = list()
+            client_2_thread = threading.Thread(target=lambda: client_2_frames.append(next_multipart_frame(client_2)))
+            client_2_thread.start()
+            while broadcaster.clients < 2:
+                time.sleep(0.01)
+            frames_queue.put(test_frames[1])
+            client_1_second_frame = next_multipart_frame(client_1)
+            client_2_thread.join(timeout=5)
+            client_2_first_frame = client_2_frames[0]
+            rendition = broadcaster.rendition_cache.renditions[(64, 50)]
+            viewers_streaming = rendition.viewers
+            producer_thread = broadcaster.producer_thread
+            client_1.close()
+            viewers_after_close = rendition.viewers
+            client_2.close()
+            frames_queue.put(test_frames[2])
+            producer_thread.join(timeout=5)
+
+        # Validation
+        self.assertEqual(client_1_first_frame, multipart_frame(b'first'))
+        self.assertEqual(client_2_first_frame, multipart_frame(b'second'))
+        self.assertEqual(client_1_second_frame, client_2_first_frame)
+        self.assertEqual(mock_encode.call_count, 2)
+        self.assertEqual(viewers_streaming, 2)
+        self.assertEqual(viewers_after_close, 1)
+        self.assertEqual(broadcaster.rendition_cache.renditions, dict())
@@ -0,0 +1,151 @@
+"""
+Test capture controller
+"""
+import io
+import os
+import subprocess
+import sys
+from PIL import Image
+from unittest.mock import patch, MagicMock
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.captured_image import captured_images_files
+from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.frame_broadcaster import FrameBroadcaster
+from picamera_server.camera.capture_controller import CaptureController, get_capture_controller
+from picamera_server.camera.camera_controllers import get_camera_controller
+from picamera_server.config.config import CAPTURE_FRAME_SOURCE_DEDICATED
+
+
+class TestCaptureController(BaseTestClass):
+
+    @patch('picamera_server.camera.capture_controller.get_frame_broadcaster')
+    def test_capture_reuses_fresh_stream_frame(self, mock_get_frame_broadcaster: MagicMock):
+        """
+        Test that a capture reuses the latest stream frame when it's fresh, without capturing the camera
+
+        :param mock_get_frame_broadcaster: Magic mock of get_frame_broadcaster
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        broadcaster = FrameBroadcaster(get_camera_controller())
+        broadcaster._publish(test_frames[1])
+        mock_get_frame_broadcaster.return_value = broadcaster
+
+        with patch.object(TestCamera, 'get_frame') as mock_get_frame:
+            # When
+            frame = get_capture_controller()._grab_capture_frame()
+
+        # Validation
+        self.assertIs(frame, test_frames[1])
+        mock_get_frame.assert_not_called()
+
+    @patch('picamera_server.camera.capture_controller.get_frame_broadcaster')
+    def test_capture_stale_stream_frame(self, mock_get_frame_broadcaster: MagicMock):
+        """
+        Test that a capture takes a frame from the camera when the stream frame is older than FRAME_MAX_AGE
+
+        :param mock_get_frame_broadcaster: Magic mock of get_frame_broadcaster
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+        broadcaster = FrameBroadcaster(get_camera_controller())
+        broadcaster._publish(test_frames[1])
+        broadcaster.frame_time -= CaptureController.FRAME_MAX_AGE + 1
+        mock_get_frame_broadcaster.return_value = broadcaster
+
+        with patch.object(TestCamera, 'get_frame', return_value=test_frames[2]) as mock_get_frame:
+            # When
+            frame = get_capture_controller()._grab_capture_frame()
+
+        # Validation
+        self.assertIs(frame, test_frames[2])
+        mock_get_frame.assert_called_once()
+
+    def test_capture_dedicated(self):
+        """
+        Test that a dedicated still capture is taken when asked or with the 'dedicated' frame source
+
+        :return:
+        """
+        # Mock and data
+        test_frames = get_camera_controller().frames
+
+        with patch.object(TestCamera, 'get_still_frame', return_value=test_frames[0]) as mock_get_still_frame:
+            # When
+            asked_frame = get_capture_controller()._grab_capture_frame(dedicated=True)
+            with patch.object(CaptureController, 'FRAME_SOURCE', CAPTURE_FRAME_SOURCE_DEDICATED):
+                configured_frame = get_capture_controller()._grab_capture_frame()
+
+        # Validation
+        self.assertIs(asked_frame, test_frames[0])
+        self.assertIs(configured_frame, test_frames[0])
+        self.assertEqual(mock_get_still_frame.call_count, 2)
+
+    def test_invalid_capture_frame_source(self):
+        """
+        Test that the config rejects an unknown CAPTURE_FRAME_SOURCE at startup
+
+        :return:
+        """
+        # Mock and data
+        server_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, CAPTURE_FRAME_SOURCE='video')
+
+        # When
+        result = subprocess.run([sys.executable, '-c', 'import picamera_server.config.config'], cwd=server_root,
+                                env=env, capture_output=True, timeout=30)
+
+        # Validation
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(b'Invalid CAPTURE_FRAME_SOURCE video', result.stderr)
+
+    def test_save_capture_as_is(self):
+        """
+        Test that the capture is stored with the camera JPEG bytes, and no temp file is left
+        """
+        # Mock and data
+        test_frame = get_camera_controller().frames[0]
+
+        # When
+        relative_path = get_capture_controller()._save_capture_to_file(test_frame)
+
+        # Validation
+        file_path = os.path.join(self.app.config['CAPTURES_DIR'], relative_path)
+        with open(file_path, 'rb') as capture_file:
+            self.assertEqual(capture_file.read(), test_frame)
+        self.assertFalse([name for name in os.listdir(os.path.dirname(file_path)) if name.endswith('.tmp')])
+
+    def test_save_incomplete_capture(self):
+        """
+        Test that a capture without the JPEG start or end of image markers, or with the end of image marker before the
+        checked tail, is not stored
+        """
+        # Mock and data
+        test_frame = get_camera_controller().frames[0]
+        files_before = captured_images_files()
+        padding = b'\x00' * CaptureController.JPEG_TAIL_SIZE
+
+        # When / Validation
+        for incomplete_capture in [test_frame[:-100], test_frame[2:], b'', test_frame + padding]:
+            with self.assertRaises(ValueError):
+                get_capture_controller()._save_capture_to_file(incomplete_capture)
+        self.assertEqual(captured_images_files(), files_before)
+
+    def test_save_capture_reencoded(self):
+        """
+        Test that the capture is encoded again only when the REENCODE_QUALITY is set
+        """
+        # Mock and data
+        test_frame = get_camera_controller().frames[0]
+
+        # When
+        with patch.object(CaptureController, 'REENCODE_QUALITY', 50):
+            relative_path = get_capture_controller()._save_capture_to_file(test_frame)
+
+        # Validation
+        with open(os.path.join(self.app.config['CAPTURES_DIR'], relative_path), 'rb') as capture_file:
+            reencoded_capture = capture_file.read()
+        self.assertNotEqual(reencoded_capture, test_frame)
+        self.assertEqual(Image.open(io.BytesIO(reencoded_capture)).size, Image.open(io.BytesIO(test_frame)).size)
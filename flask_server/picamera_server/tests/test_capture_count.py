@@ -0,0 +1,166 @@
+"""
+Test capture counts
+"""
+import datetime
+from unittest.mock import patch
+from sqlalchemy import inspect
+from picamera_server.config.config import DEFAULT_CAMERA_ID
+from picamera_server.config.database import migrate_database
+from picamera_server.models import CapturedImage, CaptureCount
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.captured_image import create_test_captured_images
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.camera.camera_controllers import get_camera_controller
+from picamera_server.camera.capture_writer import CaptureWriter
+
+
+class TestCaptureCount(BaseTestClass):
+
+    def setUp(self) -> None:
+        """
+        Clean up the captures of the previous test
+        :return:
+        """
+        get_capture_controller().remove_all_captures()
+
+    def _get_days_counts(self) -> dict:
+        """
+        Return the counts of the days, without the total
+        :return:
+        """
+        return {capture_count.day: capture_count.count for capture_count in CaptureCount.query.all()
+                if capture_count.day != CaptureCount.TOTAL_DAY}
+
+    def test_counts_maintained(self):
+        """
+        Test that the counts of the days and the total are updated with the new captures and removed with all the
+        captures
+        """
+        # Mock and data
+        first_day = datetime.datetime(2020, 1, 1, 23, 59)
+        second_day = datetime.datetime(2020, 1, 2, 0, 0)
+
+        # When
+        create_test_captured_images(3, first_day)
+        create_test_captured_images(2, second_day)
+        days_counts = self._get_days_counts()
+        total_count = CaptureCount.query.get((DEFAULT_CAMERA_ID, CaptureCount.TOTAL_DAY)).count
+        total_captures = get_capture_controller().get_total_captures()
+        get_capture_controller().remove_all_captures()
+
+        # Validation
+        self.assertEqual(days_counts, {first_day.date(): 3, second_day.date(): 2})
+        self.assertEqual(total_count, 5)
+        self.assertEqual(total_captures, 5)
+        self.assertEqual(get_capture_controller().get_total_captures(), 0)
+        self.assertEqual(CaptureCount.query.count(), 0)
+
+    def test_counts_written_batch(self):
+        """
+        Test that a batch of the capture writer updates the counts in its transaction, and a failed batch doesn't
+        """
+        # Mock and data
+        frames = get_camera_controller().frames
+        capture_time = datetime.datetime(2020, 1, 1, 12)
+        captures = [(get_capture_controller(), frames[i], capture_time + datetime.timedelta(seconds=i))
+                    for i in range(2)]
+        failed_captures = [(get_capture_controller(), frames[2], capture_time + datetime.timedelta(seconds=2))]
+        capture_writer = CaptureWriter()
+
+        # When
+        capture_writer.write_batch(captures)
+        with patch.object(self.db.session, 'commit', side_effect=Exception('Test')):
+            capture_writer.write_batch(failed_captures)
+
+        # Validation
+        self.assertEqual(self._get_days_counts(), {capture_time.date(): 2})
+        self.assertEqual(CaptureCount.get_total(), 2)
+        self.assertEqual(CapturedImage.query.count(), 2)
+
+    def test_count_captures_range(self):
+        """
+        Test that the counts of the date ranges, with full and partial days, are the same as counting the captures
+        """
+        # Mock and data
+        start_time = datetime.datetime(2020, 1, 1)
+        for hours in range(0, 96, 5):
+            create_test_captured_images(1, start_time + datetime.timedelta(hours=hours))
+        create_test_captured_images(1, datetime.datetime(2020, 1, 2, 23, 59, 59, 999999))
+        ranges = [
+            (None, None),
+            (datetime.datetime(2020, 1, 1, 10), None),
+            (None, datetime.datetime(2020, 1, 3, 10)),
+            (datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 3)),
+            (datetime.datetime(2020, 1, 1, 7, 30), datetime.datetime(2020, 1, 3, 22, 15)),
+            (datetime.datetime(2020, 1, 2, 4), datetime.datetime(2020, 1, 2, 16)),
+            (datetime.datetime(2020, 1, 2, 16), datetime.datetime(2020, 1, 2, 4)),
+            (datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 2, 23, 59, 59, 999999)),
+        ]
+
+        for date_from, date_until in ranges:
+            # When
+            count = CaptureCount.count_captures(date_from, date_until)
+
+            # Validation
+            query = CapturedImage.query
+            if date_from:
+                query = query.filter(CapturedImage.created_at >= date_from)
+            if date_until:
+                query = query.filter(CapturedImage.created_at <= date_until)
+            self.assertEqual(count, query.count(), (date_from, date_until))
+
+    def test_migrate_database_rebuilds_counts(self):
+        """
+        Test that the counts are rebuilt for a database with captures and without counts
+        """
+        # Mock and data
+        first_day = datetime.datetime(2020, 1, 1, 12)
+        create_test_captured_images(3, first_day)
+        create_test_captured_images(1, first_day + datetime.timedelta(days=1))
+        expected_days_counts = self._get_days_counts()
+        CaptureCount.remove_all()
+        self.db.session.commit()
+
+        # When
+        migrate_database(self.db)
+
+        # Validation
+        self.assertEqual(self._get_days_counts(), expected_days_counts)
+        self.assertEqual(get_capture_controller().get_total_captures(), 4)
+
+    def test_migrate_database_rebuilds_total(self):
+        """
+        Test that the counts are rebuilt for a database with the counts of the days and without the total
+        """
+        # Mock and data
+        create_test_captured_images(3, datetime.datetime(2020, 1, 1, 12))
+        CaptureCount.query.filter_by(day=CaptureCount.TOTAL_DAY).delete()
+        self.db.session.commit()
+
+        # When
+        total_before = CaptureCount.get_total()
+        migrate_database(self.db)
+
+        # Validation
+        self.assertEqual(total_before, 0)
+        self.assertEqual(CaptureCount.get_total(), 3)
+        self.assertEqual(self._get_days_counts(), {datetime.date(2020, 1, 1): 3})
+
+    def test_migrate_database_counts_per_camera(self):
+        """
+        Test that the counts table created before the counts were kept per camera is created again and rebuilt
+        """
+        # Mock and data
+        create_test_captured_images(2, datetime.datetime(2020, 1, 1, 12))
+        CaptureCount.__table__.drop(self.db.engine)
+        self.db.engine.execute('CREATE TABLE capture_count (day DATE NOT NULL PRIMARY KEY, count INTEGER NOT NULL)')
+        self.db.engine.execute("INSERT INTO capture_count (day, count) VALUES ('2020-01-01', 2)")
+
+        # When
+        migrate_database(self.db)
+
+        # Validation
+        columns = [column['name'] for column in inspect(self.db.engine).get_columns('capture_count')]
+        self.assertIn('camera_id', columns)
+        self.assertEqual(self._get_days_counts(), {datetime.date(2020, 1, 1): 2})
+        self.assertEqual(get_capture_controller().get_total_captures(), 2)
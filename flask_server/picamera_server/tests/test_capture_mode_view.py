@@ -4,8 +4,8 @@ Test camera view
 import time
 import shutil
 import os
-import math
 from datetime import datetime, timedelta
+from typing import List
 from lxml import html
 from unittest.mock import patch, MagicMock
 from jinja2 import TemplateNotFound
@@ -15,10 +15,13 @@ from picamera_server.tests.base_test_class import BaseTestClass
 from picamera_server.views.capture_mode_view import TEMPLATES, UI_CONFIG_CAPTURE_MODE, FORM_STATUS,\
     FORM_CAPTURE_INTERVAL, UI_CAPTURES_PAGINATED
 from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.camera.capture_writer import get_capture_writer
 from picamera_server.camera.camera_controllers import get_camera_controller
 from picamera_server.camera.test_camera import TestCamera
 from picamera_server.tests.helpers.captured_image import create_test_captured_images, captured_images_files
-from picamera_server.views.helpers.captures import get_captures_grids, FRONTEND_TS_FORMAT
+from picamera_server.views.helpers.captures import get_captures_grids, FRONTEND_TS_FORMAT, SORT_ASC, SORT_DESC,\
+    PAGE_PREV, format_cursor, parse_cursor, get_capture_key, get_captures_page, get_capture_etag
+from picamera_server.config.config import CAPTURE_CACHE_MAX_AGE
 
 
 class TestCaptureModeView(BaseTestClass):
@@ -259,6 +262,7 @@ class TestCaptureModeView(BaseTestClass):
             self.assertEqual(302, response.status_code)
             self.assertEqual(get_capture_controller().CAPTURING_STATUS, False)
             self.assertEqual(get_capture_controller().CAPTURING_THREAD, None)
+            self.assertTrue(get_capture_writer().flush(timeout=5))
             db_captures = CapturedImage.query.all()
             db_captures_files_paths = [os.path.join(self.app.config['CAPTURES_DIR'], capture.relative_path)
                                        for capture in db_captures]
@@ -358,8 +362,73 @@ class TestCaptureModeView(BaseTestClass):
         # Validation
         self.assertEqual(200, response.status_code)
         mock_send_from_directory.assert_called_once_with(self.app.config['CAPTURES_DIR'],
-                                                         created_images[0].relative_path.replace('\\', '/'))
+                                                         created_images[0].relative_path.replace('\\', '/'),
+                                                         conditional=False, add_etags=False,
+                                                         cache_timeout=CAPTURE_CACHE_MAX_AGE)
         self.assertEqual(response.mimetype, 'image/jpeg')
+        response.close()
+
+    def test_get_captured_image_cache_headers(self):
+        """
+        Test the strong ETag of the capture id and the immutable Cache-Control of a captured image,
+        and the 304 response to a conditional request with the ETag
+
+        :return:
+        """
+        # Mock and data
+        created_image = create_test_captured_images()[0]
+        endpoint = url_for('capture_mode.get_captured_image', relative_path=created_image.relative_path)
+
+        # When
+        response = self.client.get(endpoint)
+        etag = response.headers['ETag']
+        response.close()
+        conditional_response = self.client.get(endpoint, headers={'If-None-Match': etag})
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(etag, '"{}"'.format(get_capture_etag(created_image)))
+        self.assertTrue(etag.startswith('"capture-{}-'.format(created_image.id)))
+        self.assertEqual(response.cache_control.max_age, CAPTURE_CACHE_MAX_AGE)
+        self.assertTrue(response.cache_control.immutable)
+        self.assertTrue(response.cache_control.private)
+        self.assertFalse(response.cache_control.public)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(conditional_response.status_code, 304)
+        self.assertEqual(conditional_response.data, b'')
+        self.assertEqual(conditional_response.headers['ETag'], etag)
+
+    def test_get_captured_image_range(self):
+        """
+        Test the Range requests of a captured image, a valid range, a range with If-Range and an invalid range
+
+        :return:
+        """
+        # Mock and data
+        created_image = create_test_captured_images()[0]
+        endpoint = url_for('capture_mode.get_captured_image', relative_path=created_image.relative_path)
+        with open(os.path.join(self.app.config['CAPTURES_DIR'], created_image.relative_path), 'rb') as capture_file:
+            capture = capture_file.read()
+        etag = '"{}"'.format(get_capture_etag(created_image))
+
+        # When
+        range_response = self.client.get(endpoint, headers={'Range': 'bytes=100-'})
+        if_range_response = self.client.get(endpoint, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+        stale_if_range_response = self.client.get(endpoint, headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+        invalid_range_response = self.client.get(endpoint, headers={'Range': 'bytes={}-'.format(len(capture))})
+
+        # Validation
+        self.assertEqual(range_response.status_code, 206)
+        self.assertEqual(range_response.data, capture[100:])
+        self.assertEqual(range_response.headers['Content-Range'],
+                         'bytes 100-{}/{}'.format(len(capture) - 1, len(capture)))
+        self.assertEqual(if_range_response.status_code, 206)
+        self.assertEqual(if_range_response.data, capture[:10])
+        self.assertEqual(stale_if_range_response.status_code, 200)
+        self.assertEqual(stale_if_range_response.data, capture)
+        self.assertEqual(invalid_range_response.status_code, 416)
+        for response in [range_response, if_range_response, stale_if_range_response, invalid_range_response]:
+            response.close()
 
 
 class TestCaptureModeViewPagination(BaseTestClass):
@@ -384,14 +453,14 @@ class TestCaptureModeViewPagination(BaseTestClass):
         # Mock and data
         render_template_mock.side_effect = render_template
         number_test_images = 15
-        total_pages = math.ceil(number_test_images / self.app.config['ITEMS_PER_PAGE'])
         created_images = create_test_captured_images(number_test_images)
         expected_grids = get_captures_grids(created_images[:self.app.config['ITEMS_PER_PAGE']])
         expected_data = {
             'captures_grids': expected_grids,
-            'total_pages': total_pages,
             'total_captures': number_test_images,
-            'current_page': 1,
+            'next_cursor': format_cursor(get_capture_key(created_images[self.app.config['ITEMS_PER_PAGE'] - 1])),
+            'prev_cursor': None,
+            'sort': SORT_ASC,
             'date_from': '',
             'date_until': ''
         }
@@ -422,14 +491,14 @@ class TestCaptureModeViewPagination(BaseTestClass):
         # Images filtered out
         create_test_captured_images(10, mock_datetime_created + timedelta(minutes=-1))
         number_test_images = 15
-        total_pages = math.ceil(number_test_images / self.app.config['ITEMS_PER_PAGE'])
         created_images = create_test_captured_images(number_test_images, mock_datetime_created)
         expected_grids = get_captures_grids(created_images[:self.app.config['ITEMS_PER_PAGE']])
         expected_data = {
             'captures_grids': expected_grids,
-            'total_pages': total_pages,
             'total_captures': number_test_images,
-            'current_page': 1,
+            'next_cursor': format_cursor(get_capture_key(created_images[self.app.config['ITEMS_PER_PAGE'] - 1])),
+            'prev_cursor': None,
+            'sort': SORT_ASC,
             'date_from': datetime_created_frontend_str,
             'date_until': ''
         }
@@ -437,7 +506,6 @@ class TestCaptureModeViewPagination(BaseTestClass):
 
         # When
         endpoint = url_for('capture_mode.ui_captures_paginated',
-                           page_number=1,
                            datetimeFrom=datetime_created_frontend_str)
 
         response = self.client.get(endpoint)
@@ -467,14 +535,14 @@ class TestCaptureModeViewPagination(BaseTestClass):
         create_test_captured_images(10, datetime_until_filtered)
 
         number_test_images = 15
-        total_pages = math.ceil(number_test_images / self.app.config['ITEMS_PER_PAGE'])
         created_images = create_test_captured_images(number_test_images, mock_datetime_created)
         expected_grids = get_captures_grids(created_images[:self.app.config['ITEMS_PER_PAGE']])
         expected_data = {
             'captures_grids': expected_grids,
-            'total_pages': total_pages,
             'total_captures': number_test_images,
-            'current_page': 1,
+            'next_cursor': format_cursor(get_capture_key(created_images[self.app.config['ITEMS_PER_PAGE'] - 1])),
+            'prev_cursor': None,
+            'sort': SORT_ASC,
             'date_from': '',
             'date_until': datetime_until_frontend_str
         }
@@ -482,7 +550,6 @@ class TestCaptureModeViewPagination(BaseTestClass):
 
         # When
         endpoint = url_for('capture_mode.ui_captures_paginated',
-                           page_number=1,
                            datetimeUntil=datetime_until_frontend_str)
         response = self.client.get(endpoint)
 
@@ -514,14 +581,14 @@ class TestCaptureModeViewPagination(BaseTestClass):
         create_test_captured_images(10, mock_datetime_created + timedelta(minutes=-2))
 
         number_test_images = 15
-        total_pages = math.ceil(number_test_images / self.app.config['ITEMS_PER_PAGE'])
         created_images = create_test_captured_images(number_test_images, mock_datetime_created)
         expected_grids = get_captures_grids(created_images[:self.app.config['ITEMS_PER_PAGE']])
         expected_data = {
             'captures_grids': expected_grids,
-            'total_pages': total_pages,
             'total_captures': number_test_images,
-            'current_page': 1,
+            'next_cursor': format_cursor(get_capture_key(created_images[self.app.config['ITEMS_PER_PAGE'] - 1])),
+            'prev_cursor': None,
+            'sort': SORT_ASC,
             'date_from': datetime_from_frontend_str,
             'date_until': datetime_until_frontend_str
         }
@@ -529,7 +596,6 @@ class TestCaptureModeViewPagination(BaseTestClass):
 
         # When
         endpoint = url_for('capture_mode.ui_captures_paginated',
-                           page_number=1,
                            datetimeFrom=datetime_from_frontend_str,
                            datetimeUntil=datetime_until_frontend_str)
         response = self.client.get(endpoint)
@@ -540,3 +606,149 @@ class TestCaptureModeViewPagination(BaseTestClass):
                                                      section='captures')
         self.assertEqual(get_capture_controller().get_total_captures(), total_db_captures)
         self.assertEqual(response.status_code, 200)
+
+    def _get_all_pages(self, sort: str) -> List[List[int]]:
+        """
+        Walk all the pages following the next cursors and return the ids of the captures of each page
+
+        :param sort: Sort of the pages
+        :return:
+        """
+        pages = list()
+        cursor = None
+        while True:
+            captures, cursor, _ = get_captures_page(CapturedImage.query, self.app.config['ITEMS_PER_PAGE'], sort,
+                                                    parse_cursor(cursor) if cursor else None)
+            pages.append([capture.id for capture in captures])
+            if not cursor:
+                return pages
+
+    def test_keyset_pagination_next_and_prev(self) -> None:
+        """
+        Test that the next cursors walk all the captures in order, with captures sharing the created_at,
+        and that the previous cursors walk back the same pages
+
+        :return:
+        """
+        # Mock and data
+        items_per_page = self.app.config['ITEMS_PER_PAGE']
+        mock_datetime_created = datetime(year=2020, month=1, day=1, hour=1, minute=1, second=1)
+        created_images = create_test_captured_images(6, mock_datetime_created + timedelta(minutes=1))
+        created_images = create_test_captured_images(6, mock_datetime_created) + created_images
+        expected_ids = sorted([image.id for image in created_images],
+                              key=lambda image_id: (CapturedImage.query.get(image_id).created_at, image_id))
+
+        # When
+        asc_pages = self._get_all_pages(SORT_ASC)
+        desc_pages = self._get_all_pages(SORT_DESC)
+        last_page_first = CapturedImage.query.get(asc_pages[-1][0])
+        prev_page, next_cursor, prev_cursor = get_captures_page(CapturedImage.query, items_per_page, SORT_ASC,
+                                                                get_capture_key(last_page_first), PAGE_PREV)
+
+        # Validation
+        self.assertEqual([len(page) for page in asc_pages], [5, 5, 2])
+        self.assertEqual(sum(asc_pages, []), expected_ids)
+        self.assertEqual(sum(desc_pages, []), expected_ids[::-1])
+        self.assertEqual([capture.id for capture in prev_page], asc_pages[-2])
+        self.assertEqual(next_cursor, format_cursor(get_capture_key(prev_page[-1])))
+        self.assertEqual(prev_cursor, format_cursor(get_capture_key(prev_page[0])))
+        first_page, _, first_prev_cursor = get_captures_page(CapturedImage.query, items_per_page, SORT_ASC,
+                                                             parse_cursor(prev_cursor), PAGE_PREV)
+        self.assertEqual([capture.id for capture in first_page], asc_pages[0])
+        self.assertIsNone(first_prev_cursor)
+
+    def test_keyset_pagination_jump_to(self) -> None:
+        """
+        Test the jump to a timestamp in both sorts, and jumping after the last capture
+
+        :return:
+        """
+        # Mock and data
+        items_per_page = self.app.config['ITEMS_PER_PAGE']
+        mock_datetime_created = datetime(year=2020, month=1, day=1, hour=1, minute=1, second=1)
+        for minutes in range(10):
+            create_test_captured_images(1, mock_datetime_created + timedelta(minutes=minutes))
+        jump_to = mock_datetime_created + timedelta(minutes=4, seconds=30)
+
+        # When
+        asc_page, asc_next_cursor, asc_prev_cursor = get_captures_page(CapturedImage.query, items_per_page, SORT_ASC,
+                                                                       jump_to=jump_to)
+        desc_page, _, desc_prev_cursor = get_captures_page(CapturedImage.query, items_per_page, SORT_DESC,
+                                                           jump_to=jump_to)
+        after_page, after_next_cursor, after_prev_cursor = get_captures_page(
+            CapturedImage.query, items_per_page, SORT_ASC, jump_to=mock_datetime_created + timedelta(days=1))
+
+        # Validation
+        self.assertEqual([capture.created_at.minute for capture in asc_page], [6, 7, 8, 9, 10])
+        self.assertIsNone(asc_next_cursor)
+        self.assertEqual(asc_prev_cursor, format_cursor(get_capture_key(asc_page[0])))
+        self.assertEqual([capture.created_at.minute for capture in desc_page], [5, 4, 3, 2, 1])
+        self.assertIsNotNone(desc_prev_cursor)
+        self.assertEqual(after_page, [])
+        self.assertIsNone(after_next_cursor)
+        previous_page, _, _ = get_captures_page(CapturedImage.query, items_per_page, SORT_ASC,
+                                                parse_cursor(after_prev_cursor), PAGE_PREV)
+        self.assertEqual([capture.created_at.minute for capture in previous_page], [6, 7, 8, 9, 10])
+
+    def test_get_keyset_pagination_links(self) -> None:
+        """
+        Test the next and previous links of a page in the middle
+
+        :return:
+        """
+        # Mock and data
+        created_images = create_test_captured_images(12)
+        cursor = format_cursor(get_capture_key(created_images[4]))
+
+        # When
+        response = self.client.get(url_for('capture_mode.ui_captures_paginated', cursor=cursor, sort=SORT_ASC))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        tree = html.fromstring(response.data)
+        links = [link.get('href') for link in tree.xpath('//div[@class="pagination"]/a')]
+        self.assertEqual(links, [
+            url_for('capture_mode.ui_captures_paginated', cursor=format_cursor(get_capture_key(created_images[5])),
+                    direction=PAGE_PREV, sort=SORT_ASC, datetimeFrom='', datetimeUntil=''),
+            url_for('capture_mode.ui_captures_paginated', cursor=format_cursor(get_capture_key(created_images[9])),
+                    sort=SORT_ASC, datetimeFrom='', datetimeUntil='')
+        ])
+
+    @patch('picamera_server.views.capture_mode_view.abort')
+    def test_get_keyset_pagination_bad_request(self, mock_abort: MagicMock) -> None:
+        """
+        Test that invalid sort, direction, cursor or jumpTo are a bad request
+
+        :param mock_abort: Magic mock of abort
+        :return:
+        """
+        # Mock and data
+        mock_abort.side_effect = abort
+        invalid_args = [{'sort': 'random'}, {'direction': 'up'}, {'cursor': 'page-5000'}, {'jumpTo': 'yesterday'}]
+
+        for args in invalid_args:
+            # When
+            response = self.client.get(url_for('capture_mode.ui_captures_paginated', **args))
+
+            # Validation
+            self.assertEqual(response.status_code, 400, args)
+        self.assertEqual(mock_abort.call_count, len(invalid_args))
+
+    def test_get_page_number_redirect(self) -> None:
+        """
+        Test that the old page number route redirects to the first page of the captures keeping the sort and dates
+
+        :return:
+        """
+        # Mock and data
+        filters = {'sort': SORT_DESC, 'datetimeFrom': '2020-01-01T12:00', 'datetimeUntil': '2020-01-02T12:00'}
+
+        # When
+        response = self.client.get(url_for('capture_mode.ui_captures_page_number', page_number=3, **filters))
+        response_without_filters = self.client.get(url_for('capture_mode.ui_captures_page_number', page_number=3))
+
+        # Validation
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response.location, url_for('capture_mode.ui_captures_paginated', _external=True, **filters))
+        self.assertEqual(response_without_filters.location,
+                         url_for('capture_mode.ui_captures_paginated', _external=True))
@@ -0,0 +1,330 @@
+"""
+Test capture writer
+"""
+import datetime
+import threading
+import time
+from typing import List
+from unittest.mock import patch
+from picamera_server import db
+from picamera_server.models import CapturedImage
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.captured_image import captured_images_files
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.camera.camera_controllers import get_camera_controller
+from picamera_server.camera.capture_writer import CaptureWriter, QueuedCapture, get_capture_writer
+from picamera_server.config.config import CAPTURE_WRITER_OVERFLOW_DROP_OLDEST, CAPTURE_WRITER_OVERFLOW_DROP_NEWEST
+
+
+class TestCaptureWriter(BaseTestClass):
+
+    def setUp(self) -> None:
+        """
+        Clean up the captures of the previous test
+        :return:
+        """
+        get_capture_controller().remove_all_captures()
+
+    @staticmethod
+    def _get_test_captures(number: int) -> List[QueuedCapture]:
+        """
+        Return queued captures of the test camera frames, one second apart so their files have different names
+
+        :param number:
+        :return:
+        """
+        frames = get_camera_controller().frames
+        start_time = datetime.datetime(2020, 1, 1, 12)
+        return [(get_capture_controller(), frames[i % len(frames)], start_time + datetime.timedelta(seconds=i))
+                for i in range(number)]
+
+    def test_invalid_overflow_policy(self):
+        """
+        Test that an invalid overflow policy raises ValueError
+        :return:
+        """
+        # When / Validation
+        with self.assertRaises(ValueError):
+            CaptureWriter(overflow_policy='invalid')
+
+    def test_overflow_drop_newest(self):
+        """
+        Test that the new capture is dropped when the queue is full with the drop_newest policy
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter(max_size=2, overflow_policy=CAPTURE_WRITER_OVERFLOW_DROP_NEWEST)
+
+        # When
+        queued = [capture_writer.submit(capture) for capture in captures]
+
+        # Validation
+        self.assertEqual(queued, [True, True, False])
+        self.assertEqual(list(capture_writer.queue), captures[:2])
+        self.assertEqual(capture_writer.dropped, 1)
+
+    def test_overflow_drop_oldest(self):
+        """
+        Test that the oldest queued capture is dropped when the queue is full with the drop_oldest policy
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter(max_size=2, overflow_policy=CAPTURE_WRITER_OVERFLOW_DROP_OLDEST)
+
+        # When
+        queued = [capture_writer.submit(capture) for capture in captures]
+
+        # Validation
+        self.assertEqual(queued, [True, True, True])
+        self.assertEqual(list(capture_writer.queue), captures[1:])
+        self.assertEqual(capture_writer.dropped, 1)
+        self.assertEqual(len(capture_writer.queued_times), 2)
+
+    def test_overflow_block(self):
+        """
+        Test that a capture waits for room in the queue when the queue is full with the block policy
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter(max_size=2, batch_size=1)
+        for capture in captures[:2]:
+            capture_writer.submit(capture)
+        submit_thread = threading.Thread(target=capture_writer.submit, args=(captures[2],), daemon=True)
+
+        # When
+        submit_thread.start()
+        submit_thread.join(timeout=0.2)
+        blocked = submit_thread.is_alive()
+        batch = capture_writer._take_batch()
+        submit_thread.join(timeout=5)
+
+        # Validation
+        self.assertTrue(blocked)
+        self.assertFalse(submit_thread.is_alive())
+        self.assertEqual(batch, captures[:1])
+        self.assertEqual(list(capture_writer.queue), captures[1:])
+        self.assertEqual(capture_writer.dropped, 0)
+
+    def test_write_batch_one_commit(self):
+        """
+        Test that the captures of a batch are written and committed in one transaction
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter()
+
+        # When
+        with patch.object(db.session, 'commit', wraps=db.session.commit) as mock_commit:
+            captured_images = capture_writer.write_batch(captures)
+
+        # Validation
+        mock_commit.assert_called_once()
+        self.assertEqual(len(captured_images), 3)
+        self.assertEqual(CapturedImage.query.count(), 3)
+        self.assertEqual([captured_image.created_at for captured_image in CapturedImage.query.all()],
+                         [capture_time for _, _, capture_time in captures])
+        self.assertEqual(len(captured_images_files()), 3)
+
+    def test_write_batch_commit_error(self):
+        """
+        Test that the files of a batch are removed when the transaction fails
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(2)
+        capture_writer = CaptureWriter()
+
+        # When
+        with patch.object(db.session, 'commit', side_effect=Exception('Test')):
+            captured_images = capture_writer.write_batch(captures)
+
+        # Validation
+        self.assertEqual(captured_images, [])
+        self.assertEqual(CapturedImage.query.count(), 0)
+        self.assertEqual(captured_images_files(), [])
+
+    def test_close_drains_queue(self):
+        """
+        Test that the queued captures are written when the writer is closed, and no captures are accepted after it
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(5)
+        capture_writer = CaptureWriter(batch_size=2)
+        for capture in captures:
+            capture_writer.submit(capture)
+
+        # When
+        capture_writer.start()
+        capture_writer.close(timeout=5)
+
+        # Validation
+        self.assertIsNone(capture_writer.writer_thread)
+        self.assertEqual(capture_writer.size, 0)
+        self.assertEqual(CapturedImage.query.count(), 5)
+        self.assertEqual(len(captured_images_files()), 5)
+        self.assertFalse(capture_writer.submit(captures[0]))
+
+    def test_flush(self):
+        """
+        Test that flush waits until the queued captures are committed
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter()
+        capture_writer.start()
+
+        # When
+        for capture in captures:
+            capture_writer.submit(capture)
+        flushed = capture_writer.flush(timeout=5)
+
+        # Validation
+        self.assertTrue(flushed)
+        self.assertEqual(CapturedImage.query.count(), 3)
+        capture_writer.close(timeout=5)
+
+    def _wait_for_captures(self, number: int, timeout: float = 5) -> None:
+        """
+        Wait until the number of captures are committed
+
+        :param number:
+        :param timeout: Max seconds to wait
+        :return:
+        """
+        deadline = time.monotonic() + timeout
+        while CapturedImage.query.count() < number and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_group_commit_batch_size(self):
+        """
+        Test that the captures are committed in one transaction as soon as batch_size captures are queued
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter(batch_size=3, flush_interval=60000)
+        capture_writer.start()
+
+        # When
+        with patch.object(db.session, 'commit', wraps=db.session.commit) as mock_commit:
+            for capture in captures:
+                capture_writer.submit(capture)
+            self._wait_for_captures(3)
+            capture_writer.close(timeout=5)
+
+        # Validation
+        self.assertEqual(CapturedImage.query.count(), 3)
+        mock_commit.assert_called_once()
+
+    def test_group_commit_flush_interval(self):
+        """
+        Test that the captures of an incomplete batch are committed together after flush_interval milliseconds
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(2)
+        capture_writer = CaptureWriter(batch_size=10, flush_interval=200)
+        capture_writer.start()
+
+        # When
+        with patch.object(db.session, 'commit', wraps=db.session.commit) as mock_commit:
+            start_time = time.monotonic()
+            for capture in captures:
+                capture_writer.submit(capture)
+            committed_early = CapturedImage.query.count()
+            self._wait_for_captures(2)
+            elapsed = time.monotonic() - start_time
+            capture_writer.close(timeout=5)
+
+        # Validation
+        self.assertEqual(committed_early, 0)
+        self.assertEqual(CapturedImage.query.count(), 2)
+        self.assertGreaterEqual(elapsed, 0.2)
+        mock_commit.assert_called_once()
+
+    def test_take_batch_oldest_queued_time(self):
+        """
+        Test that after a batch is taken the flush interval of the captures left in the queue starts when they were
+        queued, and not when the captures of the taken batch were queued
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(3)
+        capture_writer = CaptureWriter(batch_size=2, flush_interval=60000)
+        with patch('picamera_server.camera.capture_writer.time.monotonic', side_effect=[10.0, 20.0, 30.0]):
+            for capture in captures:
+                capture_writer.submit(capture)
+
+        # When
+        batch = capture_writer._take_batch()
+
+        # Validation
+        self.assertEqual(batch, captures[:2])
+        self.assertEqual(list(capture_writer.queue), captures[2:])
+        self.assertEqual(capture_writer.oldest_queued_time, 30.0)
+
+    def test_flush_incomplete_batch(self):
+        """
+        Test that flush commits the captures of an incomplete batch without waiting for flush_interval
+        :return:
+        """
+        # Mock and data
+        captures = self._get_test_captures(2)
+        capture_writer = CaptureWriter(batch_size=10, flush_interval=60000)
+        capture_writer.start()
+        for capture in captures:
+            capture_writer.submit(capture)
+
+        # When
+        flushed = capture_writer.flush(timeout=5)
+
+        # Validation
+        self.assertTrue(flushed)
+        self.assertEqual(CapturedImage.query.count(), 2)
+        self.assertFalse(capture_writer.flush_requested)
+        capture_writer.close(timeout=5)
+
+    def test_get_total_captures_without_flush(self):
+        """
+        Test that the total of captures is read without waiting for the captures queued in the capture writer
+        :return:
+        """
+        # Mock and data
+        frame = get_camera_controller().frames[0]
+        capture_writer = CaptureWriter()
+
+        # When
+        with patch('picamera_server.camera.capture_controller.get_capture_writer', return_value=capture_writer), \
+                patch.object(capture_writer, 'flush') as mock_flush:
+            get_capture_controller().queue_new_capture(frame)
+            total_captures = get_capture_controller().get_total_captures()
+
+        # Validation
+        self.assertEqual(total_captures, 0)
+        mock_flush.assert_not_called()
+
+    def test_queue_new_capture(self):
+        """
+        Test that the capture controller queues the captures in the capture writer
+        :return:
+        """
+        # Mock and data
+        frame = get_camera_controller().frames[0]
+        capture_writer = CaptureWriter()
+
+        # When
+        with patch('picamera_server.camera.capture_controller.get_capture_writer', return_value=capture_writer):
+            queued = get_capture_controller().queue_new_capture(frame)
+
+        # Validation
+        self.assertTrue(queued)
+        self.assertEqual(capture_writer.size, 1)
+        capture_controller, queued_frame, _ = capture_writer.queue[0]
+        self.assertIs(capture_controller, get_capture_controller())
+        self.assertIs(queued_frame, frame)
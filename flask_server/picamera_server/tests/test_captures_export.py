@@ -0,0 +1,221 @@
+"""
+Test export of the captures
+"""
+import csv
+import io
+import os
+import tarfile
+import zipfile
+from datetime import datetime, timedelta
+from typing import List
+from unittest.mock import patch
+from flask import url_for
+from picamera_server.models import CapturedImage
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.captured_image import create_test_captured_images
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.views.capture_mode_view import CAPTURES_CLI_GROUP, CAPTURES_EXPORT_COMMAND
+from picamera_server.views.helpers.captures import FRONTEND_TS_FORMAT, iterate_captures
+from picamera_server.views.helpers.captures_export import CapturesExport, EXPORT_FORMAT_ZIP, EXPORT_FORMAT_TAR,\
+    MANIFEST_NAME, MANIFEST_FIELDS
+
+
+class TestCapturesExport(BaseTestClass):
+
+    def setUp(self) -> None:
+        """
+        Clean up the captures of the previous test
+        :return:
+        """
+        get_capture_controller().remove_all_captures()
+
+    def _read_capture(self, capture: CapturedImage) -> bytes:
+        """
+        Return the bytes of the file of a capture
+        :param capture:
+        :return:
+        """
+        with open(os.path.join(self.app.config['CAPTURES_DIR'], capture.relative_path), 'rb') as capture_file:
+            return capture_file.read()
+
+    def _get_manifest(self, captures: List[CapturedImage]) -> List[List[str]]:
+        """
+        Return the expected manifest rows of the captures
+        :param captures:
+        :return:
+        """
+        return [MANIFEST_FIELDS] + [[str(capture.id), capture.camera_id, capture.created_at.isoformat(),
+                                     capture.relative_path] for capture in captures]
+
+    def test_iterate_captures(self):
+        """
+        Test that all the captures are iterated in order of (created_at, id) reading them in batches
+        """
+        # Mock and data
+        capture_time = datetime(2020, 1, 1, 12)
+        captures = create_test_captured_images(3, capture_time + timedelta(minutes=1))
+        captures = create_test_captured_images(4, capture_time) + captures
+
+        # When
+        iterated_captures = list(iterate_captures(CapturedImage.query, 2))
+        iterated_captures_exact_batches = list(iterate_captures(CapturedImage.query, 7))
+
+        # Validation
+        self.assertEqual([capture.id for capture in iterated_captures], [capture.id for capture in captures])
+        self.assertEqual([capture.id for capture in iterated_captures_exact_batches],
+                         [capture.id for capture in captures])
+
+    def test_export_zip(self):
+        """
+        Test the ZIP export of the captures of a date range, with the manifest and the captures as stored entries
+        """
+        # Mock and data
+        capture_time = datetime(2020, 1, 1, 12, 30)
+        create_test_captured_images(2, capture_time - timedelta(minutes=1))
+        captures = create_test_captured_images(3, capture_time)
+        create_test_captured_images(2, capture_time + timedelta(minutes=1))
+
+        # When
+        response = self.client.get(url_for('capture_mode.export_captures',
+                                           datetimeFrom=capture_time.strftime(FRONTEND_TS_FORMAT),
+                                           datetimeUntil=capture_time.strftime(FRONTEND_TS_FORMAT)))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        self.assertTrue(response.is_streamed)
+        self.assertIn('captures_20200101T1230_20200101T1230.zip', response.headers['Content-Disposition'])
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [MANIFEST_NAME] + [capture.relative_path for capture in captures])
+            manifest = list(csv.reader(io.StringIO(archive.read(MANIFEST_NAME).decode())))
+            self.assertEqual(manifest, self._get_manifest(captures))
+            for capture in captures:
+                zip_info = archive.getinfo(capture.relative_path)
+                self.assertEqual(zip_info.compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zip_info.date_time, capture_time.timetuple()[:6])
+                self.assertEqual(archive.read(zip_info), self._read_capture(capture))
+
+    def test_export_tar(self):
+        """
+        Test the TAR export of all the captures, with the manifest and the creation time of the captures
+        """
+        # Mock and data
+        capture_time = datetime(2020, 1, 1, 12, 30)
+        captures = create_test_captured_images(3, capture_time)
+
+        # When
+        response = self.client.get(url_for('capture_mode.export_captures', format=EXPORT_FORMAT_TAR))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-tar')
+        self.assertEqual(len(response.data) % tarfile.RECORDSIZE, 0)
+        with tarfile.open(fileobj=io.BytesIO(response.data)) as archive:
+            self.assertEqual(archive.getnames(), [MANIFEST_NAME] + [capture.relative_path for capture in captures])
+            manifest = list(csv.reader(io.StringIO(archive.extractfile(MANIFEST_NAME).read().decode())))
+            self.assertEqual(manifest, self._get_manifest(captures))
+            for capture in captures:
+                tar_info = archive.getmember(capture.relative_path)
+                self.assertEqual(tar_info.mtime, capture_time.timestamp())
+                self.assertEqual(archive.extractfile(tar_info).read(), self._read_capture(capture))
+
+    def test_export_tar_spooled_manifest(self):
+        """
+        Test that the manifest of the TAR export is generated with one scan of the captures, and a manifest bigger
+        than the spool size is written from its temp file with its size, even if the captures are removed after it
+        """
+        # Mock and data
+        expected_manifest = self._get_manifest(create_test_captured_images(3))
+        export = CapturesExport(CapturedImage.query, self.app.config['CAPTURES_DIR'], EXPORT_FORMAT_TAR,
+                                manifest_spool_size=10)
+
+        # When
+        with patch.object(export, '_iterate_captures', wraps=export._iterate_captures) as mock_iterate_captures:
+            chunks = iter(export)
+            first_chunk = next(chunks)
+            get_capture_controller().remove_all_captures()
+            data = first_chunk + b''.join(chunks)
+
+        # Validation
+        self.assertEqual(mock_iterate_captures.call_count, 2)
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            self.assertEqual(archive.getnames(), [MANIFEST_NAME])
+            manifest = list(csv.reader(io.StringIO(archive.extractfile(MANIFEST_NAME).read().decode())))
+            self.assertEqual(manifest, expected_manifest)
+
+    def test_export_invalid_format(self):
+        """
+        Test that an invalid format is a bad request
+        """
+        # When
+        response = self.client.get(url_for('capture_mode.export_captures', format='rar'))
+
+        # Validation
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            CapturesExport(CapturedImage.query, self.app.config['CAPTURES_DIR'], 'rar')
+
+    def test_export_chunks(self):
+        """
+        Test that the archives are sent in chunks of about the chunk size, and the rows in batches,
+        so the memory used doesn't depend on the size of the export
+        """
+        # Mock and data
+        captures = create_test_captured_images(4)
+        chunk_size = 1024
+        # Room for the headers and data descriptors of the entries
+        max_chunk_size = chunk_size + tarfile.RECORDSIZE
+
+        for archive_format in [EXPORT_FORMAT_ZIP, EXPORT_FORMAT_TAR]:
+            # When
+            export = CapturesExport(CapturedImage.query, self.app.config['CAPTURES_DIR'], archive_format,
+                                    chunk_size=chunk_size, batch_size=3)
+            chunks = list(export)
+
+            # Validation
+            self.assertLessEqual(max(len(chunk) for chunk in chunks), max_chunk_size, archive_format)
+            self.assertGreater(len(chunks), sum(len(self._read_capture(capture)) for capture in captures) // chunk_size)
+            self.assertEqual(export.exported, len(captures))
+
+    def test_export_missing_file_and_new_captures(self):
+        """
+        Test that a capture without file is skipped, and the captures taken after the export starts are not exported
+        """
+        # Mock and data
+        captures = create_test_captured_images(3)
+        os.remove(os.path.join(self.app.config['CAPTURES_DIR'], captures[1].relative_path))
+        export = CapturesExport(CapturedImage.query, self.app.config['CAPTURES_DIR'])
+
+        # When
+        create_test_captured_images(1)
+        data = b''.join(export)
+
+        # Validation
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), [MANIFEST_NAME, captures[0].relative_path, captures[2].relative_path])
+            manifest = list(csv.reader(io.StringIO(archive.read(MANIFEST_NAME).decode())))
+            self.assertEqual(manifest, self._get_manifest(captures))
+        self.assertEqual(export.exported, 2)
+        self.assertEqual(export.skipped, 1)
+
+    def test_export_command(self):
+        """
+        Test the export command writing the archive of a date range to a file
+        """
+        # Mock and data
+        capture_time = datetime(2020, 1, 1, 12, 30)
+        captures = create_test_captured_images(2, capture_time)
+        create_test_captured_images(1, capture_time + timedelta(days=1))
+        output_path = os.path.join(self.app.config['CAPTURES_DIR'], 'export.tar')
+
+        # When
+        result = self.app_runner.invoke(args=[CAPTURES_CLI_GROUP, CAPTURES_EXPORT_COMMAND, output_path,
+                                              '--datetime-until', capture_time.strftime(FRONTEND_TS_FORMAT),
+                                              '--format', EXPORT_FORMAT_TAR])
+
+        # Validation
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Exported 2 captures', result.output)
+        with tarfile.open(output_path) as archive:
+            self.assertEqual(archive.getnames(), [MANIFEST_NAME] + [capture.relative_path for capture in captures])
@@ -0,0 +1,73 @@
+"""
+Test database config and migrations
+"""
+from unittest.mock import patch
+from sqlalchemy import inspect
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.config.database import get_sqlite_pragmas, add_missing_indexes
+from picamera_server.config.config import SQLITE_PROFILE_DEFAULT, SQLITE_PROFILE_PERFORMANCE, SQLITE_BUSY_TIMEOUT,\
+    SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE
+from picamera_server.models import CapturedImage
+
+
+class TestDatabase(BaseTestClass):
+
+    def test_get_sqlite_pragmas(self):
+        """
+        Test the pragmas of the SQLite profiles, and that invalid values raise ValueError
+        """
+        # When
+        performance_pragmas = get_sqlite_pragmas(SQLITE_PROFILE_PERFORMANCE)
+        default_pragmas = get_sqlite_pragmas(SQLITE_PROFILE_DEFAULT)
+
+        # Validation
+        self.assertEqual(performance_pragmas, [('busy_timeout', SQLITE_BUSY_TIMEOUT), ('journal_mode', 'WAL'),
+                                               ('synchronous', 'NORMAL'), ('mmap_size', SQLITE_MMAP_SIZE),
+                                               ('cache_size', SQLITE_CACHE_SIZE)])
+        self.assertEqual(default_pragmas, [])
+        with self.assertRaises(ValueError):
+            get_sqlite_pragmas('fast')
+        with patch('picamera_server.config.database.SQLITE_JOURNAL_MODE', 'wal; DROP TABLE user'):
+            with self.assertRaises(ValueError):
+                get_sqlite_pragmas(SQLITE_PROFILE_PERFORMANCE)
+        with patch('picamera_server.config.database.SQLITE_SYNCHRONOUS', 'fast'):
+            with self.assertRaises(ValueError):
+                get_sqlite_pragmas(SQLITE_PROFILE_PERFORMANCE)
+
+    def test_sqlite_pragmas_set_on_connect(self):
+        """
+        Test that the pragmas of the performance profile are set in the connections of the engine
+        """
+        # When
+        with self.db.engine.connect() as connection:
+            journal_mode = connection.execute('PRAGMA journal_mode').scalar()
+            synchronous = connection.execute('PRAGMA synchronous').scalar()
+            busy_timeout = connection.execute('PRAGMA busy_timeout').scalar()
+            cache_size = connection.execute('PRAGMA cache_size').scalar()
+
+        # Validation
+        self.assertEqual(journal_mode, 'wal')
+        # NORMAL
+        self.assertEqual(synchronous, 1)
+        self.assertEqual(busy_timeout, SQLITE_BUSY_TIMEOUT)
+        self.assertEqual(cache_size, SQLITE_CACHE_SIZE)
+
+    def test_add_missing_indexes(self):
+        """
+        Test that the created_at index is created in a table created without it, and the date filters use it
+        """
+        # Mock and data
+        self.db.engine.execute('DROP INDEX ix_captured_image_created_at')
+
+        # When
+        added_indexes = add_missing_indexes(self.db, CapturedImage)
+        added_indexes_again = add_missing_indexes(self.db, CapturedImage)
+
+        # Validation
+        self.assertEqual(added_indexes, ['ix_captured_image_created_at'])
+        self.assertEqual(added_indexes_again, [])
+        indexes = [index['name'] for index in inspect(self.db.engine).get_indexes('captured_image')]
+        self.assertIn('ix_captured_image_created_at', indexes)
+        query_plan = self.db.engine.execute('EXPLAIN QUERY PLAN SELECT id FROM captured_image '
+                                            "WHERE created_at >= '2020-01-01'").fetchall()
+        self.assertIn('ix_captured_image_created_at', ' '.join(str(row) for row in query_plan))
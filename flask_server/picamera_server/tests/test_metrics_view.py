@@ -0,0 +1,87 @@
+"""
+Test metrics view
+"""
+from flask import url_for
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.metrics.registry import Counter, Gauge, Histogram, MetricsRegistry, CONTENT_TYPE_LATEST
+from picamera_server.metrics.camera_metrics import CAPTURE_STAGE_SECONDS
+
+
+class TestMetricsView(BaseTestClass):
+
+    def test_get_metrics(self):
+        """
+        Test the metrics endpoint exposes the camera, stream and capture metrics
+
+        :return:
+        """
+        # When
+        response = self.client.get(url_for('metrics.get_metrics'))
+
+        # Validation
+        metrics_text = response.data.decode()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.content_type, CONTENT_TYPE_LATEST)
+        for metric_line in ['# TYPE picamera_get_frame_seconds histogram',
+                            '# TYPE picamera_camera_lock_wait_seconds histogram',
+                            '# TYPE picamera_capture_stage_seconds histogram',
+                            '# TYPE picamera_stream_frames_sent_total counter',
+                            '# TYPE picamera_stream_bytes_sent_total counter',
+                            'picamera_stream_clients 0',
+                            'picamera_capture_thread_alive 0']:
+            self.assertIn(metric_line, metrics_text)
+
+    def test_capture_stages_observed(self):
+        """
+        Test that a new capture observes the duration of each stage
+
+        :return:
+        """
+        # Mock and data
+        stage_counts = {stage: sum(CAPTURE_STAGE_SECONDS.labels(stage).counts)
+                        for stage in ['grab', 'save', 'db_commit']}
+
+        # When
+        get_capture_controller().create_new_capture()
+
+        # Validation
+        for stage, count in stage_counts.items():
+            self.assertEqual(sum(CAPTURE_STAGE_SECONDS.labels(stage).counts), count + 1)
+
+    def test_registry_text_format(self):
+        """
+        Test the text exposition format of the metrics
+
+        :return:
+        """
+        # Mock and data
+        registry = MetricsRegistry()
+        counter = registry.register(Counter('test_total', 'Test counter'))
+        gauge = registry.register(Gauge('test_gauge', 'Test gauge', ['name']))
+        histogram = registry.register(Histogram('test_seconds', 'Test histogram', buckets=[0.1, 1]))
+
+        # When
+        counter.inc()
+        counter.inc(2)
+        gauge.labels('a "quoted" name').set(1.5)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        metrics_text = registry.generate_latest()
+
+        # Validation
+        self.assertEqual(metrics_text, '# HELP test_total Test counter\n'
+                                       '# TYPE test_total counter\n'
+                                       'test_total 3\n'
+                                       '# HELP test_gauge Test gauge\n'
+                                       '# TYPE test_gauge gauge\n'
+                                       'test_gauge{name="a \\"quoted\\" name"} 1.5\n'
+                                       '# HELP test_seconds Test histogram\n'
+                                       '# TYPE test_seconds histogram\n'
+                                       'test_seconds_bucket{le="0.1"} 1\n'
+                                       'test_seconds_bucket{le="1"} 2\n'
+                                       'test_seconds_bucket{le="+Inf"} 3\n'
+                                       'test_seconds_sum 5.55\n'
+                                       'test_seconds_count 3\n')
+        self.assertRaises(ValueError, registry.register, Counter('test_total', 'Duplicated'))
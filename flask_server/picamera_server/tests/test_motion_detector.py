@@ -0,0 +1,172 @@
+"""
+Test the motion detector and the motion capture mode
+"""
+import io
+import os
+import queue
+import subprocess
+import sys
+import time
+from PIL import Image
+from unittest.mock import patch
+from flask import url_for
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.config.config import CAPTURE_MODE_INTERVAL, CAPTURE_MODE_MOTION
+from picamera_server.models import CapturedImage
+from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.motion_detector import MotionDetector, get_luma
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.camera.camera_controllers import get_frame_broadcaster
+from picamera_server.views.capture_mode_view import FORM_CAPTURE_MODE
+from picamera_server.views.helpers.optional_import import import_optional
+
+
+def scene_frame(square: bool = False, size: tuple = (640, 480)) -> bytes:
+    """
+    Return a JPEG frame of a dark scene, with a bright square covering a quarter of it if square is True
+
+    :param square:
+    :param size: Width and height of the frame
+    :return:
+    """
+    image = Image.new('RGB', size, (20, 20, 20))
+    if square:
+        image.paste((230, 230, 230), (0, 0, size[0] // 2, size[1] // 2))
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class TestMotionDetector(BaseTestClass):
+
+    def test_get_luma(self):
+        """
+        The frame is decoded to a luma array of the detection width, keeping the aspect ratio
+        """
+        # When
+        luma = get_luma(scene_frame(square=True), 160)
+
+        # Validation
+        self.assertEqual(luma.shape, (120, 160))
+        self.assertGreater(luma[10, 10], 200)
+        self.assertLess(luma[100, 140], 40)
+
+    def test_changed_fraction(self):
+        """
+        The first frame is the background, the square changes a quarter of the pixels of the next frame
+        """
+        # Mock and data
+        detector = MotionDetector(width=160)
+
+        # When
+        first_fraction = detector.get_changed_fraction(scene_frame())
+        still_fraction = detector.get_changed_fraction(scene_frame())
+        motion_fraction = detector.get_changed_fraction(scene_frame(square=True))
+
+        # Validation
+        self.assertEqual(first_fraction, 0.0)
+        self.assertEqual(still_fraction, 0.0)
+        self.assertAlmostEqual(motion_fraction, 0.25, delta=0.02)
+
+    def test_update_motion(self):
+        """
+        The captures are triggered at most every min interval while the motion lasts, and not until the cooldown
+        passes when the motion stops
+        """
+        # Mock and data
+        detector = MotionDetector(threshold=0.1, min_interval=1, cooldown=5)
+        frames = [(0.0, 0.5), (0.5, 0.5), (1.0, 0.5), (1.5, 0.0), (2.0, 0.5), (7.0, 0.5), (7.5, 0.05)]
+
+        # When
+        triggers = [detector.update_motion(changed_fraction, now) for now, changed_fraction in frames]
+
+        # Validation
+        self.assertEqual(triggers, [True, False, True, False, False, True, False])
+
+
+class TestMotionCaptureMode(BaseTestClass):
+
+    def tearDown(self) -> None:
+        """
+        Restore the interval capture mode
+        """
+        get_capture_controller().CAPTURE_MODE = CAPTURE_MODE_INTERVAL
+
+    def test_import_optional_missing_module(self):
+        """
+        Test that a missing optional dependency is logged instead of raising
+        """
+        # Mock and data
+        with patch('picamera_server.views.helpers.optional_import.app.logger') as mock_logger:
+            # When
+            module = import_optional('picamera_server_missing_module')
+
+        # Validation
+        self.assertIsNone(module)
+        mock_logger.warning.assert_called_once()
+
+    def test_default_motion_capture_mode_without_numpy(self):
+        """
+        Test that the config rejects the default motion capture mode when numpy is not installed
+        """
+        # Mock and data
+        server_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        script = 'import sys; sys.modules["numpy"] = None; import picamera_server.config.config'
+        env = dict(os.environ, DEFAULT_CAPTURE_MODE=CAPTURE_MODE_MOTION)
+
+        # When
+        result = subprocess.run([sys.executable, '-c', script], cwd=server_root, env=env, capture_output=True,
+                                timeout=30)
+
+        # Validation
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(b'DEFAULT_CAPTURE_MODE motion needs numpy installed', result.stderr)
+
+    def test_set_capture_mode(self):
+        """
+        Test the post to set the capture mode, an invalid mode returns 400
+        """
+        # When
+        response = self.client.post(url_for('capture_mode.set_capture_mode'),
+                                    data={FORM_CAPTURE_MODE: CAPTURE_MODE_MOTION})
+        invalid_response = self.client.post(url_for('capture_mode.set_capture_mode'), data={FORM_CAPTURE_MODE: 'sound'})
+
+        # Validation
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_capture_controller().CAPTURE_MODE, CAPTURE_MODE_MOTION)
+        self.assertEqual(invalid_response.status_code, 400)
+
+    def test_motion_capture(self):
+        """
+        With the motion capture mode only the stream frame with motion is stored
+        """
+        # Mock and data
+        capture_controller = get_capture_controller()
+        capture_controller.update_capture_mode(CAPTURE_MODE_MOTION)
+        broadcaster = get_frame_broadcaster()
+        still_frame, motion_frame = scene_frame(), scene_frame(square=True)
+        frames_queue = queue.Queue()
+
+        with patch.object(TestCamera, 'get_frame', side_effect=frames_queue.get) as _:
+            # When
+            capture_controller.update_capturing_status('true')
+            frames_queue.put(still_frame)
+            frames_queue.put(motion_frame)
+            deadline = time.monotonic() + 5
+            while not CapturedImage.query.count() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            capture_thread = capture_controller.CAPTURING_THREAD
+            producer_thread = broadcaster.producer_thread
+            capture_controller.update_capturing_status('false')
+            capture_thread.join(timeout=5)
+            frames_queue.put(still_frame)
+            producer_thread.join(timeout=5)
+
+        # Validation
+        captures = CapturedImage.query.all()
+        self.assertEqual(len(captures), 1)
+        with open(os.path.join(self.app.config['CAPTURES_DIR'], captures[0].relative_path), 'rb') as capture_file:
+            self.assertEqual(capture_file.read(), motion_frame)
+        self.assertFalse(capture_thread.is_alive())
+        self.assertFalse(producer_thread.is_alive())
+        self.assertEqual(broadcaster.clients, 0)
@@ -0,0 +1,232 @@
+"""
+Test the cameras registry, the streams and captures of several cameras
+"""
+import os
+import shutil
+import tempfile
+from flask import url_for
+from sqlalchemy import inspect
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.stream import next_multipart_frame, multipart_frame
+from picamera_server.picamera_server import init_camera_controllers
+from picamera_server.config.config import DEFAULT_CAMERA_ID
+from picamera_server.config.database import add_missing_columns
+from picamera_server.models import CapturedImage
+from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.replay_camera import ReplayCamera
+from picamera_server.camera.camera_controllers import parse_cameras_config, init_camera_controller,\
+    get_camera_controller, get_frame_broadcaster, get_camera_ids
+from picamera_server.camera.capture_controller import init_capture_controller, get_capture_controller
+from picamera_server.views.capture_mode_view import FORM_CAPTURE_INTERVAL, FORM_CAMERA_ID
+
+
+class TestCamerasConfig(BaseTestClass):
+
+    def test_parse_cameras_config(self):
+        """
+        Test the parse of the cameras config, the source is only valid for the replay cameras, and the camera classes
+        with only one instance can't be repeated
+        """
+        # When
+        cameras = parse_cameras_config('main:pi, door:replay:/media/door.mjpeg,yard:synthetic')
+
+        # Validation
+        self.assertEqual(cameras, [('main', 'pi', ''), ('door', 'replay', '/media/door.mjpeg'),
+                                   ('yard', 'synthetic', '')])
+        self.assertEqual(parse_cameras_config(''), [])
+        self.assertEqual(parse_cameras_config('door:replay:/media/door.mjpeg,yard:replay:/media/yard.mjpeg'),
+                         [('door', 'replay', '/media/door.mjpeg'), ('yard', 'replay', '/media/yard.mjpeg')])
+        for invalid_config in ['main', 'main:webcam', 'main:pi,main:test', 'front door:test', 'main:test:/media',
+                               'main:test,door:test', 'main:pi,yard:synthetic,door:pi']:
+            with self.assertRaises(ValueError, msg=invalid_config):
+                parse_cameras_config(invalid_config)
+
+
+class TestMultiCamera(BaseTestClass):
+    """
+    Serve the test camera as the default camera and a replay camera of a directory with only one of the test frames
+    """
+
+    def setUp(self) -> None:
+        """
+        Init the default camera and the door camera, without captures
+        """
+        self.test_frames = get_camera_controller().frames
+        self.replay_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.replay_dir, 'frame.jpg'), 'wb') as frame_file:
+            frame_file.write(self.test_frames[1])
+        init_camera_controller([(DEFAULT_CAMERA_ID, '', ''), ('door', 'replay', self.replay_dir)])
+        init_capture_controller()
+        for camera_id in get_camera_ids():
+            get_capture_controller(camera_id).remove_all_captures()
+
+    def tearDown(self) -> None:
+        """
+        Remove the captures of the door camera and init only the default camera again
+        """
+        get_capture_controller('door').remove_all_captures()
+        init_camera_controllers()
+        shutil.rmtree(self.replay_dir, ignore_errors=True)
+
+    def test_camera_registry(self):
+        """
+        Every camera has its own controller, frame broadcaster and capture controller
+        """
+        # Validation
+        self.assertEqual(get_camera_ids(), [DEFAULT_CAMERA_ID, 'door'])
+        self.assertIsInstance(get_camera_controller(), TestCamera)
+        self.assertIsInstance(get_camera_controller('door'), ReplayCamera)
+        self.assertIs(get_frame_broadcaster(DEFAULT_CAMERA_ID), get_frame_broadcaster())
+        self.assertIsNot(get_frame_broadcaster('door'), get_frame_broadcaster())
+        self.assertIsNot(get_capture_controller('door'), get_capture_controller())
+        self.assertIsNone(get_frame_broadcaster('garden'))
+        self.assertIsNone(get_capture_controller('garden'))
+
+    def test_get_camera_video_frame(self):
+        """
+        The stream of a camera is fed by the producer thread of its own broadcaster
+        """
+        # Mock and data
+        broadcaster = get_frame_broadcaster('door')
+
+        # When
+        response = self.client.get(url_for('camera.video_frame', camera_id='door'))
+        frame = next_multipart_frame(response.iter_encoded())
+        producer_thread = broadcaster.producer_thread
+        default_producer_thread = get_frame_broadcaster().producer_thread
+        response.close()
+        producer_thread.join(timeout=5)
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(frame, multipart_frame(self.test_frames[1]))
+        self.assertEqual(producer_thread.name, 'frame-producer-door')
+        self.assertIsNone(default_producer_thread)
+        self.assertFalse(producer_thread.is_alive())
+
+    def test_get_unknown_camera(self):
+        """
+        The endpoints of a camera that doesn't exist return 404
+        """
+        # When
+        video_frame_response = self.client.get(url_for('camera.video_frame', camera_id='garden'))
+        snapshot_response = self.client.get(url_for('camera.snapshot', camera_id='garden'))
+        clients_response = self.client.get(url_for('camera.stream_clients', camera_id='garden'))
+
+        # Validation
+        self.assertEqual(video_frame_response.status_code, 404)
+        self.assertEqual(snapshot_response.status_code, 404)
+        self.assertEqual(clients_response.status_code, 404)
+
+    def test_ui_camera_stream(self):
+        """
+        The stream page shows the stream of every camera
+        """
+        # When
+        response = self.client.get(url_for('camera.ui_camera_stream'))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(url_for('camera.video_frame', camera_id=DEFAULT_CAMERA_ID).encode(), response.data)
+        self.assertIn(url_for('camera.video_frame', camera_id='door').encode(), response.data)
+
+    def test_camera_capture(self):
+        """
+        The captures of a camera are stored in its folder and with its camera id
+        """
+        # When
+        door_capture = get_capture_controller('door').create_new_capture()
+        default_capture = get_capture_controller().create_new_capture()
+
+        # Validation
+        self.assertEqual(door_capture.camera_id, 'door')
+        self.assertTrue(door_capture.relative_path.startswith('door' + os.sep))
+        self.assertEqual(default_capture.camera_id, DEFAULT_CAMERA_ID)
+        self.assertFalse(default_capture.relative_path.startswith('door'))
+        self.assertTrue(os.path.isfile(os.path.join(self.app.config['CAPTURES_DIR'], door_capture.relative_path)))
+
+    def test_remove_camera_captures(self):
+        """
+        The captures, counts and total of the camera of the form are removed, the rest of the cameras keep them
+        """
+        # Mock and data
+        door_captures_paths = [get_capture_controller('door').create_new_capture().relative_path for _ in range(2)]
+        default_capture = get_capture_controller().create_new_capture()
+        default_capture_id, default_capture_path = default_capture.id, default_capture.relative_path
+        door_totals_before = get_capture_controller('door').get_total_captures()
+
+        # When
+        response = self.client.post(url_for('capture_mode.remove_all_captures'), data={FORM_CAMERA_ID: 'door'})
+
+        # Validation
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith(url_for('capture_mode.ui_config_capture_mode', camera_id='door')))
+        self.assertEqual(door_totals_before, 2)
+        self.assertEqual(get_capture_controller('door').get_total_captures(), 0)
+        self.assertEqual(get_capture_controller().get_total_captures(), 1)
+        self.assertEqual([capture.id for capture in CapturedImage.query.all()], [default_capture_id])
+        for door_capture_path in door_captures_paths:
+            self.assertFalse(os.path.exists(os.path.join(self.app.config['CAPTURES_DIR'], door_capture_path)))
+        self.assertTrue(os.path.isfile(os.path.join(self.app.config['CAPTURES_DIR'], default_capture_path)))
+
+    def test_camera_total_captures(self):
+        """
+        The capture mode UI of a camera shows the total of captures of the camera and removes its captures
+        """
+        # Mock and data
+        get_capture_controller('door').create_new_capture()
+
+        # When
+        response = self.client.get(url_for('capture_mode.ui_config_capture_mode', camera_id='door'))
+        default_response = self.client.get(url_for('capture_mode.ui_config_capture_mode'))
+
+        # Validation
+        self.assertIn(b'The total number of stored captures of the camera is 1.', response.data)
+        self.assertIn(b'<input type="hidden" name="camera_id" value="door">', response.data)
+        self.assertIn(b'The total number of stored captures of the camera is 0.', default_response.data)
+
+    def test_camera_capture_interval(self):
+        """
+        The capture interval is configured for the camera of the form, the rest of the cameras keep their interval
+        """
+        # Mock and data
+        default_interval = get_capture_controller().CAPTURE_INTERVAL
+        data = {FORM_CAPTURE_INTERVAL: default_interval + 1, FORM_CAMERA_ID: 'door'}
+
+        # When
+        response = self.client.post(url_for('capture_mode.set_capt_interval_value'), data=data)
+        unknown_camera_response = self.client.post(url_for('capture_mode.set_capt_interval_value'),
+                                                   data={FORM_CAPTURE_INTERVAL: 1, FORM_CAMERA_ID: 'garden'})
+
+        # Validation
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith(url_for('capture_mode.ui_config_capture_mode', camera_id='door')))
+        self.assertEqual(get_capture_controller('door').CAPTURE_INTERVAL, default_interval + 1)
+        self.assertEqual(get_capture_controller().CAPTURE_INTERVAL, default_interval)
+        self.assertEqual(unknown_camera_response.status_code, 404)
+
+
+class TestCapturedImageMigration(BaseTestClass):
+
+    def test_add_camera_id_column(self):
+        """
+        The captured image table created before the multi camera support gets the camera_id column, the existing
+        captures belong to the default camera
+        """
+        # Mock and data
+        CapturedImage.__table__.drop(self.db.engine)
+        self.db.engine.execute('CREATE TABLE captured_image (id INTEGER PRIMARY KEY, '
+                               'relative_path VARCHAR(255) NOT NULL UNIQUE, created_at DATETIME NOT NULL)')
+        self.db.engine.execute("INSERT INTO captured_image (relative_path, created_at) "
+                               "VALUES ('20-1-1/old.jpg', '2020-01-01 00:00:00')")
+
+        # When
+        added_columns = add_missing_columns(self.db, CapturedImage)
+        added_columns_again = add_missing_columns(self.db, CapturedImage)
+
+        # Validation
+        columns = [column['name'] for column in inspect(self.db.engine).get_columns('captured_image')]
+        self.assertEqual(added_columns, ['camera_id'])
+        self.assertEqual(added_columns_again, [])
+        self.assertIn('camera_id', columns)
+        self.assertEqual(CapturedImage.query.one().camera_id, DEFAULT_CAMERA_ID)
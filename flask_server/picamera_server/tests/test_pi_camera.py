@@ -9,11 +9,12 @@ from flask import Response, url_for
 
 import picamera_server.camera.pi_camera as picamera
 from picamera_server.tests.base_test_class import BaseTestClass
-from picamera_server.views.camera_view import MIME_TYPE_MULTIPART_FRAME, get_camera_controller
-from picamera_server.camera.base_camera import Camera
+from picamera_server.tests.helpers.stream import next_multipart_frame, multipart_frame
+from picamera_server.views.camera_view import MIME_TYPE_MULTIPART_FRAME
 from picamera_server.camera.test_camera import TestCamera
-from picamera_server.camera.camera_controllers import set_camera_class, init_camera_controller
-from picamera_server.camera.pi_camera import PiCamera
+from picamera_server.camera.camera_controllers import set_camera_class, init_camera_controller, get_camera_controller
+from picamera_server.camera.pi_camera import PiCamera, StreamingOutput
+from picamera_server.config.config import PI_CAMERA_CAPTURE_MODE_VIDEO
 
 
 class TestPiCamera(BaseTestClass):
@@ -93,6 +94,67 @@ class TestPiCamera(BaseTestClass):
         """
         stream.write(TestCamera().get_frame())
 
+    @staticmethod
+    def _mock_camera_start_recording(output: StreamingOutput, **kwargs) -> None:
+        """
+        Push the test frames as chunks in the recording output to mock the picamera.PiCamera.start_recording method,
+        a last incomplete frame is pushed and it shouldn't be returned as a frame
+
+        :param output: Output of the recording
+        :param kwargs: Recording arguments
+        :return:
+        """
+        for frame in TestCamera().frames:
+            middle = len(frame) // 2
+            output.write(frame[:middle])
+            output.write(frame[middle:])
+        output.write(TestCamera().frames[0][:100])
+
+    def test_get_frame_video_capture_mode(self):
+        """
+        Test the video capture mode, the frame returned is the latest complete frame written by the recorder
+
+        :return:
+        """
+        # Mock and data
+        camera_controller = get_camera_controller()
+        test_frames = TestCamera().frames
+        capture_calls = self.mock_picamera_class.capture.call_count
+        self.mock_picamera_class.start_recording.side_effect = TestPiCamera._mock_camera_start_recording
+
+        with patch.object(PiCamera, 'CAPTURE_MODE', PI_CAMERA_CAPTURE_MODE_VIDEO),\
+                patch.object(self.mock_picamera_class, 'closed', False):
+            # When
+            first_frame = camera_controller.get_frame()
+            second_frame = camera_controller.get_frame()
+            camera_controller._stop_video_capture()
+
+        # Validation
+        self.assertEqual(first_frame, test_frames[-1])
+        self.assertEqual(second_frame, test_frames[-1])
+        self.mock_picamera_class.start_recording.assert_called_once_with(camera_controller.output,
+                                                                         format=PiCamera.VIDEO_FORMAT,
+                                                                         quality=PiCamera.VIDEO_QUALITY)
+        self.mock_picamera_class.stop_recording.assert_called_once()
+        self.assertEqual(self.mock_picamera_class.capture.call_count, capture_calls)
+        self.assertFalse(camera_controller.recording)
+
+    def test_streaming_output_wait_for_frame_timeout(self):
+        """
+        Test that the streaming output returns None when there is no complete frame
+
+        :return:
+        """
+        # Mock and data
+        output = StreamingOutput()
+        output.write(TestCamera().frames[0][:100])
+
+        # When
+        frame = output.wait_for_frame(timeout=0)
+
+        # Validation
+        self.assertIsNone(frame)
+
     @patch('picamera_server.views.camera_view.stream_with_context')
     @patch('picamera_server.views.camera_view.Response')
     def test_get_video_frame_test_camera(self, mock_response: MagicMock, mock_stream_with_context: MagicMock):
@@ -111,9 +173,9 @@ class TestPiCamera(BaseTestClass):
         mock_stream_with_context.return_value = test_generator
         mock_response.side_effect = Response
 
-        expected_multipart_frames = [Camera._get_multipart_frame(test_frames[0]),
-                                     Camera._get_multipart_frame(test_frames[1]),
-                                     Camera._get_multipart_frame(test_frames[2])]
+        expected_multipart_frames = [multipart_frame(test_frames[0]),
+                                     multipart_frame(test_frames[1]),
+                                     multipart_frame(test_frames[2])]
 
         # Get frame of TestCamera is used in the _mock_camera_capture method
         with patch.object(TestCamera, 'get_frame', side_effect=test_frames) as _:
@@ -127,9 +189,9 @@ class TestPiCamera(BaseTestClass):
             self.assertEqual(response.is_streamed, True)
             self.assertEqual(response.content_type, MIME_TYPE_MULTIPART_FRAME)
             response_iterator = response.iter_encoded()
-            self.assertEqual(next(response_iterator), expected_multipart_frames[0])
-            self.assertEqual(next(response_iterator), expected_multipart_frames[1])
-            self.assertEqual(next(response_iterator), expected_multipart_frames[2])
+            self.assertEqual(next_multipart_frame(response_iterator), expected_multipart_frames[0])
+            self.assertEqual(next_multipart_frame(response_iterator), expected_multipart_frames[1])
+            self.assertEqual(next_multipart_frame(response_iterator), expected_multipart_frames[2])
             self.assertRaises(RuntimeError, response_iterator.__next__)
             self.assertRaises(StopIteration, response_iterator.__next__)
 
@@ -0,0 +1,138 @@
+"""
+Test replay camera
+"""
+import os
+import tempfile
+from unittest.mock import patch, MagicMock
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.config.config import STATIC_FILES_PATH, CAMERA_CLASS_REPLAY
+from picamera_server.camera.replay_camera import ReplayCamera, index_mjpeg_frames
+from picamera_server.camera.camera_controllers import get_camera_controller, get_camera_class_by_name
+
+
+TEST_IMAGES_DIR = os.path.join(STATIC_FILES_PATH, 'test_images')
+
+
+class TestReplayCamera(BaseTestClass):
+
+    def setUp(self) -> None:
+        """
+        Create a MJPEG file with the test frames
+        """
+        self.test_frames = get_camera_controller().frames
+        self.mjpeg_file = tempfile.NamedTemporaryFile(suffix='.mjpeg', delete=False)
+        self.mjpeg_file.write(b''.join(self.test_frames))
+        self.mjpeg_file.close()
+
+    def tearDown(self) -> None:
+        """
+        Remove the MJPEG file
+        """
+        os.remove(self.mjpeg_file.name)
+
+    @patch('picamera_server.camera.replay_camera.time.monotonic')
+    def test_replay_directory(self, mock_monotonic: MagicMock):
+        """
+        Test the replay of a directory of JPEG files at the configured fps, the same frame object is returned until
+        the next frame is due
+
+        :param mock_monotonic: Magic mock of time.monotonic
+        :return:
+        """
+        # Mock and data
+        mock_monotonic.return_value = 100
+        camera = ReplayCamera(TEST_IMAGES_DIR, fps=2)
+
+        # When
+        first_frame = camera.get_frame()
+        same_frame = camera.get_frame()
+        mock_monotonic.return_value = 100.5
+        second_frame = camera.get_frame()
+        mock_monotonic.return_value = 101.5
+        looped_frame = camera.get_frame()
+
+        # Validation
+        self.assertEqual(first_frame, self.test_frames[0])
+        self.assertIs(same_frame, first_frame)
+        self.assertEqual(second_frame, self.test_frames[1])
+        self.assertEqual(looped_frame, self.test_frames[0])
+
+    @patch('picamera_server.camera.replay_camera.time.monotonic')
+    def test_replay_mjpeg_file(self, mock_monotonic: MagicMock):
+        """
+        Test the replay of a memory mapped MJPEG file
+
+        :param mock_monotonic: Magic mock of time.monotonic
+        :return:
+        """
+        # Mock and data
+        mock_monotonic.return_value = 0
+        camera = ReplayCamera(self.mjpeg_file.name, fps=1)
+
+        # When
+        frames = list()
+        for second in range(3):
+            mock_monotonic.return_value = second
+            frames.append(camera.get_frame())
+        camera.close()
+
+        # Validation
+        self.assertEqual(camera.frames_count, 3)
+        self.assertEqual(frames, self.test_frames)
+
+    def test_index_mjpeg_frames_with_thumbnail(self):
+        """
+        Test that the SOI and EOI markers of an embedded thumbnail are not taken as frames
+
+        :return:
+        """
+        # Mock and data
+        thumbnail = b'\xff\xd8\xff\xd9'
+        app1_segment = b'\xff\xe1' + (len(thumbnail) + 8).to_bytes(2, 'big') + b'Exif\x00\x00' + thumbnail
+        frame_with_thumbnail = self.test_frames[0][:2] + app1_segment + self.test_frames[0][2:]
+        data = b'garbage' + frame_with_thumbnail + self.test_frames[1] + self.test_frames[2][:100]
+
+        # When
+        frames = index_mjpeg_frames(data)
+
+        # Validation
+        self.assertEqual([data[start:end] for start, end in frames], [frame_with_thumbnail, self.test_frames[1]])
+
+    @patch('picamera_server.camera.replay_camera.time.sleep')
+    def test_replay_latency(self, mock_sleep: MagicMock):
+        """
+        Test the latency and jitter added to each frame
+
+        :param mock_sleep: Magic mock of time.sleep
+        :return:
+        """
+        # Mock and data
+        camera = ReplayCamera(TEST_IMAGES_DIR, latency=0.2, jitter=0.05, seed=1)
+
+        # When
+        for _ in range(10):
+            camera.get_frame()
+
+        # Validation
+        latencies = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(latencies), 10)
+        self.assertTrue(all(0.15 <= latency <= 0.25 for latency in latencies))
+        self.assertGreater(len(set(latencies)), 1)
+
+    def test_replay_empty_source(self):
+        """
+        Test that a source without frames raises ValueError
+
+        :return:
+        """
+        with tempfile.TemporaryDirectory() as empty_dir:
+            self.assertRaises(ValueError, ReplayCamera, empty_dir)
+
+    def test_camera_class_by_name(self):
+        """
+        Test the selection of the camera class with the CAMERA_CLASS option
+
+        :return:
+        """
+        self.assertIs(get_camera_class_by_name(CAMERA_CLASS_REPLAY), ReplayCamera)
+        self.assertRaises(ValueError, get_camera_class_by_name, 'invalid')
@@ -0,0 +1,154 @@
+"""
+Test the stream load test harness
+"""
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import threading
+from unittest.mock import patch
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.async_server.server import AsyncStreamServer
+from picamera_server.camera.test_camera import TestCamera
+from picamera_server.camera.camera_controllers import get_frame_broadcaster, get_camera_controller
+from benchmarks.stream_load_test import percentile, summarize, run_load_test, ClientStats,\
+    ProcessSampler
+
+
+class TestStreamLoadTestStats(BaseTestClass):
+
+    def test_import_without_app(self):
+        """
+        The load test client doesn't import the app, so it doesn't create the app and its database
+        """
+        # Mock and data
+        server_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        script = 'import sys, benchmarks.stream_load_test; print("picamera_server" in sys.modules)'
+
+        # When
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=server_root, timeout=30)
+
+        # Validation
+        self.assertEqual(output.strip(), b'False')
+
+    def test_percentile(self):
+        """
+        The percentiles are interpolated between the closest ranks
+        """
+        # Mock and data
+        values = [4.0, 1.0, 3.0, 2.0]
+
+        # Validation
+        self.assertEqual(percentile(values, 0), 1.0)
+        self.assertEqual(percentile(values, 50), 2.5)
+        self.assertEqual(percentile(values, 100), 4.0)
+        self.assertAlmostEqual(percentile(values, 90), 3.7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_client_and_total_summary(self):
+        """
+        The client summary has the fps, the bytes per second and the percentiles of the intervals between frames
+        """
+        # Mock and data
+        client = ClientStats(0)
+        client.connected_at = 10.0
+        for received_at in [10.5, 11.0, 11.5, 13.5]:
+            client.add_frame(received_at, 100)
+        client_without_frames = ClientStats(1)
+        client_without_frames.error = 'ConnectionRefusedError: refused'
+
+        # When
+        client_summary = client.get_summary(duration=4)
+        total_summary = summarize([client, client_without_frames], duration=4)
+
+        # Validation
+        self.assertEqual(client_summary['frames'], 4)
+        self.assertEqual(client_summary['fps'], 1.0)
+        self.assertEqual(client_summary['bytes_per_second'], 100.0)
+        self.assertEqual(client_summary['first_frame_seconds'], 0.5)
+        self.assertEqual(client_summary['interval_p50_seconds'], 0.5)
+        self.assertEqual(client_summary['interval_max_seconds'], 2.0)
+        self.assertEqual(total_summary['clients'], 2)
+        self.assertEqual(total_summary['clients_with_errors'], 1)
+        self.assertEqual(total_summary['clients_without_frames'], 1)
+        self.assertEqual(total_summary['frames'], 4)
+        self.assertEqual(total_summary['fps_per_client_min'], 0.0)
+        self.assertEqual(total_summary['fps_per_client_avg'], 0.5)
+
+    def test_process_sampler(self):
+        """
+        The sampler reads the CPU and RSS of a process from /proc
+        """
+        # Mock and data
+        if not os.path.exists('/proc/self/stat'):
+            self.skipTest('/proc is not available')
+        sampler = ProcessSampler(os.getpid())
+
+        # When
+        sampler.sample()
+        sampler.sample()
+        summary = sampler.get_summary()
+
+        # Validation
+        self.assertEqual(len(summary['samples']), 1)
+        self.assertGreater(summary['rss_max_bytes'], 0)
+        self.assertGreaterEqual(summary['cpu_percent_avg'], 0)
+
+
+class TestStreamLoadTestRun(BaseTestClass):
+    """
+    Run the load test clients against the async server, running in a background thread
+    """
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Start the async server
+        """
+        super(TestStreamLoadTestRun, cls).setUpClass()
+        cls.loop = asyncio.new_event_loop()
+        cls.server = AsyncStreamServer(cls.app, '127.0.0.1', 0, wsgi_threads=2)
+        cls.loop.run_until_complete(cls.server.start())
+        cls.server_thread = threading.Thread(target=cls.loop.run_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """
+        Stop the async server
+        """
+        asyncio.run_coroutine_threadsafe(cls.server.close(), cls.loop).result(timeout=5)
+        cls.loop.call_soon_threadsafe(cls.loop.stop)
+        cls.server_thread.join(timeout=5)
+        cls.loop.close()
+        super(TestStreamLoadTestRun, cls).tearDownClass()
+
+    def test_run_load_test(self):
+        """
+        All the clients receive frames and the results have the stats of every client and of the server process
+        """
+        # Mock and data
+        clients = 3
+        broadcaster = get_frame_broadcaster()
+        # Every camera frame is different, so the clients get frames at the requested fps
+        camera_frames = itertools.cycle(get_camera_controller().frames)
+
+        # When
+        with patch.object(TestCamera, 'get_frame', side_effect=camera_frames) as _:
+            results = asyncio.run(run_load_test(clients, 1, '127.0.0.1', self.server.port,
+                                                '/camera/video_frame?fps=10', server_pid=os.getpid()))
+            producer_thread = broadcaster.producer_thread
+            if producer_thread:
+                producer_thread.join(timeout=5)
+
+        # Validation
+        summary = results['summary']
+        self.assertEqual(summary['clients'], clients)
+        self.assertEqual(summary['clients_with_errors'], 0)
+        self.assertEqual(summary['clients_without_frames'], 0)
+        self.assertGreater(summary['bytes_per_second'], 0)
+        self.assertEqual(len(results['clients']), clients)
+        self.assertTrue(all(client['frames'] > 0 for client in results['clients']))
+        self.assertEqual(results['server']['pid'], os.getpid())
+        self.assertEqual(broadcaster.clients, 0)
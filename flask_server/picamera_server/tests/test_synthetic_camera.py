@@ -0,0 +1,108 @@
+"""
+Test synthetic camera
+"""
+import io
+from PIL import Image
+from unittest.mock import patch, MagicMock
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.config.config import CAMERA_CLASS_SYNTHETIC
+from picamera_server.camera.synthetic_camera import SyntheticCamera
+from picamera_server.camera.camera_controllers import get_camera_class_by_name
+
+
+class TestSyntheticCamera(BaseTestClass):
+
+    def test_frames_resolution_and_format(self):
+        """
+        Test that the frames are JPEG images with the configured resolution
+
+        :return:
+        """
+        # Mock and data
+        camera = SyntheticCamera(width=320, height=180, loop_frames=4, prerender=False)
+
+        # When
+        frame = camera.get_loop_frame(0)
+
+        # Validation
+        image = Image.open(io.BytesIO(frame))
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (320, 180))
+
+    def test_frames_deterministic(self):
+        """
+        Test that the cameras with the same seed render the same frames, and different seeds render different frames
+
+        :return:
+        """
+        # Mock and data
+        camera = SyntheticCamera(width=160, height=120, loop_frames=4, seed=7, prerender=False)
+        same_seed_camera = SyntheticCamera(width=160, height=120, loop_frames=4, seed=7, prerender=False)
+        other_seed_camera = SyntheticCamera(width=160, height=120, loop_frames=4, seed=8, prerender=False)
+
+        # When
+        frames = [camera.get_loop_frame(index) for index in range(4)]
+        same_seed_frames = [same_seed_camera.get_loop_frame(index) for index in range(4)]
+        other_seed_frames = [other_seed_camera.get_loop_frame(index) for index in range(4)]
+
+        # Validation
+        self.assertEqual(frames, same_seed_frames)
+        self.assertNotEqual(frames, other_seed_frames)
+
+    def test_moving_objects_and_lighting(self):
+        """
+        Test that the scene changes between the frames of the loop and the loop is closed
+
+        :return:
+        """
+        # Mock and data
+        camera = SyntheticCamera(width=160, height=120, objects=2, noise=0, loop_frames=8, prerender=False)
+
+        # When
+        first_image = camera.render_frame(0).astype(int)
+        second_image = camera.render_frame(2).astype(int)
+        looped_image = camera.render_frame(8).astype(int)
+
+        # Validation
+        self.assertGreater(abs(first_image - second_image).mean(), 1)
+        self.assertEqual(abs(first_image - looped_image).max(), 0)
+
+    def test_prerender(self):
+        """
+        Test that the loop is pre-rendered in a background thread and the same frame object is returned each time
+
+        :return:
+        """
+        # Mock and data
+        camera = SyntheticCamera(width=160, height=120, loop_frames=3)
+
+        # When
+        camera.prerender_thread.join(timeout=10)
+
+        # Validation
+        self.assertTrue(all(camera.frames))
+        self.assertIs(camera.get_loop_frame(1), camera.frames[1])
+
+    @patch('picamera_server.camera.synthetic_camera.time.monotonic')
+    def test_get_frame_fps(self, mock_monotonic: MagicMock):
+        """
+        Test that the frame shown changes at the configured fps
+
+        :param mock_monotonic: Magic mock of time.monotonic
+        :return:
+        """
+        # Mock and data
+        mock_monotonic.return_value = 10
+        camera = SyntheticCamera(width=160, height=120, fps=4, loop_frames=4, prerender=False)
+
+        # When
+        first_frame = camera.get_frame()
+        mock_monotonic.return_value = 10.2
+        same_frame = camera.get_frame()
+        mock_monotonic.return_value = 10.5
+        third_frame = camera.get_frame()
+
+        # Validation
+        self.assertIs(same_frame, first_frame)
+        self.assertIs(third_frame, camera.frames[2])
+        self.assertIs(get_camera_class_by_name(CAMERA_CLASS_SYNTHETIC), SyntheticCamera)
@@ -0,0 +1,234 @@
+"""
+Test thumbnails of the captures
+"""
+import io
+import math
+import os
+import shutil
+from PIL import Image
+from lxml import html
+from unittest.mock import patch
+from flask import url_for
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.captured_image import create_test_captured_images
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.camera.thumbnails import ThumbnailCache, get_thumbnail_cache
+from picamera_server.camera.renditions import resize_jpeg
+from picamera_server.config.config import THUMBNAIL_WIDTHS
+from picamera_server.views.helpers.captures import get_capture_etag
+
+
+class TestThumbnails(BaseTestClass):
+
+    def setUp(self) -> None:
+        """
+        Clean up the captures and thumbnails of the previous test
+        :return:
+        """
+        get_capture_controller().remove_all_captures()
+        get_thumbnail_cache().clear()
+
+    def test_resize_jpeg(self):
+        """
+        Test that the thumbnail is resized to the width keeping the aspect ratio, and a small capture keeps its size
+        """
+        # Mock and data
+        capture = io.BytesIO()
+        Image.new('RGB', (640, 480), (200, 100, 50)).save(capture, 'JPEG')
+
+        # When
+        thumbnail = resize_jpeg(capture.getvalue(), 160, 75)
+        bigger_thumbnail = resize_jpeg(capture.getvalue(), 1280, 75)
+
+        # Validation
+        self.assertEqual(Image.open(io.BytesIO(thumbnail)).size, (160, 120))
+        self.assertEqual(Image.open(io.BytesIO(bigger_thumbnail)).size, (640, 480))
+
+    def test_thumbnail_cache_hit(self):
+        """
+        Test that the thumbnail is generated on the first request and read from the cache after it
+        """
+        # Mock and data
+        capture = create_test_captured_images(1)[0]
+        thumbnail_cache = ThumbnailCache(self.app.config['CAPTURES_DIR'], self.app.config['THUMBNAILS_DIR'])
+
+        # When
+        with patch('picamera_server.camera.thumbnails.resize_jpeg', wraps=resize_jpeg) as mock_create:
+            thumbnail_path = thumbnail_cache.get_thumbnail(capture.relative_path, 64)
+            cached_thumbnail_path = thumbnail_cache.get_thumbnail(capture.relative_path, 64)
+
+        # Validation
+        mock_create.assert_called_once()
+        self.assertEqual(thumbnail_path, os.path.join('64', capture.relative_path))
+        self.assertEqual(cached_thumbnail_path, thumbnail_path)
+        full_thumbnail_path = os.path.join(self.app.config['THUMBNAILS_DIR'], thumbnail_path)
+        self.assertEqual(Image.open(full_thumbnail_path).width, 64)
+        self.assertEqual(thumbnail_cache.get_size(), os.path.getsize(full_thumbnail_path))
+
+    def test_thumbnail_cache_not_found(self):
+        """
+        Test that a missing capture, or a path outside the captures dir, raise FileNotFoundError
+        """
+        # Mock and data
+        thumbnail_cache = ThumbnailCache(self.app.config['CAPTURES_DIR'], self.app.config['THUMBNAILS_DIR'])
+
+        # When / Validation
+        for relative_path in ['20-01-01/missing.jpg', '../../config/config.py']:
+            with self.assertRaises(FileNotFoundError, msg=relative_path):
+                thumbnail_cache.get_thumbnail(relative_path, 64)
+
+    def test_thumbnail_cache_eviction(self):
+        """
+        Test that the least recently used thumbnails are removed when the cache is bigger than its max size
+        """
+        # Mock and data
+        captures = create_test_captured_images(3)
+        thumbnail_cache = ThumbnailCache(self.app.config['CAPTURES_DIR'], self.app.config['THUMBNAILS_DIR'])
+        thumbnails_paths = [os.path.join(self.app.config['THUMBNAILS_DIR'],
+                                         thumbnail_cache.get_thumbnail(capture.relative_path, 64))
+                            for capture in captures]
+        # The first thumbnail is the most recently used
+        for age, thumbnail_path in zip([10, 30, 20], thumbnails_paths):
+            modified_time = os.path.getmtime(thumbnail_path) - age
+            os.utime(thumbnail_path, (modified_time, modified_time))
+        # The cache is over its max size, and after the eviction only the first thumbnail fits in it
+        thumbnail_cache.max_size = math.ceil(os.path.getsize(thumbnails_paths[0]) / ThumbnailCache.EVICTION_TARGET)
+        self.assertGreater(thumbnail_cache.get_size(), thumbnail_cache.max_size)
+
+        # When
+        with thumbnail_cache.lock:
+            removed = thumbnail_cache._evict()
+
+        # Validation
+        self.assertEqual(removed, 2)
+        self.assertEqual([os.path.exists(thumbnail_path) for thumbnail_path in thumbnails_paths], [True, False, False])
+        self.assertEqual(thumbnail_cache.get_size(), os.path.getsize(thumbnails_paths[0]))
+
+    def test_thumbnail_cache_eviction_skips_recent_and_temp_files(self):
+        """
+        Test that the eviction removes the old thumbnails, but not the temp files being written or the thumbnails
+        just used
+        """
+        # Mock and data
+        captures = create_test_captured_images(2)
+        thumbnail_cache = ThumbnailCache(self.app.config['CAPTURES_DIR'], self.app.config['THUMBNAILS_DIR'], max_size=1)
+        old_thumbnail_path, recent_thumbnail_path = [
+            os.path.join(self.app.config['THUMBNAILS_DIR'], thumbnail_cache.get_thumbnail(capture.relative_path, 64))
+            for capture in captures]
+        modified_time = os.path.getmtime(old_thumbnail_path) - ThumbnailCache.EVICTION_MIN_AGE - 10
+        os.utime(old_thumbnail_path, (modified_time, modified_time))
+        temp_file_path = '{}.1.tmp'.format(old_thumbnail_path)
+        with open(temp_file_path, 'wb') as temp_file:
+            temp_file.write(b'partial thumbnail')
+        os.utime(temp_file_path, (modified_time, modified_time))
+
+        # When
+        with thumbnail_cache.lock:
+            removed = thumbnail_cache._evict()
+
+        # Validation
+        self.assertEqual(removed, 1)
+        self.assertFalse(os.path.exists(old_thumbnail_path))
+        self.assertTrue(os.path.exists(temp_file_path))
+        self.assertTrue(os.path.exists(recent_thumbnail_path))
+        os.remove(temp_file_path)
+
+    def test_get_removed_capture_thumbnail(self):
+        """
+        Test that the thumbnail of a capture without database entry is not served, even if its files are there
+        """
+        # Mock and data
+        capture = create_test_captured_images(1)[0]
+        endpoint = url_for('capture_mode.get_captured_thumbnail', relative_path=capture.relative_path)
+        self.client.get(endpoint).close()
+        self.db.session.delete(capture)
+        self.db.session.commit()
+
+        # When
+        with patch('picamera_server.camera.thumbnails.resize_jpeg') as mock_resize:
+            response = self.client.get(endpoint)
+
+        # Validation
+        self.assertEqual(response.status_code, 404)
+        mock_resize.assert_not_called()
+
+    def test_get_captured_thumbnail(self):
+        """
+        Test the thumbnail endpoint, with the default and an invalid width, and a missing capture
+        """
+        # Mock and data
+        capture = create_test_captured_images(1)[0]
+
+        # When
+        response = self.client.get(url_for('capture_mode.get_captured_thumbnail', relative_path=capture.relative_path))
+        invalid_width_response = self.client.get(url_for('capture_mode.get_captured_thumbnail',
+                                                         relative_path=capture.relative_path, width=123))
+        not_found_response = self.client.get(url_for('capture_mode.get_captured_thumbnail',
+                                                     relative_path='20-01-01/missing.jpg'))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        capture_width = Image.open(os.path.join(self.app.config['CAPTURES_DIR'], capture.relative_path)).width
+        self.assertEqual(Image.open(io.BytesIO(response.data)).width, min(THUMBNAIL_WIDTHS[0], capture_width))
+        response.close()
+        self.assertEqual(invalid_width_response.status_code, 400)
+        self.assertEqual(not_found_response.status_code, 404)
+
+    def test_get_captured_thumbnail_not_modified(self):
+        """
+        Test that a conditional request with the ETag of the thumbnail gets a 304 without generating the thumbnail
+        """
+        # Mock and data
+        capture = create_test_captured_images(1)[0]
+        endpoint = url_for('capture_mode.get_captured_thumbnail', relative_path=capture.relative_path)
+        response = self.client.get(endpoint)
+        response.close()
+        get_thumbnail_cache().clear()
+
+        # When
+        with patch('picamera_server.camera.thumbnails.resize_jpeg') as mock_create:
+            conditional_response = self.client.get(endpoint, headers={'If-None-Match': response.headers['ETag']})
+
+        # Validation
+        self.assertEqual(response.headers['ETag'], '"{}"'.format(get_capture_etag(capture, THUMBNAIL_WIDTHS[0])))
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(conditional_response.status_code, 304)
+        mock_create.assert_not_called()
+
+    def test_captures_page_thumbnails(self):
+        """
+        Test that the captures page shows the thumbnails and links the full resolution captures for the expanded view
+        """
+        # Mock and data
+        capture = create_test_captured_images(1)[0]
+
+        # When
+        response = self.client.get(url_for('capture_mode.ui_captures_paginated'))
+
+        # Validation
+        tree = html.fromstring(response.data)
+        image = tree.xpath('//div[@class="column"]/img')[0]
+        self.assertEqual(image.get('src'), url_for('capture_mode.get_captured_thumbnail',
+                                                   relative_path=capture.relative_path))
+        self.assertEqual(image.get('data-full-src'), url_for('capture_mode.get_captured_image',
+                                                             relative_path=capture.relative_path))
+
+    def test_remove_all_captures_clears_thumbnails(self):
+        """
+        Test that the thumbnails of every width are removed with all the captures of the camera
+        """
+        # Mock and data
+        capture = create_test_captured_images(1)[0]
+        thumbnails_paths = [os.path.join(self.app.config['THUMBNAILS_DIR'],
+                                         get_thumbnail_cache().get_thumbnail(capture.relative_path, width))
+                            for width in THUMBNAIL_WIDTHS]
+
+        # When
+        get_capture_controller().remove_all_captures()
+
+        # Validation
+        for thumbnail_path in thumbnails_paths:
+            self.assertFalse(os.path.exists(thumbnail_path))
+        self.assertEqual(get_thumbnail_cache().get_size(), 0)
+        shutil.rmtree(self.app.config['THUMBNAILS_DIR'], ignore_errors=True)
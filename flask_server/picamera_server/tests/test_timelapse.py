@@ -0,0 +1,181 @@
+"""
+Test timelapses of the captures
+"""
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from unittest.mock import patch
+from PIL import Image
+from flask import url_for
+from picamera_server.models import CapturedImage
+from picamera_server.tests.base_test_class import BaseTestClass
+from picamera_server.tests.helpers.captured_image import create_test_captured_images
+from picamera_server.camera.capture_controller import get_capture_controller
+from picamera_server.views.helpers.captures import FRONTEND_TS_FORMAT
+from picamera_server.views.helpers.timelapse import CapturesPrefetcher, Timelapse, TIMELAPSE_FORMAT_MJPEG,\
+    AVIIF_KEYFRAME
+
+
+class TestTimelapse(BaseTestClass):
+
+    def setUp(self) -> None:
+        """
+        Clean up the captures of the previous test
+        :return:
+        """
+        get_capture_controller().remove_all_captures()
+
+    def _read_capture(self, capture: CapturedImage) -> bytes:
+        """
+        Return the bytes of the file of a capture
+        :param capture:
+        :return:
+        """
+        with open(os.path.join(self.app.config['CAPTURES_DIR'], capture.relative_path), 'rb') as capture_file:
+            return capture_file.read()
+
+    @staticmethod
+    def _parse_avi(avi: bytes) -> Tuple[dict, List[bytes], List[Tuple[bytes, int, int, int]]]:
+        """
+        Parse a MJPEG AVI, checking the sizes of its lists
+
+        :param avi:
+        :return: Main header, frames and entries of the index
+        """
+        riff_id, riff_size, riff_type = struct.unpack_from('<4sI4s', avi, 0)
+        assert (riff_id, riff_type, riff_size) == (b'RIFF', b'AVI ', len(avi) - 8)
+        header_fields = struct.unpack_from('<10I', avi, 32)
+        header = dict(zip(['us_per_frame', 'max_bytes_per_sec', 'padding', 'flags', 'frames', 'initial_frames',
+                           'streams', 'buffer_size', 'width', 'height'], header_fields))
+        offset = 12
+        frames = list()
+        index = list()
+        while offset < len(avi):
+            chunk_id, chunk_size = struct.unpack_from('<4sI', avi, offset)
+            if chunk_id == b'LIST':
+                list_type = avi[offset + 8:offset + 12]
+                if list_type == b'movi':
+                    movi_offset = offset + 8
+                    movi_end = movi_offset + chunk_size
+                    offset += 12
+                    while offset < movi_end:
+                        frame_id, frame_size = struct.unpack_from('<4sI', avi, offset)
+                        assert frame_id == b'00dc'
+                        frames.append(avi[offset + 8:offset + 8 + frame_size])
+                        offset += 8 + frame_size + frame_size % 2
+                    assert offset == movi_end
+                    continue
+            elif chunk_id == b'idx1':
+                index = [struct.unpack_from('<4sIII', avi, offset + 8 + i * 16) for i in range(chunk_size // 16)]
+                for _, _, entry_offset, entry_size in index:
+                    assert struct.unpack_from('<4sI', avi, movi_offset + entry_offset) == (b'00dc', entry_size)
+            offset += 8 + chunk_size + chunk_size % 2
+        return header, frames, index
+
+    def test_timelapse_avi(self):
+        """
+        Test the AVI timelapse of a date range with a step, the frames are the captures and the index points to them
+        """
+        # Mock and data
+        capture_time = datetime(2020, 1, 1, 12, 30)
+        create_test_captured_images(2, capture_time - timedelta(minutes=1))
+        captures = create_test_captured_images(5, capture_time)
+        create_test_captured_images(2, capture_time + timedelta(minutes=1))
+
+        # When
+        response = self.client.get(url_for('capture_mode.timelapse', step=2, fps=5,
+                                           datetimeFrom=capture_time.strftime(FRONTEND_TS_FORMAT),
+                                           datetimeUntil=capture_time.strftime(FRONTEND_TS_FORMAT)))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'video/x-msvideo')
+        self.assertIn('timelapse_20200101T1230_20200101T1230.avi', response.headers['Content-Disposition'])
+        self.assertEqual(int(response.headers['Content-Length']), len(response.data))
+        header, frames, index = self._parse_avi(response.data)
+        expected_frames = [self._read_capture(capture) for capture in captures[::2]]
+        self.assertEqual(frames, expected_frames)
+        self.assertEqual(header['frames'], 3)
+        self.assertEqual(header['us_per_frame'], 200000)
+        first_capture_path = os.path.join(self.app.config['CAPTURES_DIR'], captures[0].relative_path)
+        self.assertEqual((header['width'], header['height']), Image.open(first_capture_path).size)
+        self.assertEqual([(entry_id, flags, size) for entry_id, flags, _, size in index],
+                         [(b'00dc', AVIIF_KEYFRAME, len(frame)) for frame in expected_frames])
+
+    def test_timelapse_mjpeg(self):
+        """
+        Test the MJPEG timelapse, a multipart stream with the captures as frames
+        """
+        # Mock and data
+        captures = create_test_captured_images(3)
+
+        # When
+        response = self.client.get(url_for('capture_mode.timelapse', format=TIMELAPSE_FORMAT_MJPEG, fps=30))
+
+        # Validation
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'multipart/x-mixed-replace')
+        parts = response.data.split(b'--frame\r\n')[1:]
+        self.assertEqual(len(parts), len(captures))
+        for part, capture in zip(parts, captures):
+            self.assertTrue(part.endswith(self._read_capture(capture) + b'\r\n'))
+
+    def test_timelapse_bad_request(self):
+        """
+        Test that an invalid format, step or fps are bad requests, and a range without captures is not found
+        """
+        # Mock and data
+        create_test_captured_images(1, datetime(2020, 1, 1))
+        invalid_arguments = [{'format': 'mp4'}, {'step': 0}, {'step': 'a'}, {'fps': 0}, {'fps': 1000}]
+
+        # When / Validation
+        for arguments in invalid_arguments:
+            response = self.client.get(url_for('capture_mode.timelapse', **arguments))
+            self.assertEqual(response.status_code, 400, arguments)
+        response = self.client.get(url_for('capture_mode.timelapse', datetimeFrom='2020-01-02T00:00'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_timelapse_avi_changed_files(self):
+        """
+        Test that the AVI is stopped if a capture file is removed after its size was read, it would be corrupted
+        """
+        # Mock and data
+        captures = create_test_captured_images(3)
+        timelapse = Timelapse(CapturedImage.query, self.app.config['CAPTURES_DIR'])
+        timelapse.scan_avi()
+        os.remove(os.path.join(self.app.config['CAPTURES_DIR'], captures[1].relative_path))
+
+        # When / Validation
+        with self.assertRaises(OSError):
+            list(timelapse.iterate_avi())
+
+    def test_prefetcher_reads_ahead(self):
+        """
+        Test that the prefetcher reads up to max_frames files ahead of the consumer, and stops when it's closed
+        """
+        # Mock and data
+        captures = create_test_captured_images(6)
+        prefetcher = CapturesPrefetcher(CapturedImage.query, self.app.config['CAPTURES_DIR'], max_frames=2)
+
+        # When
+        with patch('picamera_server.views.helpers.timelapse._read_capture',
+                   wraps=lambda capture_path: capture_path.encode()) as mock_read:
+            prefetcher.start()
+            frames = iter(prefetcher)
+            first_frame = next(frames)
+            with prefetcher.condition:
+                prefetcher.condition.wait_for(lambda: len(prefetcher.frames) == 2, 5)
+            # The reader reads one more file and waits for room to add it
+            time.sleep(0.2)
+            read_ahead = mock_read.call_count
+            prefetcher.close()
+            prefetcher.reader_thread.join(5)
+
+        # Validation
+        self.assertEqual(first_frame, os.path.join(self.app.config['CAPTURES_DIR'],
+                                                   captures[0].relative_path).encode())
+        self.assertEqual(read_ahead, 4)
+        self.assertFalse(prefetcher.reader_thread.is_alive())
+        self.assertLess(mock_read.call_count, len(captures))
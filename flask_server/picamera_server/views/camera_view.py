@@ -1,5 +1,9 @@
-from picamera_server.camera.camera_controllers import get_camera_controller
-from flask import Blueprint, abort, render_template, Response, stream_with_context
+from picamera_server.camera.camera_controllers import get_frame_broadcaster, get_camera_ids
+from picamera_server.camera.frame_broadcaster import FrameBroadcaster
+from picamera_server.config.config import RENDITION_MIN_WIDTH, RENDITION_MAX_WIDTH, RENDITION_MIN_QUALITY,\
+    RENDITION_MAX_QUALITY
+from typing import Optional, Tuple
+from flask import Blueprint, abort, render_template, Response, stream_with_context, request, jsonify, url_for
 from flask_login import login_required
 from jinja2 import TemplateNotFound
 
@@ -8,9 +12,19 @@ camera = Blueprint('camera', __name__, template_folder='templates')
 
 UI_CAMERA_STREAM = 'UI_CAMERA_STREAM'
 VIDEO_FRAME = 'VIDEO_FRAME'
+CAMERA_VIDEO_FRAME = 'CAMERA_VIDEO_FRAME'
+STREAM_CLIENTS = 'STREAM_CLIENTS'
+CAMERA_STREAM_CLIENTS = 'CAMERA_STREAM_CLIENTS'
+SNAPSHOT = 'SNAPSHOT'
+CAMERA_SNAPSHOT = 'CAMERA_SNAPSHOT'
 ENDPOINTS = {
     UI_CAMERA_STREAM: '/camera/ui/stream',
     VIDEO_FRAME: '/camera/video_frame',
+    CAMERA_VIDEO_FRAME: '/camera/<camera_id>/video_frame',
+    STREAM_CLIENTS: '/camera/stream/clients',
+    CAMERA_STREAM_CLIENTS: '/camera/<camera_id>/stream/clients',
+    SNAPSHOT: '/camera/snapshot.jpg',
+    CAMERA_SNAPSHOT: '/camera/<camera_id>/snapshot.jpg',
 }
 
 TEMPLATES = {
@@ -18,6 +32,11 @@ TEMPLATES = {
 }
 
 MIME_TYPE_MULTIPART_FRAME = 'multipart/x-mixed-replace; boundary=frame'
+MIME_TYPE_JPEG = 'image/jpeg'
+
+QUERY_FPS = 'fps'
+QUERY_WIDTH = 'w'
+QUERY_QUALITY = 'q'
 
 
 @camera.route(ENDPOINTS[UI_CAMERA_STREAM], methods=['GET'])
@@ -27,28 +46,181 @@ def ui_camera_stream():
     GET
     responses:
         200:
-            description: GUI for the video stream
+            description: GUI for the video stream, with the stream of every camera
         404:
             description: Template not found
     :return:
     """
+    camera_ids = get_camera_ids()
+    if len(camera_ids) > 1:
+        stream_urls = [url_for('camera.video_frame', camera_id=camera_id) for camera_id in camera_ids]
+    else:
+        stream_urls = [url_for('camera.video_frame')]
     try:
-        return render_template(TEMPLATES[UI_CAMERA_STREAM], section='stream')
+        return render_template(TEMPLATES[UI_CAMERA_STREAM], section='stream', stream_urls=stream_urls)
     except TemplateNotFound:
         abort(404)
 
 
+def _get_stream_fps() -> Optional[float]:
+    """
+    Return the fps query argument of the stream request, abort with 400 if it's not a positive number
+
+    :return: Requested fps, None if not requested
+    """
+    fps = request.args.get(QUERY_FPS)
+    if fps is None:
+        return None
+
+    try:
+        fps = float(fps)
+        if fps <= 0:
+            raise ValueError
+    except ValueError:
+        abort(400, 'Query argument {} must be a positive number. Value received: {}'.format(QUERY_FPS, fps))
+
+    return fps
+
+
+def _get_stream_int_argument(name: str, min_value: int, max_value: int) -> Optional[int]:
+    """
+    Return an integer query argument of the stream request, abort with 400 if it's not an integer
+    between min_value and max_value
+
+    :param name: Name of the query argument
+    :param min_value:
+    :param max_value:
+    :return: Value of the argument, None if not requested
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    if not (value.isnumeric() and max_value >= int(value) >= min_value):
+        abort(400, 'Query argument {} must be an integer between {} and {}. Value received: {}'.format(name,
+                                                                                                         min_value,
+                                                                                                         max_value,
+                                                                                                         value))
+    return int(value)
+
+
+def get_camera_frame_broadcaster(camera_id: Optional[str] = None) -> FrameBroadcaster:
+    """
+    Return the frame broadcaster of the camera of the request, abort with 404 if there is no camera with the id
+
+    :param camera_id: Id of the camera, None for the default camera
+    :return:
+    """
+    broadcaster = get_frame_broadcaster(camera_id)
+    if not broadcaster:
+        abort(404, 'Camera {} not found'.format(camera_id))
+    return broadcaster
+
+
+def get_video_frame_arguments() -> Tuple[Optional[float], Optional[int], Optional[int]]:
+    """
+    Return the query arguments of the video stream request, abort with 400 if any of them is invalid.
+    Used by the video_frame view and by the asyncio stream server
+
+    :return: fps, width and quality requested, None for the arguments not requested
+    """
+    fps = _get_stream_fps()
+    width = _get_stream_int_argument(QUERY_WIDTH, RENDITION_MIN_WIDTH, RENDITION_MAX_WIDTH)
+    quality = _get_stream_int_argument(QUERY_QUALITY, RENDITION_MIN_QUALITY, RENDITION_MAX_QUALITY)
+    return fps, width, quality
+
+
 @camera.route(ENDPOINTS[VIDEO_FRAME], methods=['GET'])
+@camera.route(ENDPOINTS[CAMERA_VIDEO_FRAME], methods=['GET'])
 @login_required
-def video_frame():
+def video_frame(camera_id: Optional[str] = None):
     """
-    Endpoint used to feed the video stream with multipart responses
+    Endpoint used to feed the video stream with multipart responses.
+    The frames are taken from the frame broadcaster of the camera, so all the clients share the same camera captures
 
     GET:
+    parameters:
+        -   name: camera_id
+            type: str
+            in: path
+            required: false
+            description: Id of the camera, the default camera if not defined
+        -   name: fps
+            type: float
+            in: query
+            required: false
+            description: Target frames per second of the stream, limited to STREAM_MAX_FPS
+        -   name: w
+            type: int
+            in: query
+            required: false
+            description: Width of the frames, the rendition is shared by all the clients asking for it
+        -   name: q
+            type: int
+            in: query
+            required: false
+            description: JPEG quality of the frames, the rendition is shared by all the clients asking for it
     responses:
         200:
             description: multipart/x-mixed-replace; boundary=frame
+        400:
+            description: Invalid fps, width or quality value
+        404:
+            description: Camera not found
+    :return:
+    """
+    broadcaster = get_camera_frame_broadcaster(camera_id)
+    fps, width, quality = get_video_frame_arguments()
+    frames_generator = broadcaster.frames_generator(fps, width, quality, request.remote_addr)
+    return Response(stream_with_context(frames_generator), mimetype=MIME_TYPE_MULTIPART_FRAME)
+
+
+@camera.route(ENDPOINTS[STREAM_CLIENTS], methods=['GET'])
+@camera.route(ENDPOINTS[CAMERA_STREAM_CLIENTS], methods=['GET'])
+@login_required
+def stream_clients(camera_id: Optional[str] = None):
+    """
+    Counters of the clients connected to the video stream of a camera, a client with dropped frames is limited by
+    its link
+
+    GET
+    responses:
+        200:
+            description: JSON list of the clients, with the client address, connection timestamp and the
+                delivered, dropped and skipped frames
+        404:
+            description: Camera not found
     :return:
     """
-    return Response(stream_with_context(get_camera_controller().frames_generator()),
-                    mimetype=MIME_TYPE_MULTIPART_FRAME)
+    return jsonify(get_camera_frame_broadcaster(camera_id).get_clients_stats())
+
+
+@camera.route(ENDPOINTS[SNAPSHOT], methods=['GET'])
+@camera.route(ENDPOINTS[CAMERA_SNAPSHOT], methods=['GET'])
+@login_required
+def snapshot(camera_id: Optional[str] = None):
+    """
+    Last frame published by the frame broadcaster of a camera, the camera is not captured by the request.
+    The ETag is derived from the frame sequence, a request with the If-None-Match of the last frame gets a 304
+
+    GET
+    responses:
+        200:
+            description: image/jpeg
+        304:
+            description: The frame didn't change
+        404:
+            description: Camera not found
+        503:
+            description: There is no frame from the camera yet
+    :return:
+    """
+    broadcaster = get_camera_frame_broadcaster(camera_id)
+    sequence, frame = broadcaster.get_snapshot()
+    if not sequence:
+        abort(503, 'There is no frame from the camera yet')
+
+    response = Response(frame, mimetype=MIME_TYPE_JPEG)
+    response.set_etag('{}-{}'.format(broadcaster.boot_id, sequence))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
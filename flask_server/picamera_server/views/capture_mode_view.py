@@ -1,31 +1,64 @@
-from picamera_server.models import CapturedImage
-from picamera_server.camera.capture_controller import get_capture_controller
-from picamera_server.views.helpers.captures import get_captures_grids, format_timestamp, FRONTEND_TS
-from flask import Blueprint, abort, render_template, request, url_for, redirect, current_app, send_from_directory
+import os
+import click
+from datetime import datetime
+from typing import Optional, Tuple
+from picamera_server.models import CapturedImage, CaptureCount
+from picamera_server.camera.capture_controller import CaptureController, get_capture_controller
+from picamera_server.camera.capture_writer import flush_captures
+from picamera_server.camera.thumbnails import get_thumbnail_cache
+from picamera_server.config.config import THUMBNAIL_WIDTHS, CAPTURE_CACHE_MAX_AGE, TIMELAPSE_FPS, TIMELAPSE_MAX_FPS
+from picamera_server.views.helpers.captures import get_captures_grids, format_timestamp, filter_captures_by_date,\
+    FRONTEND_TS_FORMAT, DB_TS_FORMAT, SORT_ASC, SORT_DIRECTIONS, PAGE_NEXT, PAGE_DIRECTIONS, parse_cursor,\
+    get_captures_page, get_capture_etag
+from picamera_server.views.helpers.captures_export import CapturesExport, EXPORT_FORMATS, EXPORT_FORMAT_ZIP,\
+    EXPORT_MIMETYPES
+from picamera_server.views.helpers.timelapse import Timelapse, TIMELAPSE_FORMATS, TIMELAPSE_FORMAT_AVI, MIME_TYPE_AVI
+from picamera_server.views.camera_view import MIME_TYPE_MULTIPART_FRAME
+from flask import Blueprint, abort, render_template, request, url_for, redirect, current_app, send_from_directory,\
+    stream_with_context
+from werkzeug.wrappers import Response
+from werkzeug.security import safe_join
 from flask_login import login_required
 from jinja2 import TemplateNotFound
 
 
-capture_mode = Blueprint('capture_mode', __name__, template_folder='templates')
+CAPTURES_CLI_GROUP = 'captures'
+
+capture_mode = Blueprint('capture_mode', __name__, template_folder='templates', cli_group=CAPTURES_CLI_GROUP)
+
+CAPTURES_EXPORT_COMMAND = 'export'
 
 FORM_CAPTURE_INTERVAL = 'capture_interval'
 FORM_STATUS = 'status'
+FORM_CAPTURE_MODE = 'capture_mode'
+FORM_CAMERA_ID = 'camera_id'
+FORM_EXPORT_FORMAT = 'format'
+FORM_TIMELAPSE_STEP = 'step'
+FORM_TIMELAPSE_FPS = 'fps'
 
 UI_CONFIG_CAPTURE_MODE = 'UI_CONFIG_CAPTURE_MODE'
 UI_CAPTURES_PAGINATED_DEFAULT = 'UI_CAPTURES_PAGINATED_DEFAULT'
 UI_CAPTURES_PAGINATED = 'UI_CAPTURES_PAGINATED'
 SET_STATUS_CAPTURE_MODE = 'SET_STATUS_CAPTURE_MODE'
 SET_CAPT_INTERVAL_VALUE = 'SET_CAPT_INTERVAL_VALUE'
+SET_CAPTURE_MODE = 'SET_CAPTURE_MODE'
 REMOVE_ALL_CAPTURES = 'REMOVE_ALL_CAPTURES'
 GET_CAPTURED_IMAGE = 'GET_CAPTURED_IMAGE'
+GET_CAPTURED_THUMBNAIL = 'GET_CAPTURED_THUMBNAIL'
+EXPORT_CAPTURES = 'EXPORT_CAPTURES'
+TIMELAPSE = 'TIMELAPSE'
 ENDPOINTS = {
     UI_CONFIG_CAPTURE_MODE: '/camera/ui/captures/config/',
     UI_CAPTURES_PAGINATED_DEFAULT: '/camera/ui/captures/',
     UI_CAPTURES_PAGINATED: '/camera/ui/captures/<page_number>/',
     GET_CAPTURED_IMAGE: '/camera/captured/image/',
+    GET_CAPTURED_THUMBNAIL: '/camera/captured/thumbnail/',
     SET_CAPT_INTERVAL_VALUE: '/camera/captures/config/capture_interval/',
+    SET_CAPTURE_MODE: '/camera/captures/config/capture_mode/',
     SET_STATUS_CAPTURE_MODE: '/camera/captures/config/set_status_capture_mode/',
-    REMOVE_ALL_CAPTURES: '/camera/captures/remove/'
+    REMOVE_ALL_CAPTURES: '/camera/captures/remove/',
+    EXPORT_CAPTURES: '/camera/captures/export/',
+    TIMELAPSE: '/camera/captures/timelapse/'
 }
 
 TEMPLATES = {
@@ -34,20 +67,133 @@ TEMPLATES = {
 }
 
 
+def _get_request_capture_controller() -> CaptureController:
+    """
+    Return the capture controller of the camera_id query or form argument, the default camera if there is no
+    camera_id. Abort with 404 if there is no camera with the id
+
+    :return:
+    """
+    camera_id = request.values.get(FORM_CAMERA_ID) or None
+    capture_controller = get_capture_controller(camera_id)
+    if not capture_controller:
+        abort(404, 'Camera {} not found'.format(camera_id))
+    return capture_controller
+
+
+def _get_request_dates() -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Return the dates of the datetimeFrom and datetimeUntil query arguments, None if they are not defined or invalid
+    :return:
+    """
+    date_from = format_timestamp(request.args.get('datetimeFrom', ''))
+    date_until = format_timestamp(request.args.get('datetimeUntil', ''))
+    return (datetime.strptime(date_from, DB_TS_FORMAT) if date_from else None,
+            datetime.strptime(date_until, DB_TS_FORMAT) if date_until else None)
+
+
+def _get_dates_file_name(name: str, extension: str, date_from: Optional[datetime],
+                         date_until: Optional[datetime]) -> str:
+    """
+    Return the name of a downloaded file of the captures of a date range, ex. captures_20200101T0000_last.zip
+
+    :param name:
+    :param extension:
+    :param date_from: None for the first capture
+    :param date_until: None for the last capture
+    :return:
+    """
+    return '{}_{}_{}.{}'.format(name, date_from.strftime('%Y%m%dT%H%M') if date_from else 'first',
+                                date_until.strftime('%Y%m%dT%H%M') if date_until else 'last', extension)
+
+
+def _set_capture_cache_headers(response: Response, etag: str) -> None:
+    """
+    Set the ETag and the Cache-Control of a capture or thumbnail response. The captures are never modified once
+    written, so the browsers can cache them for CAPTURE_CACHE_MAX_AGE without revalidating them
+
+    :param response:
+    :param etag: Strong ETag of the capture
+    :return:
+    """
+    response.set_etag(etag)
+    response.cache_control.max_age = CAPTURE_CACHE_MAX_AGE
+    # The captures are only served to the logged in users, send_file marks the files as public
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+
+
+def _get_not_modified_response(etag: Optional[str]) -> Optional[Response]:
+    """
+    Return a 304 response if the If-None-Match header of the request has the ETag, without reading the file
+
+    :param etag: Strong ETag of the capture
+    :return: None if the file must be sent
+    """
+    if not etag or not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    _set_capture_cache_headers(response, etag)
+    return response
+
+
+def _send_capture_file(directory: str, relative_path: str, etag: Optional[str]) -> Response:
+    """
+    Send a capture or thumbnail file with the cache headers of the capture. A conditional request with the ETag
+    gets a 304, and a Range request gets the requested part of the file
+
+    :param directory: Dir of the file
+    :param relative_path: Path of the file in the directory
+    :param etag: Strong ETag of the capture, None to send the file with the default headers
+    :return:
+    """
+    if not etag:
+        return send_from_directory(directory, relative_path)
+
+    not_modified_response = _get_not_modified_response(etag)
+    if not_modified_response:
+        return not_modified_response
+    response = send_from_directory(directory, relative_path, conditional=False, add_etags=False,
+                                   cache_timeout=CAPTURE_CACHE_MAX_AGE)
+    _set_capture_cache_headers(response, etag)
+    # Advertise the ranges in the complete responses too, so the clients can resume an interrupted download
+    response.accept_ranges = 'bytes'
+    return response.make_conditional(request, accept_ranges=True,
+                                     complete_length=os.path.getsize(safe_join(directory, relative_path)))
+
+
+def _redirect_to_ui_config_capture_mode() -> Response:
+    """
+    Redirect to the capture mode UI of the camera of the request
+    :return:
+    """
+    camera_id = request.values.get(FORM_CAMERA_ID)
+    if camera_id:
+        return redirect(url_for('capture_mode.ui_config_capture_mode', camera_id=camera_id))
+    return redirect(url_for('capture_mode.ui_config_capture_mode'))
+
+
 @capture_mode.route(ENDPOINTS[UI_CONFIG_CAPTURE_MODE], methods=['GET'])
 @login_required
 def ui_config_capture_mode():
     """
     GET
+    parameters:
+        -   name: camera_id
+            type: str
+            in: query
+            required: false
+            description: Id of the camera, the default camera if not defined
     responses:
         200:
-            description: GUI to manage capture mode
+            description: GUI to manage capture mode of a camera
         404:
-            description: Template not found
+            description: Template or camera not found
     :return:
     """
+    capture_controller = _get_request_capture_controller()
     try:
-        capture_controller = get_capture_controller()
         data = capture_controller.get_capture_controller_status()
         return render_template(TEMPLATES[UI_CONFIG_CAPTURE_MODE], section='capture config', data=data)
     except TemplateNotFound:
@@ -66,6 +212,11 @@ def set_capt_interval_value():
             in: form
             required: true
             description: Value to set the capture interval
+        -   name: camera_id
+            type: str
+            in: form
+            required: false
+            description: Id of the camera, the default camera if not defined
     responses:
         200:
             description: Value modified
@@ -76,7 +227,7 @@ def set_capt_interval_value():
 
     :return:
     """
-    capture_controller = get_capture_controller()
+    capture_controller = _get_request_capture_controller()
     capture_interval = request.form.get(FORM_CAPTURE_INTERVAL, '')
     try:
         capture_controller.update_capture_interval(capture_interval)
@@ -92,7 +243,50 @@ def set_capt_interval_value():
         current_app.logger.exception('Unexpected exception {}'.format(e))
         abort(500, 'Unexpected error')
 
-    return redirect(url_for('capture_mode.ui_config_capture_mode'))
+    return _redirect_to_ui_config_capture_mode()
+
+
+@capture_mode.route(ENDPOINTS[SET_CAPTURE_MODE], methods=['POST'])
+@login_required
+def set_capture_mode():
+    """
+    Configure the capture mode, store a capture every capture interval or only the frames with motion
+
+    parameters:
+        -   name: capture_mode
+            type: str
+            in: form
+            required: true
+            description: Capture mode, 'interval' or 'motion'
+        -   name: camera_id
+            type: str
+            in: form
+            required: false
+            description: Id of the camera, the default camera if not defined
+    responses:
+        200:
+            description: Value modified
+        400:
+            description: Invalid request, value not correct
+        500:
+            description: Unexpected Error
+
+    :return:
+    """
+    capture_controller = _get_request_capture_controller()
+    new_capture_mode = request.form.get(FORM_CAPTURE_MODE, '')
+    try:
+        capture_controller.update_capture_mode(new_capture_mode)
+    except ValueError as e:
+        error_message = 'Form argument {} must be one of {}. Value received: {}. {}'.format(
+            FORM_CAPTURE_MODE, capture_controller.CAPTURE_MODES, new_capture_mode, e)
+        current_app.logger.exception(error_message)
+        abort(400, error_message)
+    except Exception as e:
+        current_app.logger.exception('Unexpected exception {}'.format(e))
+        abort(500, 'Unexpected error')
+
+    return _redirect_to_ui_config_capture_mode()
 
 
 @capture_mode.route(ENDPOINTS[SET_STATUS_CAPTURE_MODE], methods=['POST'])
@@ -108,6 +302,11 @@ def set_status_capture_mode():
             in: form
             required: true
             description: Set capture mode to on / off
+        -   name: camera_id
+            type: str
+            in: form
+            required: false
+            description: Id of the camera, the default camera if not defined
     responses:
         200:
             description: Status to set
@@ -116,7 +315,7 @@ def set_status_capture_mode():
 
     :return:
     """
-    capture_controller = get_capture_controller()
+    capture_controller = _get_request_capture_controller()
     status = request.form.get(FORM_STATUS, '')
 
     if not status:
@@ -128,23 +327,31 @@ def set_status_capture_mode():
         current_app.logger.exception('Unexpected exception {}'.format(e))
         abort(500, 'Unexpected error')
 
-    return redirect(url_for('capture_mode.ui_config_capture_mode'))
+    return _redirect_to_ui_config_capture_mode()
 
 
 @capture_mode.route(ENDPOINTS[REMOVE_ALL_CAPTURES], methods=['POST'])
 @login_required
 def remove_all_captures():
     """
-    Remove all the stored captures
+    Remove all the stored captures of a camera
+    parameters:
+        -   name: camera_id
+            type: str
+            in: form
+            required: false
+            description: Id of the camera, the default camera if not defined
     responses:
         200:
-            description: All captures removed
+            description: All captures of the camera removed
+        404:
+            description: Camera not found
         500:
             description: Unexpected Error
 
     :return:
     """
-    capture_controller = get_capture_controller()
+    capture_controller = _get_request_capture_controller()
 
     try:
         capture_controller.remove_all_captures()
@@ -152,21 +359,15 @@ def remove_all_captures():
         current_app.logger.exception('Unexpected exception {}'.format(e))
         abort(500, 'Unexpected error')
 
-    return redirect(url_for('capture_mode.ui_config_capture_mode'))
+    return _redirect_to_ui_config_capture_mode()
 
 
 @capture_mode.route(ENDPOINTS[UI_CAPTURES_PAGINATED_DEFAULT], methods=['GET'])
-@capture_mode.route(ENDPOINTS[UI_CAPTURES_PAGINATED], methods=['GET'])
 @login_required
-def ui_captures_paginated(page_number: int = 1):
+def ui_captures_paginated():
     """
     GET
     parameters:
-        -   name: page_number
-            type: int
-            in: path
-            required: false
-            description: Value of page to retrieve
         -   name: date_from
             type: str
             in: query
@@ -177,37 +378,100 @@ def ui_captures_paginated(page_number: int = 1):
             in: query
             required: false
             description: Date until to filter images DateTime format
+        -   name: sort
+            type: str
+            in: query
+            required: false
+            description: Order of the captures by date, 'asc' (default) or 'desc'
+        -   name: cursor
+            type: str
+            in: query
+            required: false
+            description: Cursor of the next or previous page, the first page if not defined
+        -   name: direction
+            type: str
+            in: query
+            required: false
+            description: 'next' (default) for the page after the cursor, 'prev' for the page before the cursor
+        -   name: jumpTo
+            type: str
+            in: query
+            required: false
+            description: Show the page starting at the first capture taken at this DateTime, the cursor is ignored
     responses:
         200:
             description: GUI to Show the captures paginated
+        400:
+            description: Invalid sort, cursor, direction or jumpTo
 
-    :param page_number:
     :return:
     """
-    # Create query and apply filters
-    query = CapturedImage.query
-
-    date_from = format_timestamp(request.args.get('datetimeFrom', ''))
-    date_until = format_timestamp(request.args.get('datetimeUntil', ''))
-    if date_from:
-        query = query.filter(CapturedImage.created_at >= date_from)
-    if date_until:
-        query = query.filter(CapturedImage.created_at <= date_until)
-    db_captures = query.paginate(int(page_number), current_app.config['ITEMS_PER_PAGE'], False)
-
-    template_captures_grids = get_captures_grids(db_captures.items)
+    sort = request.args.get('sort', SORT_ASC)
+    direction = request.args.get('direction', PAGE_NEXT)
+    if sort not in SORT_DIRECTIONS:
+        abort(400, 'Invalid sort, options: {}'.format(SORT_DIRECTIONS))
+    if direction not in PAGE_DIRECTIONS:
+        abort(400, 'Invalid direction, options: {}'.format(PAGE_DIRECTIONS))
+
+    cursor = None
+    if request.args.get('cursor'):
+        try:
+            cursor = parse_cursor(request.args['cursor'])
+        except ValueError:
+            abort(400, 'Invalid cursor')
+
+    jump_to = None
+    if request.args.get('jumpTo'):
+        try:
+            jump_to = datetime.strptime(request.args['jumpTo'], FRONTEND_TS_FORMAT)
+        except ValueError:
+            abort(400, 'Invalid jumpTo, format: {}'.format(FRONTEND_TS_FORMAT))
+
+    # Commit the queued captures so the page shows the last ones, then create query and apply filters
+    flush_captures()
+    date_from, date_until = _get_request_dates()
+    query = filter_captures_by_date(CapturedImage.query, date_from, date_until)
+    captures, next_cursor, prev_cursor = get_captures_page(query, current_app.config['ITEMS_PER_PAGE'], sort,
+                                                           cursor, direction, jump_to)
+
+    template_captures_grids = get_captures_grids(captures)
     template_data = {
         'captures_grids': template_captures_grids,
-        'total_pages': db_captures.pages,
-        'total_captures': db_captures.total,
-        'current_page': db_captures.page,
-        'date_from': format_timestamp(date_from, FRONTEND_TS),
-        'date_until': format_timestamp(date_until, FRONTEND_TS)
+        'total_captures': CaptureCount.count_captures(date_from, date_until),
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'sort': sort,
+        'date_from': date_from.strftime(FRONTEND_TS_FORMAT) if date_from else '',
+        'date_until': date_until.strftime(FRONTEND_TS_FORMAT) if date_until else ''
     }
 
     return render_template(TEMPLATES[UI_CAPTURES_PAGINATED], data=template_data, section='captures')
 
 
+@capture_mode.route(ENDPOINTS[UI_CAPTURES_PAGINATED], methods=['GET'])
+@login_required
+def ui_captures_page_number(page_number: str):
+    """
+    GET
+    parameters:
+        -   name: page_number
+            type: int
+            in: path
+            required: true
+            description: Page of the old paginated captures page, ignored
+    responses:
+        301:
+            description: Redirect to the first page of the captures with the same sort and date filters, the pages
+                         are linked with cursors, page numbers are not supported
+
+    :param page_number:
+    :return:
+    """
+    arguments = {argument: request.args[argument] for argument in ['sort', 'datetimeFrom', 'datetimeUntil']
+                 if argument in request.args}
+    return redirect(url_for('capture_mode.ui_captures_paginated', **arguments), 301)
+
+
 @capture_mode.route(ENDPOINTS[GET_CAPTURED_IMAGE], methods=['GET'])
 @login_required
 def get_captured_image():
@@ -222,10 +486,224 @@ def get_captured_image():
     responses:
         200:
             description: Return a the file with that relative path in CAPTURES_DIR.
+        206:
+            description: Part of the file requested with a Range header
+        304:
+            description: The file was not modified, the If-None-Match header has its ETag
         404:
             description: File not found
+        416:
+            description: Invalid Range
     :return:
     """
+    relative_path = request.args.get('relative_path', '')
+    capture = CapturedImage.query.filter_by(relative_path=relative_path).first()
+    # Replace for windows testing env
+    return _send_capture_file(current_app.config['CAPTURES_DIR'], relative_path.replace('\\', '/'),
+                              get_capture_etag(capture) if capture else None)
+
+
+@capture_mode.route(ENDPOINTS[GET_CAPTURED_THUMBNAIL], methods=['GET'])
+@login_required
+def get_captured_thumbnail():
+    """
+    GET
+    parameters:
+        -   name: relative_path
+            type: str
+            in: query
+            required: false
+            description: Relative path of the captured image
+        -   name: width
+            type: int
+            in: query
+            required: false
+            description: Width of the thumbnail, one of THUMBNAIL_WIDTHS, the first one by default
+    responses:
+        200:
+            description: Return the thumbnail of the file with that relative path in CAPTURES_DIR.
+        304:
+            description: The thumbnail was not modified, the If-None-Match header has its ETag
+        400:
+            description: Invalid width
+        404:
+            description: Capture or file not found
+    :return:
+    """
+    width = request.args.get('width', THUMBNAIL_WIDTHS[0], type=int)
+    if width not in THUMBNAIL_WIDTHS:
+        abort(400, 'Invalid width, options: {}'.format(THUMBNAIL_WIDTHS))
+
     # Replace for windows testing env
     relative_path = request.args.get('relative_path', '')
-    return send_from_directory(current_app.config['CAPTURES_DIR'], relative_path.replace('\\', '/'))
+    capture = CapturedImage.query.filter_by(relative_path=relative_path).first()
+    # The thumbnails of a removed capture are not served or generated again, even if its file is still there
+    if not capture:
+        abort(404)
+    etag = get_capture_etag(capture, width)
+    # The thumbnail cached by the browser is still valid, it's not generated again
+    not_modified_response = _get_not_modified_response(etag)
+    if not_modified_response:
+        return not_modified_response
+    try:
+        thumbnail_relative_path = get_thumbnail_cache().get_thumbnail(relative_path.replace('\\', '/'), width)
+    except FileNotFoundError:
+        abort(404)
+    return _send_capture_file(current_app.config['THUMBNAILS_DIR'], thumbnail_relative_path, etag)
+
+
+@capture_mode.route(ENDPOINTS[EXPORT_CAPTURES], methods=['GET'])
+@login_required
+def export_captures():
+    """
+    Download the captures as a ZIP or TAR archive, with a manifest.csv with the id, camera, creation time and path
+    of the captures. The archive is built while it's sent, with stored entries, so it's not kept in memory or disk
+
+    parameters:
+        -   name: datetimeFrom
+            type: str
+            in: query
+            required: false
+            description: Date from to filter the captures DateTime format
+        -   name: datetimeUntil
+            type: str
+            in: query
+            required: false
+            description: Date until to filter the captures DateTime format
+        -   name: format
+            type: str
+            in: query
+            required: false
+            description: Format of the archive, 'zip' (default) or 'tar'
+    responses:
+        200:
+            description: Archive of the captures
+        400:
+            description: Invalid format
+
+    :return:
+    """
+    archive_format = request.args.get(FORM_EXPORT_FORMAT, EXPORT_FORMAT_ZIP)
+    if archive_format not in EXPORT_FORMATS:
+        abort(400, 'Invalid format, options: {}'.format(EXPORT_FORMATS))
+
+    # Commit the queued captures so the archive has the last ones
+    flush_captures()
+    date_from, date_until = _get_request_dates()
+    export = CapturesExport(filter_captures_by_date(CapturedImage.query, date_from, date_until),
+                            current_app.config['CAPTURES_DIR'], archive_format)
+    file_name = _get_dates_file_name('captures', archive_format, date_from, date_until)
+    return Response(stream_with_context(iter(export)), mimetype=EXPORT_MIMETYPES[archive_format],
+                    headers={'Content-Disposition': 'attachment; filename="{}"'.format(file_name)})
+
+
+@capture_mode.cli.command(CAPTURES_EXPORT_COMMAND)
+@click.argument('output', type=click.File('wb'), required=True)
+@click.option('--datetime-from', type=click.DateTime([FRONTEND_TS_FORMAT]), default=None,
+              help='Export the captures taken from this date, format YYYY-MM-DDTHH:MM')
+@click.option('--datetime-until', type=click.DateTime([FRONTEND_TS_FORMAT]), default=None,
+              help='Export the captures taken until this date, format YYYY-MM-DDTHH:MM')
+@click.option('--format', 'archive_format', type=click.Choice(EXPORT_FORMATS), default=EXPORT_FORMAT_ZIP,
+              help='Format of the archive')
+def captures_export(output, datetime_from: Optional[datetime], datetime_until: Optional[datetime],
+                    archive_format: str):
+    """
+    Export the captures to a ZIP or TAR archive, "-" as output writes it to the stdout
+
+    :param output: File of the archive
+    :param datetime_from:
+    :param datetime_until:
+    :param archive_format: One of EXPORT_FORMATS
+    :return:
+    """
+    export = CapturesExport(filter_captures_by_date(CapturedImage.query, datetime_from, datetime_until),
+                            current_app.config['CAPTURES_DIR'], archive_format)
+    for data in export:
+        output.write(data)
+    output.flush()
+
+    message = 'Exported {} captures, {} skipped with the file missing'.format(export.exported, export.skipped)
+    current_app.logger.info(message)
+    click.echo(message, err=True)
+
+
+@capture_mode.route(ENDPOINTS[TIMELAPSE], methods=['GET'])
+@login_required
+def timelapse():
+    """
+    Timelapse of the captures, built while it's sent with the captures as frames, without encoding them again.
+    The AVI is a MJPEG AVI file, the sizes of the capture files are read before sending it for its header.
+    The MJPEG stream is played by the browsers and starts with the first capture
+
+    parameters:
+        -   name: datetimeFrom
+            type: str
+            in: query
+            required: false
+            description: Date from to filter the captures DateTime format
+        -   name: datetimeUntil
+            type: str
+            in: query
+            required: false
+            description: Date until to filter the captures DateTime format
+        -   name: step
+            type: int
+            in: query
+            required: false
+            description: Number of captures per frame, 1 (default) to use all the captures
+        -   name: fps
+            type: float
+            in: query
+            required: false
+            description: Frames per second of the timelapse, TIMELAPSE_FPS by default, the MJPEG stream is limited to
+                STREAM_MAX_FPS
+        -   name: format
+            type: str
+            in: query
+            required: false
+            description: 'avi' (default) for a MJPEG AVI file, 'mjpeg' for a MJPEG stream
+    responses:
+        200:
+            description: video/x-msvideo or multipart/x-mixed-replace; boundary=frame
+        400:
+            description: Invalid step, fps or format, or the AVI is too big
+        404:
+            description: There are no captures in the date range
+    :return:
+    """
+    timelapse_format = request.args.get(FORM_EXPORT_FORMAT, TIMELAPSE_FORMAT_AVI)
+    step = request.args.get(FORM_TIMELAPSE_STEP, '1')
+    fps = request.args.get(FORM_TIMELAPSE_FPS, str(TIMELAPSE_FPS))
+    if timelapse_format not in TIMELAPSE_FORMATS:
+        abort(400, 'Invalid format, options: {}'.format(TIMELAPSE_FORMATS))
+    if not step.isnumeric() or int(step) < 1:
+        abort(400, 'Query argument {} must be a positive integer. Value received: {}'.format(FORM_TIMELAPSE_STEP,
+                                                                                              step))
+    try:
+        fps = float(fps)
+        if not 0 < fps <= TIMELAPSE_MAX_FPS:
+            raise ValueError
+    except ValueError:
+        abort(400, 'Query argument {} must be a number between 0 and {}. Value received: {}'.format(
+            FORM_TIMELAPSE_FPS, TIMELAPSE_MAX_FPS, fps))
+
+    # Commit the queued captures so the timelapse has the last ones
+    flush_captures()
+    date_from, date_until = _get_request_dates()
+    captures_timelapse = Timelapse(filter_captures_by_date(CapturedImage.query, date_from, date_until),
+                                   current_app.config['CAPTURES_DIR'], int(step), fps)
+    if not captures_timelapse.last_capture_id:
+        abort(404, 'There are no captures in the date range')
+    if timelapse_format != TIMELAPSE_FORMAT_AVI:
+        return Response(stream_with_context(captures_timelapse.iterate_mjpeg()), mimetype=MIME_TYPE_MULTIPART_FRAME)
+
+    try:
+        avi_size = captures_timelapse.scan_avi()
+    except ValueError as e:
+        abort(400, '{}, use a bigger step or a shorter date range'.format(e))
+    if not avi_size:
+        abort(404, 'There are no capture files in the date range')
+    file_name = _get_dates_file_name('timelapse', TIMELAPSE_FORMAT_AVI, date_from, date_until)
+    return Response(stream_with_context(captures_timelapse.iterate_avi()), mimetype=MIME_TYPE_AVI,
+                    headers={'Content-Disposition': 'attachment; filename="{}"'.format(file_name),
+                             'Content-Length': str(avi_size)})
@@ -1,5 +1,7 @@
 from datetime import datetime
-from typing import List
+from typing import Iterator, List, Optional, Tuple
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import tuple_
 from picamera_server.models import CapturedImage
 
 FRONTEND_TS_FORMAT = '%Y-%m-%dT%H:%M'
@@ -7,12 +9,25 @@ DB_TS_FORMAT = '%Y-%m-%d %H:%M:%S.0'
 FRONTEND_TS = 'frontend'
 DB_TS = 'db'
 
+# Keyset pagination of the captures on (created_at, id)
+SORT_ASC = 'asc'
+SORT_DESC = 'desc'
+SORT_DIRECTIONS = [SORT_ASC, SORT_DESC]
+PAGE_NEXT = 'next'
+PAGE_PREV = 'prev'
+PAGE_DIRECTIONS = [PAGE_NEXT, PAGE_PREV]
+CURSOR_TS_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# Id bigger than any capture id, a cursor with it is after all the captures of its created_at
+MAX_CAPTURE_ID = 2 ** 63 - 1
+
+# Position of a capture in the keyset: created_at and id
+CaptureKey = Tuple[datetime, int]
+
 
 def get_captures_grids(captures: List[CapturedImage], grid_size: int = 4) -> List[object]:
     """
-    Return a list of captures grid to send to the templating for showing the captures
-    in the UI_CAPTURES_PAGINATED page.
-
+    Return a list of captures grid to send to the templating for showing a page of captures
+    in the UI_CAPTURES_PAGINATED page, the captures of the page are already sorted and limited by the cursor.
 
     The grid item will be a dict with the "image" (relative_path) and the "date" of the capture
     :param captures:
@@ -52,3 +67,178 @@ def format_timestamp(timestamp: str,
         formatted_date = ''
 
     return formatted_date
+
+
+def filter_captures_by_date(query: BaseQuery, date_from: Optional[datetime] = None,
+                            date_until: Optional[datetime] = None) -> BaseQuery:
+    """
+    Filter the captures taken between the dates, both included
+
+    :param query:
+    :param date_from: None to not filter the first capture
+    :param date_until: None to not filter the last capture
+    :return:
+    """
+    if date_from:
+        query = query.filter(CapturedImage.created_at >= date_from)
+    if date_until:
+        query = query.filter(CapturedImage.created_at <= date_until)
+    return query
+
+
+def get_capture_etag(capture: CapturedImage, width: Optional[int] = None) -> str:
+    """
+    Return the strong ETag of a capture file, or of its thumbnail of the width. The captures are never modified,
+    so the id identifies the content, the created_at is added because the ids can be reused after removing all the
+    captures
+
+    :param capture:
+    :param width: Width of the thumbnail, None for the capture file
+    :return:
+    """
+    etag = 'capture-{}-{}'.format(capture.id, capture.created_at.strftime('%Y%m%d%H%M%S%f'))
+    if width:
+        etag += '-{}'.format(width)
+    return etag
+
+
+def get_capture_key(capture: CapturedImage) -> CaptureKey:
+    """
+    Return the key of a capture in the keyset pagination
+
+    :param capture:
+    :return: created_at and id of the capture
+    """
+    return capture.created_at, capture.id
+
+
+def format_cursor(key: CaptureKey) -> str:
+    """
+    Return the cursor of a key, used in the urls to continue the pagination after or before the key
+
+    :param key: Key of a capture
+    :return:
+    """
+    created_at, capture_id = key
+    return '{}_{}'.format(created_at.strftime(CURSOR_TS_FORMAT), capture_id)
+
+
+def parse_cursor(cursor: str) -> CaptureKey:
+    """
+    Return the key of a cursor created with format_cursor
+
+    :param cursor:
+    :raises ValueError: If the cursor is invalid
+    :return: created_at and id of the capture
+    """
+    created_at, _, capture_id = cursor.rpartition('_')
+    return datetime.strptime(created_at, CURSOR_TS_FORMAT), int(capture_id)
+
+
+def _filter_keys(query: BaseQuery, key: CaptureKey, ascending: bool) -> BaseQuery:
+    """
+    Filter the captures after the key, in the ascending or descending order of the keys
+
+    :param query:
+    :param key:
+    :param ascending:
+    :return:
+    """
+    capture_key = tuple_(CapturedImage.created_at, CapturedImage.id)
+    return query.filter(capture_key > key if ascending else capture_key < key)
+
+
+def _order_keys(query: BaseQuery, ascending: bool) -> BaseQuery:
+    """
+    Order the captures by the keys, ascending or descending
+
+    :param query:
+    :param ascending:
+    :return:
+    """
+    if ascending:
+        return query.order_by(CapturedImage.created_at.asc(), CapturedImage.id.asc())
+    return query.order_by(CapturedImage.created_at.desc(), CapturedImage.id.desc())
+
+
+def _exists_after(query: BaseQuery, key: CaptureKey, ascending: bool) -> bool:
+    """
+    Return if there is any capture after the key, in the ascending or descending order of the keys
+
+    :param query:
+    :param key:
+    :param ascending:
+    :return:
+    """
+    return _filter_keys(query, key, ascending).with_entities(CapturedImage.id).limit(1).first() is not None
+
+
+def get_captures_page(query: BaseQuery, page_size: int, sort: str = SORT_ASC, cursor: Optional[CaptureKey] = None,
+                      direction: str = PAGE_NEXT,
+                      jump_to: Optional[datetime] = None) -> Tuple[List[CapturedImage], Optional[str], Optional[str]]:
+    """
+    Return a page of captures with keyset pagination on (created_at, id).
+    The page starts after the cursor, or ends before it when going to the previous page, so the captures are
+    found with the created_at index and every page costs the same, no matter how deep it is. The order is stable even
+    for captures with the same created_at.
+
+    :param query: Query of the captures, with the filters applied
+    :param page_size: Max number of captures of the page
+    :param sort: One of SORT_DIRECTIONS, order of the captures in the pages
+    :param cursor: Key of the capture where the page starts or ends, None for the first page
+    :param direction: One of PAGE_DIRECTIONS, PAGE_NEXT for the page after the cursor, PAGE_PREV for the page before
+    :param jump_to: Start the page at the first capture taken at this time or later, or earlier with SORT_DESC,
+        the cursor and direction are ignored
+    :return: The captures of the page, the cursors of the next and previous pages, None if there are no more pages
+    """
+    ascending = sort == SORT_ASC
+    forward = direction == PAGE_NEXT
+    if jump_to:
+        cursor = (jump_to, 0) if ascending else (jump_to, MAX_CAPTURE_ID)
+        forward = True
+
+    # The next page of an ascending sort or the previous page of a descending sort reads the keys ascending
+    read_ascending = ascending == forward
+    page_query = _filter_keys(query, cursor, read_ascending) if cursor else query
+    captures = _order_keys(page_query, read_ascending).limit(page_size + 1).all()
+    more_captures = len(captures) > page_size
+    captures = captures[:page_size]
+    if not forward:
+        captures.reverse()
+
+    if not captures:
+        # There are no captures past the cursor, ex. jumping to a time after the last capture,
+        # the page before it or after it is still available
+        if not cursor:
+            return [], None, None
+        if forward:
+            return [], None, format_cursor(cursor) if _exists_after(query, cursor, not ascending) else None
+        return [], format_cursor(cursor) if _exists_after(query, cursor, ascending) else None, None
+
+    first_key = get_capture_key(captures[0])
+    last_key = get_capture_key(captures[-1])
+    has_next = more_captures if forward else _exists_after(query, last_key, ascending)
+    has_previous = more_captures if not forward else _exists_after(query, first_key, not ascending)
+    next_cursor = format_cursor(last_key) if has_next else None
+    previous_cursor = format_cursor(first_key) if has_previous else None
+    return captures, next_cursor, previous_cursor
+
+
+def iterate_captures(query: BaseQuery, batch_size: int) -> Iterator[CapturedImage]:
+    """
+    Iterate all the captures of the query in ascending order of (created_at, id).
+    The captures are read in batches with the keyset pagination, so only a batch is in memory and there is no
+    cursor kept open in the database between the batches
+
+    :param query: Query of the captures, with the filters applied
+    :param batch_size: Number of captures read at once
+    :return:
+    """
+    key = None
+    while True:
+        batch_query = _filter_keys(query, key, True) if key else query
+        captures = _order_keys(batch_query, True).limit(batch_size).all()
+        yield from captures
+        if len(captures) < batch_size:
+            return
+        key = get_capture_key(captures[-1])
@@ -0,0 +1,314 @@
+"""
+    Export of the captures as a ZIP or TAR archive built while it's sent. The captures are read from the database in
+    batches and their files in chunks, and they are written as stored entries, without compression, so the memory
+    used is the same for an export of a few captures or of several GB. Only the manifest of a TAR archive, that is
+    written before its entry, is spooled to a temp file when it's bigger than EXPORT_MANIFEST_SPOOL_SIZE.
+
+    The first entry of the archive is a manifest.csv with the id, camera, creation time and path of the captures,
+    followed by the captures with their relative path in the CAPTURES_DIR as name.
+"""
+import csv
+import io
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from functools import partial
+from typing import BinaryIO, Iterable, Iterator, List, Optional
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import func
+from werkzeug.security import safe_join
+from picamera_server import app
+from picamera_server.config.config import EXPORT_CHUNK_SIZE, EXPORT_BATCH_SIZE, EXPORT_MANIFEST_SPOOL_SIZE
+from picamera_server.models import CapturedImage
+from picamera_server.views.helpers.captures import iterate_captures
+
+EXPORT_FORMAT_ZIP = 'zip'
+EXPORT_FORMAT_TAR = 'tar'
+EXPORT_FORMATS = [EXPORT_FORMAT_ZIP, EXPORT_FORMAT_TAR]
+EXPORT_MIMETYPES = {
+    EXPORT_FORMAT_ZIP: 'application/zip',
+    EXPORT_FORMAT_TAR: 'application/x-tar'
+}
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = ['id', 'camera_id', 'created_at', 'path']
+# Permissions of the entries of the archives
+ENTRY_MODE = 0o644
+
+
+class _ArchiveBuffer(object):
+    """
+    Unseekable file where the archive is written, the written bytes are taken with pop to send them.
+    The archive writers need a file, with this one they write the archive as a stream
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = list()
+        # Bytes written since the start of the archive
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        """
+        :param data:
+        :return: Number of bytes written
+        """
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def pop(self) -> bytes:
+        """
+        Return the bytes written since the last pop
+        :return:
+        """
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class CapturesExport(object):
+    """
+    Archive of the captures of a query, iterate it to get the bytes of the archive.
+
+    The captures taken after the export is created are not exported, so the manifest and the captures of the archive
+    are the same even if the capture mode is running. The captures whose file is missing are listed in the manifest
+    but they are not in the archive, they are logged and counted in skipped.
+    """
+
+    def __init__(self, query: BaseQuery, captures_dir: str, archive_format: str = EXPORT_FORMAT_ZIP,
+                 chunk_size: int = EXPORT_CHUNK_SIZE, batch_size: int = EXPORT_BATCH_SIZE,
+                 manifest_spool_size: int = EXPORT_MANIFEST_SPOOL_SIZE):
+        """
+        :param query: Query of the captures to export, with the filters applied
+        :param captures_dir: Dir of the captures
+        :param archive_format: One of EXPORT_FORMATS
+        :param chunk_size: Bytes read from the capture files at once
+        :param batch_size: Number of captures read from the database at once
+        :param manifest_spool_size: Bytes of the TAR manifest kept in memory before spooling it to a temp file
+        :raises ValueError: If the format is not one of EXPORT_FORMATS
+        """
+        if archive_format not in EXPORT_FORMATS:
+            raise ValueError('Invalid export format {}, options: {}'.format(archive_format, EXPORT_FORMATS))
+
+        last_capture_id = query.with_entities(func.max(CapturedImage.id)).scalar() or 0
+        self.query = query.filter(CapturedImage.id <= last_capture_id)
+        self.captures_dir = captures_dir
+        self.archive_format = archive_format
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.manifest_spool_size = manifest_spool_size
+        self.exported = 0
+        self.skipped = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        """
+        Iterate the bytes of the archive, every chunk has at most about chunk_size bytes
+        :return:
+        """
+        buffer = _ArchiveBuffer()
+        write_archive = self._write_zip if self.archive_format == EXPORT_FORMAT_ZIP else self._write_tar
+        # The writers stop after writing every chunk, so the written bytes are sent before reading the next one
+        for _ in write_archive(buffer):
+            data = buffer.pop()
+            if data:
+                yield data
+        data = buffer.pop()
+        if data:
+            yield data
+
+    def _iterate_captures(self) -> Iterator[CapturedImage]:
+        """
+        Iterate the captures of the export
+        :return:
+        """
+        return iterate_captures(self.query, self.batch_size)
+
+    def _iterate_manifest(self) -> Iterator[bytes]:
+        """
+        Iterate the lines of the manifest, in chunks of about chunk_size bytes
+        :return:
+        """
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(MANIFEST_FIELDS)
+        for capture in self._iterate_captures():
+            writer.writerow([capture.id, capture.camera_id, capture.created_at.isoformat(),
+                             _get_entry_name(capture)])
+            if output.tell() >= self.chunk_size:
+                yield output.getvalue().encode()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue().encode()
+
+    def _spool_manifest(self) -> BinaryIO:
+        """
+        Write the manifest in a spooled temp file, in memory until it takes manifest_spool_size bytes,
+        the file is returned at its start
+
+        :return:
+        """
+        manifest = tempfile.SpooledTemporaryFile(max_size=self.manifest_spool_size)
+        for data in self._iterate_manifest():
+            manifest.write(data)
+        manifest.seek(0)
+        return manifest
+
+    def _open_capture(self, capture: CapturedImage) -> Optional[BinaryIO]:
+        """
+        Open the file of a capture, None if it's missing
+
+        :param capture:
+        :return:
+        """
+        capture_path = safe_join(self.captures_dir, _get_entry_name(capture))
+        try:
+            if not capture_path:
+                raise FileNotFoundError(capture.relative_path)
+            return open(capture_path, 'rb')
+        except FileNotFoundError:
+            app.logger.warning('Capture file {} not found, not exported'.format(capture.relative_path))
+            self.skipped += 1
+            return None
+
+    def _iterate_capture_file(self, capture_file: BinaryIO) -> Iterator[bytes]:
+        """
+        Iterate the bytes of a capture file, or of the spooled manifest, in chunks of chunk_size bytes
+
+        :param capture_file:
+        :return:
+        """
+        return iter(partial(capture_file.read, self.chunk_size), b'')
+
+    def _write_zip(self, buffer: _ArchiveBuffer) -> Iterator[None]:
+        """
+        Write the ZIP archive in the buffer, stopping after every chunk.
+        The buffer is unseekable, so the sizes and CRC of the entries are written after them in data descriptors.
+        ZIP64 records are added when the archive is bigger than 4 GB
+
+        :param buffer:
+        :return:
+        """
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            with archive.open(_get_zip_info(MANIFEST_NAME, datetime.now()), 'w') as entry:
+                for data in self._iterate_manifest():
+                    entry.write(data)
+                    yield
+
+            for capture in self._iterate_captures():
+                capture_file = self._open_capture(capture)
+                if not capture_file:
+                    continue
+                zip_info = _get_zip_info(_get_entry_name(capture), capture.created_at)
+                zip_info.file_size = os.fstat(capture_file.fileno()).st_size
+                with capture_file, archive.open(zip_info, 'w') as entry:
+                    for data in self._iterate_capture_file(capture_file):
+                        entry.write(data)
+                        yield
+                self.exported += 1
+                yield
+
+    def _write_tar(self, buffer: _ArchiveBuffer) -> Iterator[None]:
+        """
+        Write the TAR archive in the buffer, stopping after every chunk.
+        The header of an entry has its size, so the manifest is generated once in a spooled file and written with
+        its size, captures removed while the archive is sent can't change it
+
+        :param buffer:
+        :return:
+        """
+        with self._spool_manifest() as manifest:
+            manifest_size = manifest.seek(0, io.SEEK_END)
+            manifest.seek(0)
+            manifest_info = _get_tar_info(MANIFEST_NAME, time.time(), manifest_size)
+            yield from _write_tar_entry(buffer, manifest_info, self._iterate_capture_file(manifest))
+
+        for capture in self._iterate_captures():
+            capture_file = self._open_capture(capture)
+            if not capture_file:
+                continue
+            with capture_file:
+                tar_info = _get_tar_info(_get_entry_name(capture), capture.created_at.timestamp(),
+                                         os.fstat(capture_file.fileno()).st_size)
+                yield from _write_tar_entry(buffer, tar_info, self._iterate_capture_file(capture_file))
+            self.exported += 1
+
+        # End of archive, two empty blocks and the padding of the last record
+        buffer.write(tarfile.NUL * tarfile.BLOCKSIZE * 2)
+        remainder = buffer.size % tarfile.RECORDSIZE
+        if remainder:
+            buffer.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+        yield
+
+
+def _get_entry_name(capture: CapturedImage) -> str:
+    """
+    Return the name of a capture in the archive, its relative path
+    :param capture:
+    :return:
+    """
+    # Replace for windows testing env
+    return capture.relative_path.replace('\\', '/')
+
+
+def _get_zip_info(name: str, modified_at: datetime) -> zipfile.ZipInfo:
+    """
+    Return the info of a stored ZIP entry
+
+    :param name:
+    :param modified_at: Modification time of the entry
+    :return:
+    """
+    zip_info = zipfile.ZipInfo(name, date_time=modified_at.timetuple()[:6])
+    zip_info.compress_type = zipfile.ZIP_STORED
+    zip_info.external_attr = ENTRY_MODE << 16
+    return zip_info
+
+
+def _get_tar_info(name: str, modified_at: float, size: int) -> tarfile.TarInfo:
+    """
+    Return the info of a TAR file entry
+
+    :param name:
+    :param modified_at: Modification time of the entry, unix time
+    :param size: Bytes of the entry
+    :return:
+    """
+    tar_info = tarfile.TarInfo(name)
+    tar_info.mtime = modified_at
+    tar_info.size = size
+    tar_info.mode = ENTRY_MODE
+    return tar_info
+
+
+def _write_tar_entry(buffer: _ArchiveBuffer, tar_info: tarfile.TarInfo, chunks: Iterable[bytes]) -> Iterator[None]:
+    """
+    Write a TAR entry in the buffer, its header, its chunks and the padding of its last block, stopping after every
+    chunk
+
+    :param buffer:
+    :param tar_info: Info of the entry, with its size
+    :param chunks: Bytes of the entry
+    :raises OSError: If the chunks don't have the size of the entry, the archive would be corrupted
+    :return:
+    """
+    buffer.write(tar_info.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING, 'surrogateescape'))
+    written = 0
+    for data in chunks:
+        written += len(data)
+        if written > tar_info.size:
+            break
+        buffer.write(data)
+        yield
+    if written != tar_info.size:
+        raise OSError('Size of {} changed while it was exported'.format(tar_info.name))
+
+    remainder = tar_info.size % tarfile.BLOCKSIZE
+    if remainder:
+        buffer.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+    yield
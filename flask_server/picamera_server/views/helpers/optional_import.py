@@ -0,0 +1,22 @@
+"""
+Import of the optional dependencies, ex. numpy, the features that need them are disabled when they are missing
+"""
+import importlib
+from types import ModuleType
+from typing import Optional
+from picamera_server import app
+
+
+def import_optional(module_name: str) -> Optional[ModuleType]:
+    """
+    Import an optional dependency, a missing module is logged instead of raising
+
+    :param module_name: Name of the module, ex. 'numpy'
+    :return: The module, None if it's not installed
+    """
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        app.logger.warning('Optional dependency {} not imported, the features that need it are disabled: {}'.format(
+            module_name, e))
+        return None
@@ -0,0 +1,345 @@
+"""
+    Timelapses of the captures built while they are sent, without encoding the captures again: the JPEG captures are
+    the frames of an MJPEG stream that the browsers play, or of an MJPEG AVI file.
+
+    The capture files are read in order by a prefetch thread, that keeps up to TIMELAPSE_PREFETCH_FRAMES files read
+    ahead of the sent frame, so the response doesn't wait for the SD card and the first frames are sent while the
+    rest of the range is still being read.
+"""
+import os
+import struct
+import threading
+from array import array
+from collections import deque
+from typing import Deque, Iterator, Optional
+from flask_sqlalchemy import BaseQuery
+from PIL import Image
+from sqlalchemy import func
+from werkzeug.security import safe_join
+from picamera_server import app, db
+from picamera_server.camera.base_camera import Camera, FramePacer
+from picamera_server.config.config import TIMELAPSE_FPS, TIMELAPSE_PREFETCH_FRAMES, EXPORT_BATCH_SIZE
+from picamera_server.models import CapturedImage
+from picamera_server.views.helpers.captures import iterate_captures
+
+TIMELAPSE_FORMAT_AVI = 'avi'
+TIMELAPSE_FORMAT_MJPEG = 'mjpeg'
+TIMELAPSE_FORMATS = [TIMELAPSE_FORMAT_AVI, TIMELAPSE_FORMAT_MJPEG]
+
+MIME_TYPE_AVI = 'video/x-msvideo'
+
+# AVI 1.0 files have 32 bits sizes
+AVI_MAX_SIZE = 2 ** 32 - 1
+AVI_FRAME_CHUNK_ID = b'00dc'
+# Flags of the main header and the index entries
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+# Bytes of the header lists and of an index entry
+AVI_HEADER_SIZE = 224
+AVI_INDEX_ENTRY_SIZE = 16
+# Index entries sent in a chunk
+AVI_INDEX_ENTRIES_CHUNK = 4096
+
+
+def iterate_timelapse_captures(query: BaseQuery, step: int = 1,
+                               batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[CapturedImage]:
+    """
+    Iterate the captures of a timelapse, one of every step captures in order of creation
+
+    :param query: Query of the captures, with the filters applied
+    :param step: Number of captures per frame of the timelapse
+    :param batch_size: Number of captures read from the database at once
+    :return:
+    """
+    for index, capture in enumerate(iterate_captures(query, batch_size)):
+        if index % step == 0:
+            yield capture
+
+
+def _get_capture_path(captures_dir: str, capture: CapturedImage) -> Optional[str]:
+    """
+    Return the path of the file of a capture, None if it's missing
+
+    :param captures_dir:
+    :param capture:
+    :return:
+    """
+    # Replace for windows testing env
+    capture_path = safe_join(captures_dir, capture.relative_path.replace('\\', '/'))
+    if not capture_path or not os.path.isfile(capture_path):
+        app.logger.warning('Capture file {} not found, not added to the timelapse'.format(capture.relative_path))
+        return None
+    return capture_path
+
+
+def _read_capture(capture_path: str) -> bytes:
+    """
+    Read the file of a capture, the OS is told that it's read sequentially so it reads ahead with a bigger window
+
+    :param capture_path:
+    :return:
+    """
+    with open(capture_path, 'rb') as capture_file:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(capture_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return capture_file.read()
+
+
+class CapturesPrefetcher(object):
+    """
+    Thread that reads the capture files of a timelapse ahead of the sent frames, in order of creation.
+    Up to max_frames files are kept read, the thread waits when the consumer is slower than the SD card.
+
+    The thread reads the captures from the database with its own session.
+    Iterate the prefetcher to get the frames, and close it to stop the thread when the response is closed.
+    """
+
+    def __init__(self, query: BaseQuery, captures_dir: str, step: int = 1,
+                 max_frames: int = TIMELAPSE_PREFETCH_FRAMES, batch_size: int = EXPORT_BATCH_SIZE):
+        """
+        :param query: Query of the captures, with the filters applied
+        :param captures_dir: Dir of the captures
+        :param step: Number of captures per frame of the timelapse
+        :param max_frames: Max number of frames read ahead
+        :param batch_size: Number of captures read from the database at once
+        """
+        self.query = query
+        self.captures_dir = captures_dir
+        self.step = step
+        self.max_frames = max(max_frames, 1)
+        self.batch_size = batch_size
+        self.frames: Deque[bytes] = deque()
+        self.condition = threading.Condition()
+        self.reader_thread: Optional[threading.Thread] = None
+        # All the frames were read, or the reader failed with error
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.closed = False
+
+    def start(self) -> None:
+        """
+        Start the reader thread
+
+        :return:
+        """
+        self.reader_thread = threading.Thread(target=self.reader, name='captures-prefetcher', daemon=True)
+        self.reader_thread.start()
+
+    def close(self) -> None:
+        """
+        Stop the reader thread, the frames read ahead are discarded
+
+        :return:
+        """
+        with self.condition:
+            self.closed = True
+            self.frames.clear()
+            self.condition.notify_all()
+
+    def _put(self, frame: bytes) -> bool:
+        """
+        Add a read frame, waiting for room when there are max_frames read ahead
+
+        :param frame:
+        :return: False if the prefetcher was closed
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.frames) < self.max_frames or self.closed)
+            if self.closed:
+                return False
+            self.frames.append(frame)
+            self.condition.notify_all()
+            return True
+
+    def reader(self) -> None:
+        """
+        Reader thread, read the capture files until all of them are read or the prefetcher is closed
+
+        :return:
+        """
+        try:
+            query = self.query.with_session(db.session())
+            for capture in iterate_timelapse_captures(query, self.step, self.batch_size):
+                capture_path = _get_capture_path(self.captures_dir, capture)
+                if capture_path and not self._put(_read_capture(capture_path)):
+                    return
+        except Exception as e:
+            app.logger.exception('Exception reading the timelapse captures {}'.format(e))
+            self.error = e
+        finally:
+            db.session.remove()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def __iter__(self) -> Iterator[bytes]:
+        """
+        Iterate the frames in order of creation, waiting for the reader when there are no frames read
+
+        :raises Exception: The exception of the reader, after the frames read before it
+        :return:
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.frames or self.done)
+                if not self.frames:
+                    if self.error:
+                        raise self.error
+                    return
+                frame = self.frames.popleft()
+                self.condition.notify_all()
+            yield frame
+
+
+class Timelapse(object):
+    """
+    Timelapse of the captures of a query, one frame for every step captures.
+
+    The captures taken after the timelapse is created are not added, so the frames counted for the AVI header are
+    the frames sent. The captures whose file is missing are skipped.
+    """
+
+    def __init__(self, query: BaseQuery, captures_dir: str, step: int = 1, fps: float = TIMELAPSE_FPS,
+                 prefetch_frames: int = TIMELAPSE_PREFETCH_FRAMES, batch_size: int = EXPORT_BATCH_SIZE):
+        """
+        :param query: Query of the captures, with the filters applied
+        :param captures_dir: Dir of the captures
+        :param step: Number of captures per frame
+        :param fps: Frames per second of the timelapse
+        :param prefetch_frames: Max number of frames read ahead
+        :param batch_size: Number of captures read from the database at once
+        """
+        self.last_capture_id = query.with_entities(func.max(CapturedImage.id)).scalar() or 0
+        self.query = query.filter(CapturedImage.id <= self.last_capture_id)
+        self.captures_dir = captures_dir
+        self.step = max(step, 1)
+        self.fps = fps
+        self.prefetch_frames = prefetch_frames
+        self.batch_size = batch_size
+        # Sizes of the frames and resolution of the AVI, set by scan_avi
+        self.frames_sizes = array('L')
+        self.width = 0
+        self.height = 0
+
+    def iterate_frames(self) -> Iterator[bytes]:
+        """
+        Iterate the frames of the timelapse, read by a prefetcher
+        :return:
+        """
+        prefetcher = CapturesPrefetcher(self.query, self.captures_dir, self.step, self.prefetch_frames,
+                                        self.batch_size)
+        prefetcher.start()
+        try:
+            yield from prefetcher
+        finally:
+            prefetcher.close()
+
+    def iterate_mjpeg(self) -> Iterator[bytes]:
+        """
+        Iterate the chunks of the --frame (image/jpeg) parts of a multipart response, sent at the timelapse fps
+        limited to STREAM_MAX_FPS
+        :return:
+        """
+        pacer = FramePacer(self.fps)
+        for frame in self.iterate_frames():
+            pacer.wait()
+            yield from Camera._get_multipart_frame(frame)
+
+    def scan_avi(self) -> int:
+        """
+        Read the sizes of the frames and the resolution of the first one, needed by the header of the AVI.
+        Only the sizes of the files are read, the files are read when the AVI is sent
+
+        :raises ValueError: If the AVI is bigger than AVI_MAX_SIZE
+        :return: Bytes of the AVI, 0 if there are no frames
+        """
+        self.frames_sizes = array('L')
+        for capture in iterate_timelapse_captures(self.query, self.step, self.batch_size):
+            capture_path = _get_capture_path(self.captures_dir, capture)
+            if not capture_path:
+                continue
+            if not self.frames_sizes:
+                with Image.open(capture_path) as image:
+                    self.width, self.height = image.size
+            self.frames_sizes.append(os.path.getsize(capture_path))
+        if not self.frames_sizes:
+            return 0
+
+        avi_size = AVI_HEADER_SIZE + self._get_frames_chunks_size() + 8 + len(self.frames_sizes) * AVI_INDEX_ENTRY_SIZE
+        if avi_size > AVI_MAX_SIZE:
+            raise ValueError('The timelapse takes {} bytes, more than the max size of an AVI {}'.format(avi_size,
+                                                                                                      AVI_MAX_SIZE))
+        return avi_size
+
+    def _get_frames_chunks_size(self) -> int:
+        """
+        Return the bytes of the chunks of the frames, with their ids, sizes and padding to even sizes
+        :return:
+        """
+        return sum(8 + frame_size + frame_size % 2 for frame_size in self.frames_sizes)
+
+    def _get_avi_header(self) -> bytes:
+        """
+        Return the RIFF header of the AVI, the main header, the stream header of the MJPEG frames and the start of
+        the movi list of the frames
+        :return:
+        """
+        frames = len(self.frames_sizes)
+        max_frame_size = max(self.frames_sizes)
+        frames_chunks_size = self._get_frames_chunks_size()
+        riff_size = AVI_HEADER_SIZE - 8 + frames_chunks_size + 8 + frames * AVI_INDEX_ENTRY_SIZE
+        fps_scale = 1000
+
+        main_header = struct.pack('<4sI10I4I', b'avih', 56, round(1000000 / self.fps),
+                                  round(max_frame_size * self.fps), 0, AVIF_HASINDEX, frames, 0, 1, max_frame_size,
+                                  self.width, self.height, 0, 0, 0, 0)
+        stream_header = struct.pack('<4sI4s4sIHHIIIIIIiI4h', b'strh', 56, b'vids', b'MJPG', 0, 0, 0, 0,
+                                    fps_scale, round(self.fps * fps_scale), 0, frames, max_frame_size, -1, 0,
+                                    0, 0, self.width, self.height)
+        stream_format = struct.pack('<4sIIiiHH4sIiiII', b'strf', 40, 40, self.width, self.height, 1, 24, b'MJPG',
+                                    self.width * self.height * 3, 0, 0, 0, 0)
+        stream_list = struct.pack('<4sI4s', b'LIST', 4 + len(stream_header) + len(stream_format), b'strl')
+        header_list = struct.pack('<4sI4s', b'LIST', 4 + len(main_header) + len(stream_list) + len(stream_header)
+                                  + len(stream_format), b'hdrl')
+        movi_list = struct.pack('<4sI4s', b'LIST', 4 + frames_chunks_size, b'movi')
+        return b''.join([struct.pack('<4sI4s', b'RIFF', riff_size, b'AVI '), header_list, main_header, stream_list,
+                         stream_header, stream_format, movi_list])
+
+    def _iterate_avi_index(self) -> Iterator[bytes]:
+        """
+        Iterate the chunks of the idx1 index of the frames, the offsets are relative to the movi list id
+        :return:
+        """
+        yield struct.pack('<4sI', b'idx1', len(self.frames_sizes) * AVI_INDEX_ENTRY_SIZE)
+        entries = list()
+        offset = 4
+        for frame_size in self.frames_sizes:
+            entries.append(struct.pack('<4sIII', AVI_FRAME_CHUNK_ID, AVIIF_KEYFRAME, offset, frame_size))
+            offset += 8 + frame_size + frame_size % 2
+            if len(entries) >= AVI_INDEX_ENTRIES_CHUNK:
+                yield b''.join(entries)
+                entries.clear()
+        if entries:
+            yield b''.join(entries)
+
+    def iterate_avi(self) -> Iterator[bytes]:
+        """
+        Iterate the chunks of the MJPEG AVI, scan_avi must be called before.
+        Every frame is a chunk of the movi list followed by the index of the frames
+
+        :raises OSError: If the frames don't have the scanned sizes, the AVI would be corrupted
+        :return:
+        """
+        yield self._get_avi_header()
+        frames = 0
+        for frame in self.iterate_frames():
+            if frames >= len(self.frames_sizes) or len(frame) != self.frames_sizes[frames]:
+                raise OSError('Capture files of the timelapse changed while it was sent')
+            yield struct.pack('<4sI', AVI_FRAME_CHUNK_ID, len(frame))
+            yield frame
+            if len(frame) % 2:
+                yield b'\x00'
+            frames += 1
+        if frames != len(self.frames_sizes):
+            raise OSError('Capture files of the timelapse changed while it was sent')
+        yield from self._iterate_avi_index()
@@ -0,0 +1,25 @@
+from picamera_server.metrics.registry import get_metrics_registry, CONTENT_TYPE_LATEST
+from flask import Blueprint, Response
+
+
+metrics = Blueprint('metrics', __name__)
+
+METRICS = 'METRICS'
+ENDPOINTS = {
+    METRICS: '/metrics',
+}
+
+
+@metrics.route(ENDPOINTS[METRICS], methods=['GET'])
+def get_metrics():
+    """
+    Metrics of the camera, the streams and the capture pipeline in the Prometheus text exposition format.
+    The endpoint doesn't require log in so it can be scraped by Prometheus
+
+    GET
+    responses:
+        200:
+            description: text/plain; version=0.0.4
+    :return:
+    """
+    return Response(get_metrics_registry().generate_latest(), content_type=CONTENT_TYPE_LATEST)
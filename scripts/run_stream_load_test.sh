@@ -0,0 +1,6 @@
+# This script must be called from the root folder ./raspberry-cam
+# Move to the project folder
+cd ./flask_server
+# This script must be runned after install_server_requirements.sh
+# The arguments are passed to the load test, ex. --clients 20 --duration 60 --server async
+python3 -m pipenv run python -m benchmarks.stream_load_test "$@"